@@ -1,9 +1,14 @@
 """Module for creating basic config files."""
 import os
 import constants as c
+from config_files import template_text, write_if_changed
 
 def make_basic_config(match_filename, year, period, single: bool):
-    """Make a basic config file."""
+    """
+    Make a basic config file.
+
+    Returns (filename, whether it changed).
+    """
     # get the right template
     if single:
         basic_template_file_path = c.SM_BASIC_CONFIG_TEMPLATE
@@ -11,8 +16,7 @@ def make_basic_config(match_filename, year, period, single: bool):
         basic_template_file_path = c.ML_BASIC_CONFIG_TEMPLATE
 
     # get its text
-    with open(basic_template_file_path, "r", encoding="utf-8") as basic_file:
-        basic_template_text = basic_file.read()
+    basic_template_text = template_text(basic_template_file_path)
 
     # input detector regions file path
     basic_template_text = basic_template_text.replace(
@@ -27,6 +31,5 @@ def make_basic_config(match_filename, year, period, single: bool):
     # get filename and save
     fmt = c.SM_BASIC_CONFIG_PATH_FMT if single else c.ML_BASIC_CONFIG_PATH_FMT
     basic_filename = fmt.format(year=year, period=period)
-    with open(basic_filename, "w", encoding="utf-8") as basic_file:
-        basic_file.write(basic_file_text)
-    return basic_filename
+    changed = write_if_changed(basic_filename, basic_file_text)
+    return basic_filename, changed
@@ -0,0 +1,268 @@
+"""
+Benchmark for the SF computation in make_2d_eff, without real ntuples.
+
+python benchmark_sf.py [-n 3] [--output benchmarks.jsonl]
+
+Synthetic probe and match hists (eta-phi binning, Poisson probe counts,
+weighted MC) are written for every quality, region and trigger of one
+period, for data and MC of every variation in constants.VARIATIONS. Then
+the same steps make_2d_eff takes for a whole period are run over them,
+with make_2d_eff's own functions, and the time spent in each stage (as
+timed by instrumentation), and the peak memory use, are reported:
+    open      actually opening each input, the first time it's read
+    find      find_selections
+    fetch     getting the probe and match hists, for every selection
+    compute   compute_eff_arrays, for every selection
+    hists     making the output hists (only if ROOT can be imported)
+    write     writing them to a ROOT file (likewise)
+
+If ROOT can be imported, the inputs are written as ROOT files of TH2Ds and
+converted with wtph_columnar.convert, and each reader is benchmarked.
+Otherwise they're written straight to the columnar format, with the same
+keys convert would give them. Columnar reads are memory-mapped, so most of their actual
+reading shows up under compute rather than fetch.
+With --output, results are appended as a JSON line (with the git revision)
+so they can be compared over time.
+"""
+from __future__ import print_function
+import json
+import optparse
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import logging
+import numpy as np
+import constants as c
+import instrumentation
+from eff_engine import binning_shape, empty_hist, fill_hist
+from make_2d_eff import (close_input_files, compute_selection,
+                         find_selections, input_filepath_fmt,
+                         open_input_files, selection_hist_paths,
+                         write_selection_outputs)
+from triggers import triggers_in_period
+from wtph_columnar import columnar_path, convert, hist_key, write_columnar
+
+STAGES = ["open", "find", "fetch", "compute", "hists", "write"]
+YEAR = "18"
+PERIOD = "B"
+TRIGGER_TYPE = "SingleMuonTriggers"
+
+
+def peak_rss_mb():
+    """Peak resident memory of this process so far, in MB."""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.
+
+
+def git_revision():
+    """Current git revision, None if we can't tell."""
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"],
+            stderr=subprocess.STDOUT).decode("utf-8").strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def synthetic_pair(rng, shape, mean_probes, eff_shift, weighted):
+    """
+    (probe record fields, match record fields) for one hist pair:
+    Poisson probe counts, binomial matches, optionally with per-bin weights.
+    """
+    probe_counts = rng.poisson(mean_probes, size=shape)
+    eff = np.clip(rng.uniform(0.6, 0.95, size=shape) + eff_shift, 0, 1)
+    match_counts = rng.binomial(probe_counts, eff)
+    if weighted:
+        weights = rng.uniform(0.8, 1.2, size=shape)
+    else:
+        weights = np.ones(shape)
+    return [{"contents": (counts * weights).ravel(),
+             "sumw2": (counts * weights**2).ravel()}
+            for counts in [probe_counts, match_counts]]
+
+
+def write_root_inputs(root_path, records):
+    """Write hist records (see write_columnar) to a ROOT file of TH2s."""
+    from ROOT import TFile
+    root_file = TFile(root_path, "recreate")
+    for hist_path, record in sorted(records.items()):
+        directory, name = hist_path.rsplit("/", 1)
+        root_file.mkdir(directory, "", True)
+        root_file.cd(directory)
+        hist = fill_hist(empty_hist(record, name), record["contents"])
+        sumw2 = hist.GetSumw2()
+        np.frombuffer(sumw2.GetArray(), dtype=np.float64,
+                      count=sumw2.GetSize())[:] = record["sumw2"]
+        hist.Write()
+    root_file.Close()
+
+
+def make_inputs(input_dir, n_eta, n_phi, mean_probes, use_root, seed=0):
+    """
+    Write synthetic columnar inputs for a whole period, keyed the way
+    wtph_columnar.convert keys them (if use_root, ROOT ones are written
+    and actually converted).
+
+    Returns the number of selections (quality, region, trigger) in them.
+    """
+    rng = np.random.RandomState(seed)
+    binning = {
+        "class_name": "TH2D", "title": "",
+        "x_edges": np.linspace(-2.5, 2.5, n_eta + 1), "x_title": "#eta",
+        "y_edges": np.linspace(-np.pi, np.pi, n_phi + 1), "y_title": "#phi"}
+    shape = binning_shape(binning)
+    triggers = triggers_in_period(
+        TRIGGER_TYPE == "SingleMuonTriggers", int("20" + YEAR), PERIOD)
+    selections = [(quality, region, trigger)
+                  for quality in c.WORKING_POINTS
+                  for region in c.DETECTOR_REGIONS
+                  for trigger in triggers]
+
+    var_conf_fmt = input_filepath_fmt(
+        input_dir, YEAR, PERIOD, c.NTUPLE_VERSION, TRIGGER_TYPE)
+    for data_mc in ["data", "mc"]:
+        for variation in c.VARIATIONS:
+            eff_shift = rng.normal(0, 0.01)
+            records = {}
+            for quality, region, trigger in selections:
+                paths = selection_hist_paths(quality, region, trigger)
+                pair = synthetic_pair(rng, shape, mean_probes, eff_shift,
+                                      weighted=(data_mc == "mc"))
+                for path, fields in zip(paths, pair):
+                    record = dict(binning)
+                    record.update(fields)
+                    # (a hist's directory and name, as walk_hists joins them)
+                    records[hist_key(*path.rsplit("/", 1))] = record
+            root_path = var_conf_fmt.format(
+                data_mc=data_mc, variation=variation)
+            if use_root:
+                write_root_inputs(root_path, records)
+                convert(root_path)
+            else:
+                write_columnar(columnar_path(root_path), records,
+                               os.path.basename(root_path), [0, 0])
+    return len(selections)
+
+
+def run_pipeline(input_dir, output_path, columnar, use_root):
+    """
+    Run the make_2d_eff steps for the period, reading the columnar or ROOT
+    inputs, return {stage: seconds}.
+    """
+    # (just in case anything was left over from another run)
+    instrumentation.take_records()
+    with instrumentation.scope(columnar=columnar) as record:
+        var_conf_fmt = input_filepath_fmt(
+            input_dir, YEAR, PERIOD, c.NTUPLE_VERSION, TRIGGER_TYPE)
+        input_files = open_input_files(var_conf_fmt, columnar=columnar)
+        with instrumentation.timer("find"):
+            selections = find_selections(
+                input_files["data"]["nominal"], YEAR, PERIOD, TRIGGER_TYPE)
+
+        out_file = None
+        if use_root:
+            from ROOT import TFile
+            out_file = TFile(output_path, "recreate")
+        for quality, region, trigger in selections:
+            binning, results = compute_selection(
+                input_files, quality, region, trigger, make_sf_plots=True,
+                print_sf_values=True)
+            if use_root:
+                write_selection_outputs(
+                    out_file, None, YEAR, PERIOD, region, trigger, quality,
+                    binning, results, os.path.dirname(output_path),
+                    print_sf_values=False)
+        if use_root:
+            out_file.Close()
+        close_input_files(input_files)
+    instrumentation.take_records()
+    return record["seconds"]
+
+
+def get_options():
+    """Get options from the command line."""
+    parser = optparse.OptionParser()
+    # how many times to run the pipeline over the same inputs
+    parser.add_option('-n', '--repeat', type='int', default=3,
+                      dest='repeat')
+    # number of eta and phi bins of the synthetic hists
+    parser.add_option('--nEta', type='int', default=50, dest='nEta')
+    parser.add_option('--nPhi', type='int', default=64, dest='nPhi')
+    # mean number of probes per bin
+    parser.add_option('--meanProbes', type='float', default=2000.,
+                      dest='meanProbes')
+    # where to put the synthetic inputs (default: a temporary directory)
+    parser.add_option('--workDir', type='string', default=None,
+                      dest='workDir')
+    # append the results to this file, as a JSON line
+    parser.add_option('-o', '--output', type='string', default=None,
+                      dest='output')
+    (options, _) = parser.parse_args()
+    return options
+
+
+def main():
+    """Make synthetic inputs, run the pipeline over them and report."""
+    options = get_options()
+    logging.basicConfig(stream=sys.stdout, level=logging.WARNING)
+    try:
+        import ROOT  # pylint: disable=unused-import
+        use_root = True
+    except ImportError:
+        use_root = False
+        print("ROOT not available, not timing hist filling or writing")
+
+    work_dir = options.workDir or tempfile.mkdtemp(prefix="benchmark_sf_")
+    if not os.path.exists(work_dir):
+        os.makedirs(work_dir)
+    try:
+        start = time.time()
+        n_selections = make_inputs(
+            work_dir, options.nEta, options.nPhi, options.meanProbes,
+            use_root)
+        print("Made inputs for {} selections x {} variations in {:.1f} s"
+              .format(n_selections, len(c.VARIATIONS), time.time() - start))
+
+        readers = {"columnar": True}
+        if use_root:
+            readers["root"] = False
+        runs = {reader: [run_pipeline(
+            work_dir, os.path.join(work_dir, "out.root"), columnar, use_root)
+                         for _ in range(options.repeat)]
+                for reader, columnar in readers.items()}
+    finally:
+        if options.workDir is None:
+            shutil.rmtree(work_dir)
+
+    summary = {}
+    for reader in sorted(runs):
+        summary[reader] = {}
+        print("{} inputs:".format(reader))
+        print("{:<10}{:>12}{:>12}".format("stage", "mean [s]", "min [s]"))
+        for stage in STAGES:
+            times = [run[stage] for run in runs[reader] if stage in run]
+            if times:
+                summary[reader][stage] = {"mean": float(np.mean(times)),
+                                          "min": float(np.min(times))}
+                print("{:<10}{:>12.4f}{:>12.4f}".format(
+                    stage, summary[reader][stage]["mean"],
+                    summary[reader][stage]["min"]))
+    print("Peak RSS: {:.1f} MB".format(peak_rss_mb()))
+
+    if options.output is not None:
+        result = {
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "revision": git_revision(),
+            "n_selections": n_selections, "n_eta": options.nEta,
+            "n_phi": options.nPhi, "mean_probes": options.meanProbes,
+            "repeat": options.repeat, "stages": summary,
+            "peak_rss_mb": peak_rss_mb()}
+        with open(options.output, "a") as out:
+            out.write(json.dumps(result, sort_keys=True) + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+"""
+Script for checking a merged WTPH output against the single-variation ones.
+
+python check_merged_outputs.py -i [WTPH output directory] -y [year]
+-p [period] -T [trigger type] -v [version] [--columnar]
+
+Moving a variation's global cuts into its selection blocks (see
+merged_config) must select the same probes as running that variation on
+its own. This reads every selection of every variation, for data and MC,
+from the standalone outputs and from the merged output (as make_2d_eff
+--merged would), and checks that they have the same selections and the
+same probe and match hists, bin by bin (contents and sumw2).
+Run it on a period before using --merged for it, after running WTPH with
+both that period's variation configs and its merged config. Every
+difference is listed, and the exit status is 1 if there were any.
+"""
+from __future__ import print_function
+import logging
+import optparse
+import sys
+import numpy as np
+import constants as c
+from make_2d_eff import (close_input_files, find_selections,
+                         input_filepath_fmt, open_input_files,
+                         selection_hist_paths)
+
+# (the same events filled in the same order, but just in case)
+RTOL = 1e-9
+
+
+def hist_problems(standalone, merged, hist_path):
+    """Differences between one hist of two outputs, as a list of strings."""
+    problems = []
+    standalone_hist = standalone.hist(hist_path)
+    merged_hist = merged.hist(hist_path)
+    for field in ["x_edges", "y_edges", "contents", "sumw2"]:
+        if not np.allclose(standalone_hist[field], merged_hist[field],
+                           rtol=RTOL, atol=0):
+            problems.append("{}: {} differs".format(hist_path, field))
+    return problems
+
+
+def variation_problems(standalone, merged, year, period, trigger_type):
+    """
+    Differences between a variation's standalone output and its part of
+    the merged output, as a list of strings.
+    """
+    standalone_selections = find_selections(
+        standalone, year, period, trigger_type)
+    merged_selections = find_selections(merged, year, period, trigger_type)
+    problems = ["{} {} {} only in the standalone output".format(*selection)
+                for selection in standalone_selections
+                if selection not in merged_selections]
+    problems += ["{} {} {} only in the merged output".format(*selection)
+                 for selection in merged_selections
+                 if selection not in standalone_selections]
+    for selection in standalone_selections:
+        if selection not in merged_selections:
+            continue
+        for hist_path in selection_hist_paths(*selection):
+            problems += hist_problems(standalone, merged, hist_path)
+    return problems
+
+
+def check_merged_outputs(var_conf_fmt, year, period, trigger_type,
+                         cache_dir=None, columnar=False):
+    """Differences for every variation, {(data_mc, variation): [problem]}."""
+    standalone_files = open_input_files(var_conf_fmt, cache_dir,
+                                        columnar=columnar)
+    merged_files = open_input_files(var_conf_fmt, cache_dir,
+                                    columnar=columnar, merged=True)
+    problems = {}
+    for data_mc in ["data", "mc"]:
+        for variation in c.VARIATIONS:
+            problems[(data_mc, variation)] = variation_problems(
+                standalone_files[data_mc][variation],
+                merged_files[data_mc][variation], year, period, trigger_type)
+    close_input_files(standalone_files)
+    close_input_files(merged_files)
+    return problems
+
+
+def get_options():
+    """Get options from the command line."""
+    parser = optparse.OptionParser()
+    # path to directory where the WTPH outputs are stored
+    parser.add_option('-i', '--inDir', type='string', default=None,
+                      dest='inDir')
+    # year: 15, 16, 17 or 18
+    parser.add_option('-y', '--year', type='string', default=None,
+                      dest='year')
+    # data period letter: A,B,C, etc.
+    parser.add_option('-p', '--period', type='string', default=None,
+                      dest='period')
+    # trigger type selection, SingleMuonTriggers or MultiLegTriggers
+    parser.add_option('-T', '--triggerType', type='string',
+                      default="SingleMuonTriggers", dest='triggerType')
+    # T&P NTuple Version e.g. v65.3.2 or v064
+    parser.add_option('-v', '--version', type='string',
+                      default=c.NTUPLE_VERSION, dest='version')
+    # directory of the hist cache (see hist_cache), none by default
+    parser.add_option('--cacheDir', type='string', default=None,
+                      dest='cacheDir')
+    # read inputs from their columnar versions (made by wtph_columnar.py)
+    parser.add_option('--columnar', action='store_true', default=False,
+                      dest='columnar')
+    (options, _) = parser.parse_args()
+    return options
+
+
+def main():
+    """Compare the outputs, list the differences."""
+    options = get_options()
+    logging.basicConfig(stream=sys.stdout, level=logging.INFO)
+    if None in [options.inDir, options.year, options.period]:
+        raise ValueError("Need -i, -y and -p!")
+    if options.triggerType not in c.TRIGGER_TYPES:
+        raise ValueError("Invalid trigger type! Use one of", c.TRIGGER_TYPES)
+
+    var_conf_fmt = input_filepath_fmt(
+        options.inDir, options.year, options.period, options.version,
+        options.triggerType)
+    problems = check_merged_outputs(
+        var_conf_fmt, options.year, options.period, options.triggerType,
+        options.cacheDir, options.columnar)
+    n_bad = 0
+    for (data_mc, variation), var_problems in sorted(problems.items()):
+        if var_problems:
+            n_bad += 1
+            for problem in var_problems:
+                print("{} {}: {}".format(data_mc, variation, problem))
+    print("{} of {} variations differ".format(n_bad, len(problems)))
+    sys.exit(1 if n_bad else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+"""
+Module for writing generated config files only when their contents change.
+
+Configs are rendered in memory and compared with what's already on disk,
+by hash, so configs that come out the same keep their modification time
+and the rest of the pipeline doesn't see them as stale.
+
+Templates are only read from disk once, however many configs use them.
+"""
+import hashlib
+import os
+
+# text of every template read so far, {path: text}
+_TEMPLATES = {}
+
+
+def template_text(path):
+    """Text of a template, only read from disk the first time."""
+    if path not in _TEMPLATES:
+        with open(path, "r", encoding="utf-8") as template_file:
+            _TEMPLATES[path] = template_file.read()
+    return _TEMPLATES[path]
+
+
+def content_hash(text):
+    """Hash of a config's text."""
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+def file_hash(path):
+    """Hash of a config file on disk, None if it doesn't exist."""
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as config_file:
+        return content_hash(config_file.read())
+
+
+def write_if_changed(path, text):
+    """
+    Write a config, unless the same text is already there.
+
+    Returns True if the file was (re)written. The text goes to a temp file
+    (unique to this process) first and is then renamed, so nothing ever
+    sees a half-written config.
+    """
+    if file_hash(path) == content_hash(text):
+        return False
+    tmp_path = "{}.{}.tmp".format(path, os.getpid())
+    with open(tmp_path, "w", encoding="utf-8") as config_file:
+        config_file.write(text)
+    os.replace(tmp_path, path)
+    return True
+
+
+def remove_stale(directories, keep_paths):
+    """
+    Remove files in directories that weren't generated this time round
+    (e.g. configs for a period that has been dropped).
+
+    Returns the list of removed paths.
+    """
+    keep_paths = {os.path.normpath(path) for path in keep_paths}
+    removed = []
+    for directory in directories:
+        for filename in sorted(os.listdir(directory)):
+            path = os.path.normpath(os.path.join(directory, filename))
+            if os.path.isfile(path) and path not in keep_paths:
+                os.remove(path)
+                removed.append(path)
+    return removed
@@ -14,6 +14,8 @@ ACCOUNT = "ctb-stelzer"  # slurm account
 RELEASE = "AthAnalysis,21.2.196"  # ATLAS software release you set up
 MAIL_USER = "your-email-here@example.com"  # what to use for job-related emails
 MAIL_TYPE = "ALL"  # how many emails do you want? BEGIN END FAIL REQUEUE ALL
+# rough WTPH run time per input ntuple file, for packing jobs (minutes)
+WTPH_MINUTES_PER_INPUT = 5
 
 # stuff for looping over
 YEARS = [2015, 2016, 2017, 2018]
@@ -35,11 +37,9 @@ TRIGGER_TYPES = ["SingleMuonTriggers", "MultiLegTriggers"]
 # template files -- SM = Single Muon, ML = Multi Leg
 DETECTOR_REGION_TEMPLATE = "templates/DetectorRegionsForZmumuReco.conf"
 SM_BASIC_CONFIG_TEMPLATE = "templates/SM_BasicConfigZMuon.conf"
-SM_NOMINAL_CONFIG_TEMPLATE = "templates/SM_nominal_template.conf"
 SM_PRE_NOMINAL_CONFIG_TEMPLATE = "templates/SM_pre_nominal_template.conf"
 SM_MATCHES_TEMPLATE = "templates/SM_MatchesForZmumuMuon.conf"
 ML_BASIC_CONFIG_TEMPLATE = "templates/ML_BasicConfigZMuon.conf"
-ML_NOMINAL_CONFIG_TEMPLATE = "templates/ML_nominal_template.conf"
 ML_PRE_NOMINAL_CONFIG_TEMPLATE = "templates/ML_pre_nominal_template.conf"
 ML_MATCHES_TEMPLATE = "templates/ML_MatchesForZmumuMuon.conf"
 
@@ -62,6 +62,16 @@ ML_VAR_CONFIG_PATH_FMT = os.path.join(
     MULTI_LEG_DIR,
     "MuonProbes_MultiLegTriggers_{variation}_{year}_{period}.conf")
 
+# configs with every variation in one WTPH pass (see merged_config)
+MERGED_VARIATION = "allVariations"
+SM_MERGED_CONFIG_PATH_FMT = SM_VAR_CONFIG_PATH_FMT.replace(
+    "{variation}", MERGED_VARIATION)
+ML_MERGED_CONFIG_PATH_FMT = ML_VAR_CONFIG_PATH_FMT.replace(
+    "{variation}", MERGED_VARIATION)
+
+# list of the configs that changed the last time they were made
+CHANGED_CONFIGS_PATH = "changed_configs.json"
+
 # Useful paths
 MTPPP_ROOT = os.path.realpath("../../../../../")
 MTPPP_DATA_PATH = os.path.join(
@@ -70,6 +80,8 @@ MTPPP_DATA_PATH = os.path.join(
 WTPH_OUTPUT_DIR = os.path.join(MTPPP_ROOT, "output")
 # where job scripts will be written
 WTPH_JOB_AREA = os.path.join(WTPH_OUTPUT_DIR, "WTPHJobFiles/")
+# top directory of every WTPH output
+WTPH_TOP_DIR = "ZmumuTPMerged"
 # where you submit your batch jobs from (cannot be in /home/)
 WTPH_SUBMIT_AREA = os.path.join("/scratch/", USER)
 # where the input conigs are read from
@@ -1,12 +1,14 @@
 """Module with a helper function for making directories."""
 
 import os
-import shutil
 from constants import SINGLE_MUON_DIR, MULTI_LEG_DIR
 
 def create_dirs():
-    """Get directories ready for config files."""
+    """
+    Get directories ready for config files.
+
+    Existing configs are left alone, they're only rewritten if they change.
+    """
     for directory in [SINGLE_MUON_DIR, MULTI_LEG_DIR]:
-        if os.path.exists(directory):
-            shutil.rmtree(directory)
-        os.mkdir(directory)
+        if not os.path.exists(directory):
+            os.mkdir(directory)
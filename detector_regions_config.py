@@ -1,7 +1,13 @@
 """Module for creating detector region configs. Currently just copies."""
-import shutil
+from config_files import template_text, write_if_changed
 from constants import DETECTOR_REGION_TEMPLATE, DETECTOR_REGIONS_SAVE_PATH
 
 def make_detector_regions_config():
-    """Just copy for now, maybe we'll edit it later?"""
-    shutil.copyfile(DETECTOR_REGION_TEMPLATE, DETECTOR_REGIONS_SAVE_PATH)
+    """
+    Just copy for now, maybe we'll edit it later?
+
+    Returns (filename, whether it changed).
+    """
+    text = template_text(DETECTOR_REGION_TEMPLATE)
+    changed = write_if_changed(DETECTOR_REGIONS_SAVE_PATH, text)
+    return DETECTOR_REGIONS_SAVE_PATH, changed
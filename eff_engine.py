@@ -0,0 +1,326 @@
+"""
+Module for computing 2D efficiencies and scale factors with NumPy.
+
+make_2d_eff used to loop over every bin of every variation, asking a
+TEfficiency for each value. Here the probe and match bin contents are pulled
+out of the histograms once and everything is done as whole-array operations.
+
+Arrays are always flat and laid out like ROOT's global bin numbering,
+i.e. global_bin = x + (nbins_x + 2) * y, so they can go straight back into a
+histogram with fill_hist.
+"""
+import numpy as np
+from scipy.special import betaincinv, ndtri
+
+# same as TEfficiency's default (1 sigma)
+CONF_LEVEL = 0.682689492137
+
+# isolation variations used to build the isolation envelope
+ISO_TIGHT = "isoTight_VarRad"
+ISO_PFLOW_TIGHT = "isoPflowTight_VarRad"
+
+# what hist_binning gives, enough to make an empty copy of a hist
+BINNING_FIELDS = ["class_name", "title", "x_edges", "x_title", "y_edges",
+                  "y_title"]
+
+# numpy types of the bin content buffers, by last letter of the class name
+_DTYPES = {
+    "C": np.int8,
+    "S": np.int16,
+    "I": np.int32,
+    "F": np.float32,
+    "D": np.float64,
+}
+
+
+def hist_arrays(hist):
+    """Return (contents, sumw2) of a histogram as flat float64 arrays."""
+    n_cells = hist.GetNcells()
+    dtype = _DTYPES[hist.ClassName()[-1]]
+    contents = np.frombuffer(
+        hist.GetArray(), dtype=dtype, count=n_cells).astype(np.float64)
+    if hist.GetSumw2N():
+        sumw2 = np.frombuffer(
+            hist.GetSumw2().GetArray(), dtype=np.float64,
+            count=n_cells).copy()
+    else:
+        # unweighted, so the sum of squared weights is just the content
+        sumw2 = contents.copy()
+    return contents, sumw2
+
+
+def fill_hist(hist, contents):
+    """Overwrite all bin contents of a histogram in one call."""
+    hist.SetContent(np.ascontiguousarray(contents, dtype=np.float64))
+    return hist
+
+
+def hist_binning(hist):
+    """Binning and titles of a 2D histogram, enough to make an empty copy."""
+    binning = {"class_name": hist.ClassName(), "title": hist.GetTitle()}
+    for name, axis in [("x", hist.GetXaxis()), ("y", hist.GetYaxis())]:
+        binning[name + "_edges"] = np.array([
+            axis.GetBinLowEdge(i) for i in range(1, axis.GetNbins() + 2)])
+        binning[name + "_title"] = axis.GetTitle()
+    return binning
+
+
+def record_binning(record):
+    """
+    Binning and titles of a hist record (e.g. from hist_cache), the same
+    as hist_binning of the hist it came from, without its contents.
+    """
+    return {field: record[field] for field in BINNING_FIELDS}
+
+
+def empty_hist(record, name):
+    """Make an empty hist with the binning and titles of a hist record."""
+    import ROOT
+    x_edges = np.asarray(record["x_edges"], dtype=np.float64)
+    y_edges = np.asarray(record["y_edges"], dtype=np.float64)
+    hist = getattr(ROOT, str(record["class_name"]))(
+        name, str(record["title"]),
+        len(x_edges) - 1, x_edges, len(y_edges) - 1, y_edges)
+    hist.SetDirectory(0)
+    hist.Sumw2()
+    hist.GetXaxis().SetTitle(str(record["x_title"]))
+    hist.GetYaxis().SetTitle(str(record["y_title"]))
+    return hist
+
+
+def binning_shape(binning):
+    """Shape to reshape flat 2D hist arrays to, (y, x) incl. under/overflow."""
+    return (len(binning["y_edges"]) + 1, len(binning["x_edges"]) + 1)
+
+
+def safe_divide(num, den):
+    """Divide element-wise, giving 0 wherever the denominator is 0."""
+    num = np.asarray(num, dtype=np.float64)
+    den = np.asarray(den, dtype=np.float64)
+    out = np.zeros(np.broadcast(num, den).shape)
+    np.divide(num, den, out=out, where=(den != 0))
+    return out
+
+
+def is_weighted(*hist_pairs):
+    """
+    Check whether any (contents, sumw2) pair was filled with weights.
+
+    This is the same check TEfficiency does to decide which errors to use.
+    """
+    return any(not np.allclose(contents, sumw2)
+               for contents, sumw2 in hist_pairs)
+
+
+def clopper_pearson(passed, total, level=CONF_LEVEL):
+    """
+    Efficiency and Clopper-Pearson errors, like TEfficiency's default.
+
+    Returns (eff, err_up, err_low), all arrays.
+    """
+    passed = np.asarray(passed, dtype=np.float64)
+    total = np.asarray(total, dtype=np.float64)
+    alpha = (1. - level) / 2.
+    eff = safe_divide(passed, total)
+
+    lower = np.zeros(eff.shape)
+    has_lower = passed > 0
+    lower[has_lower] = betaincinv(
+        passed[has_lower], total[has_lower] - passed[has_lower] + 1, alpha)
+
+    upper = np.ones(eff.shape)
+    has_upper = passed < total
+    upper[has_upper] = betaincinv(
+        passed[has_upper] + 1, total[has_upper] - passed[has_upper],
+        1. - alpha)
+
+    return eff, upper - eff, eff - lower
+
+
+def normal_approximation(passed, total, passed_w2, total_w2,
+                         level=CONF_LEVEL):
+    """
+    Efficiency and errors for weighted histograms.
+
+    TEfficiency can't do Clopper-Pearson with weights, it falls back to a
+    normal approximation, so that's what we do too.
+
+    Returns (eff, err_up, err_low), all arrays.
+    """
+    eff = safe_divide(passed, total)
+    variance = safe_divide(
+        passed_w2 * (1. - 2 * eff) + total_w2 * eff * eff, total * total)
+    delta = np.sqrt(np.clip(variance, 0, None)) * ndtri(1. - (1. - level) / 2.)
+    err_up = np.where(eff + delta > 1, 1. - eff, delta)
+    err_low = np.where(eff - delta < 0, eff, delta)
+    return eff, err_up, err_low
+
+
+def efficiency(match, probe, level=CONF_LEVEL):
+    """
+    Efficiency and stat errors for (contents, sumw2) match and probe arrays.
+
+    Returns (eff, err_up, err_low), all arrays.
+    """
+    if is_weighted(match, probe):
+        return normal_approximation(
+            match[0], probe[0], match[1], probe[1], level)
+    return clopper_pearson(match[0], probe[0], level)
+
+
+def loop_mask(shape):
+    """
+    Mask of the bins we fill: everything but the underflow bins.
+
+    (This is what the old bin loop did, range(1, nbins + 2) in x and y.)
+    """
+    mask = np.zeros(shape, dtype=bool)
+    mask[1:, 1:] = True
+    return mask.ravel()
+
+
+def core_mask(shape):
+    """Mask of the bins excluding both under- and overflow."""
+    mask = np.zeros(shape, dtype=bool)
+    mask[1:-1, 1:-1] = True
+    return mask.ravel()
+
+
+def compute_eff_arrays(probes, matches, shape, make_sf_plots=False,
+                       print_sf_values=False):
+    """
+    Compute every output array for one trigger/quality/region.
+
+    probes, matches: {"data": {variation: (contents, sumw2)}, "mc": {...}}
+    shape: (nbins_y + 2, nbins_x + 2), see binning_shape
+
+    Returns a dict like
+        {"data": {name: array}, "mc": {name: array}, "sf": {name: array},
+         "sf_values": {name: float}, "sf_stat_err": float}
+    where names are the variations plus isoEnv, stat_up, stat_down,
+    syst_up and syst_down. "sf" is only filled if make_sf_plots, and
+    "sf_values"/"sf_stat_err" only if print_sf_values.
+    """
+    mask = loop_mask(shape)
+    results = {"data": {}, "mc": {}, "sf": {}}
+    # per-bin isolation envelope choice, True where isoTight was used
+    iso_choice = {}
+    stat_errs = {}
+    syst_errs = {}
+    variations = list(probes["data"].keys())
+
+    for data_mc in ["data", "mc"]:
+        out = results[data_mc]
+        effs = {}
+        for var in variations:
+            # only the nominal needs stat errors, the rest are just ratios
+            effs[var] = safe_divide(
+                matches[data_mc][var][0], probes[data_mc][var][0])
+            out[var] = effs[var]
+        nom, stat_up, stat_dw = efficiency(
+            matches[data_mc]["nominal"], probes[data_mc]["nominal"])
+        out["stat_up"] = nom + stat_up
+        out["stat_down"] = nom - stat_dw
+
+        # systematics summed in quadrature, iso ones via the envelope
+        syst_tot = np.zeros(nom.shape)
+        for var in variations:
+            if var != "nominal" and not var.startswith("iso"):
+                syst_tot += (nom - effs[var])**2
+        if ISO_TIGHT in effs and ISO_PFLOW_TIGHT in effs:
+            use_tight = (np.abs(nom - effs[ISO_TIGHT]) >
+                         np.abs(nom - effs[ISO_PFLOW_TIGHT]))
+            out["isoEnv"] = np.where(
+                use_tight, effs[ISO_TIGHT], effs[ISO_PFLOW_TIGHT])
+            syst_tot += (nom - out["isoEnv"])**2
+            iso_choice[data_mc] = use_tight
+        syst = np.sqrt(syst_tot)
+        out["syst_up"] = nom + syst
+        out["syst_down"] = nom - syst
+        stat_errs[data_mc] = (stat_up, stat_dw)
+        syst_errs[data_mc] = syst
+
+    if make_sf_plots:
+        sf_out = results["sf"]
+        dnom, mcnom = results["data"]["nominal"], results["mc"]["nominal"]
+        dstatup, dstatdw = stat_errs["data"]
+        mcstatup, mcstatdw = stat_errs["mc"]
+        ratio = safe_divide(dnom, mcnom)
+        has_mc = mcnom != 0
+        sf_out["stat_up"] = np.where(has_mc, ratio + ratio * (
+            safe_divide(dstatup, dnom) + safe_divide(mcstatup, mcnom)), 0)
+        sf_out["stat_down"] = np.where(has_mc, ratio - ratio * (
+            safe_divide(dstatdw, dnom) + safe_divide(mcstatdw, mcnom)), 0)
+        dsyst, mcsyst = syst_errs["data"], syst_errs["mc"]
+        has_syst = has_mc & (mcsyst != 0)
+        sf_out["syst_up"] = np.where(
+            has_syst, safe_divide(dnom + dsyst, mcnom + mcsyst), 0)
+        sf_out["syst_down"] = np.where(
+            has_syst, safe_divide(dnom - dsyst, mcnom - mcsyst), 0)
+        for var in variations + ["isoEnv"]:
+            if var in results["data"]:
+                sf_out[var] = safe_divide(
+                    results["data"][var], results["mc"][var])
+
+    for data_mc in ["data", "mc", "sf"]:
+        for name, arr in results[data_mc].items():
+            results[data_mc][name] = np.where(mask, arr, 0)
+
+    if print_sf_values:
+        # inclusive isoEnv SF follows whichever MC variation won in each bin
+        results["sf_values"] = inclusive_sf_values(
+            probes, matches, mask, iso_choice.get("mc"))
+        results["sf_stat_err"] = inclusive_sf_stat_err(
+            probes, matches, core_mask(shape))
+    return results
+
+
+def inclusive_sf_values(probes, matches, mask, mc_use_tight=None):
+    """
+    Inclusive SF for each variation: total matches / probes, data over MC.
+
+    mc_use_tight is the per-bin isolation envelope choice made for MC,
+    if given we also get an isoEnv value.
+    """
+    def summed(hists, data_mc, var, where):
+        return hists[data_mc][var][0][where].sum()
+
+    sums = {}
+    for var in probes["data"]:
+        sums[var] = [summed(hists, data_mc, var, mask)
+                     for data_mc in ["data", "mc"]
+                     for hists in [matches, probes]]
+    if mc_use_tight is not None:
+        tight = mask & mc_use_tight
+        pflow = mask & ~mc_use_tight
+        sums["isoEnv"] = [
+            summed(hists, data_mc, ISO_TIGHT, tight) +
+            summed(hists, data_mc, ISO_PFLOW_TIGHT, pflow)
+            for data_mc in ["data", "mc"]
+            for hists in [matches, probes]]
+
+    sf_values = {}
+    for var, (d_match, d_probe, mc_match, mc_probe) in sums.items():
+        if d_probe == 0 or mc_probe == 0 or mc_match == 0:
+            sf_values[var] = 0
+        else:
+            sf_values[var] = float(
+                (d_match / d_probe) / (mc_match / mc_probe))
+    return sf_values
+
+
+def inclusive_sf_stat_err(probes, matches, mask):
+    """Stat error on the inclusive nominal SF, errors added linearly."""
+    effs = {}
+    for data_mc in ["data", "mc"]:
+        match = [arr[mask].sum() for arr in matches[data_mc]["nominal"]]
+        probe = [arr[mask].sum() for arr in probes[data_mc]["nominal"]]
+        eff, err_up, _ = efficiency(
+            tuple(np.array([val]) for val in match),
+            tuple(np.array([val]) for val in probe))
+        effs[data_mc] = (eff[0], err_up[0])
+    (data_eff, data_err), (mc_eff, mc_err) = effs["data"], effs["mc"]
+    if mc_eff == 0 or data_eff == 0:
+        return 0
+    scale_factor = data_eff / mc_eff
+    return float(scale_factor * (data_err / data_eff + mc_err / mc_eff))
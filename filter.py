@@ -1,43 +1,107 @@
-"""Module to filter ListDisk output"""
+"""
+Module to filter ListDisk output
+
+Every dataset we keep is checked against the contents of the RSE. The RSE is
+listed once (rucio list-datasets-rse) and every dataset is looked up in that,
+or, to run offline, the listing can be read from a file dumped earlier with
+
+rucio list-datasets-rse CA-SFU-T2_LOCALGROUPDISK > listing.txt
+python filter.py --rseListing listing.txt
+"""
 from __future__ import print_function
+import optparse
 import os
+import subprocess
 from constants import MTPPP_ROOT
 
 RSE = "CA-SFU-T2_LOCALGROUPDISK"
 LIST_DISK_OUTPUT_DIR = os.path.join(MTPPP_ROOT, "run")
 LIST_DISK_OUTPUT_FILE = os.path.join(
     LIST_DISK_OUTPUT_DIR, "CA-SFU-T2_LOCALGROUPDISK_2022-11-13_v66.3.0.txt")
-TEMP_FILE_PATH = "temp.out"
 FILTERED_OUTPUT_FILENAME = "filtered.txt"
 
+
+def dataset_index(listing_lines):
+    """
+    Set of dataset names in an RSE listing.
+
+    Names are indexed both with and without their scope: prefix,
+    so either form can be looked up.
+    """
+    index = set()
+    for line in listing_lines:
+        name = line.strip()
+        if name:
+            index.add(name)
+            index.add(name.split(":")[-1])
+    return index
+
+
+def list_rse(rse):
+    """List an RSE once with rucio, return the index of its datasets."""
+    output = subprocess.check_output(["rucio", "list-datasets-rse", rse])
+    return dataset_index(output.decode("utf-8").splitlines())
+
+
+def read_rse_listing(listing_path):
+    """Index of the datasets in a pre-dumped RSE listing file."""
+    with open(listing_path, "r") as listing_file:
+        return dataset_index(listing_file)
+
+
+def is_wanted(line):
+    """Check whether a ListDisk line is a dataset we care about for SFs."""
+    return "Main" in line or ("Zmumu" in line and "Powheg" in line)
+
+
+def get_options():
+    """Get options from the command line."""
+    parser = optparse.OptionParser()
+    # ListDisk output to filter
+    parser.add_option('-i', '--inFile', type='string',
+                      default=LIST_DISK_OUTPUT_FILE, dest='inFile')
+    # RSE the datasets should be on
+    parser.add_option('--rse', type='string', default=RSE, dest='rse')
+    # read the RSE contents from this file instead of asking rucio
+    parser.add_option('--rseListing', type='string', default=None,
+                      dest='rseListing')
+    (options, _) = parser.parse_args()
+    return options
+
+
 def main():
     """Filter to only get the files we care about for SFs"""
-    if not os.path.exists(LIST_DISK_OUTPUT_FILE):
+    options = get_options()
+    if not os.path.exists(options.inFile):
         raise ValueError("Make sure you've provided the correct path!")
 
-    with open(LIST_DISK_OUTPUT_FILE, "r+") as ld_output_file:
-        lines = ld_output_file.readlines()
+    with open(options.inFile, "r") as ld_output_file:
+        lines = [line.strip() for line in ld_output_file]
+
+    # ensure the datasets actually exist, checking them all in one go
+    if options.rseListing is not None:
+        rse_index = read_rse_listing(options.rseListing)
+    else:
+        rse_index = list_rse(options.rse)
 
     filtered_lines = []
+    missing = []
     for line in lines:
         # the actual line where we do the filtering
-        if "Main" in line or ("Zmumu" in line and "Powheg" in line):
-            line = line.replace('\n', '')
-            # ensure the dataset actually exists
-            cmd = "rucio list-datasets-rse " + RSE + " | grep " + line
-            os.system(cmd + " > " + TEMP_FILE_PATH)
-            with open(TEMP_FILE_PATH, 'r') as tmpfile:
-                cmd_output = tmpfile.read()
-            dataset_exists = line in str(cmd_output)
-            if dataset_exists:
-                print("Adding", line)
-                filtered_lines.append(line)
-            else:
-                raise ValueError("File" + line + "does not exist!")
+        if not is_wanted(line):
+            continue
+        if line in rse_index:
+            print("Adding", line)
+            filtered_lines.append(line)
+        else:
+            missing.append(line)
+    if missing:
+        raise ValueError("Files do not exist on " + options.rse + ":", missing)
+
     # write filtered output
     out_path = os.path.join(LIST_DISK_OUTPUT_DIR, FILTERED_OUTPUT_FILENAME)
     with open(out_path, "w+") as filtered_file:
-        filtered_file.writelines(filtered_lines)
+        filtered_file.writelines(line + "\n" for line in filtered_lines)
 
 
 if __name__ == "__main__":
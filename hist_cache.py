@@ -0,0 +1,224 @@
+"""
+Module for reading WTPH outputs through an on-disk cache.
+
+make_2d_eff only ever needs the bin contents and binning of the probe and
+match hists, so whatever we read out of a WTPH output is kept in an .npz
+file in a cache directory. Re-running (e.g. just to save PNGs) then doesn't
+need to touch ROOT files at all.
+
+Cache files are tied to the size and modification time of the WTPH output
+they came from, so regenerating an output invalidates its cache.
+
+Each process only ever writes its own cache file per input (named after
+the host and process ID), and only when it read something that wasn't
+cached yet, so batch jobs sharing a cache directory don't overwrite each
+other. Loading a cache reads every one of those files.
+"""
+import glob
+import hashlib
+import logging
+import os
+import socket
+import numpy as np
+import instrumentation
+from eff_engine import hist_arrays, hist_binning
+
+# names of the arrays we keep for each hist
+HIST_FIELDS = ["contents", "sumw2", "class_name", "title",
+               "x_edges", "x_title", "y_edges", "y_title"]
+# how many cache files an input can have before they're folded into one
+MAX_CACHE_PARTS = 16
+TMP_SUFFIX = ".tmp.npz"
+
+
+def cache_prefix(cache_dir, filepath):
+    """Where the cache files of an input file live, without their suffix."""
+    abspath = os.path.abspath(filepath)
+    digest = hashlib.sha1(abspath.encode("utf-8")).hexdigest()[:16]
+    return os.path.join(cache_dir, digest + "_" + os.path.basename(filepath))
+
+
+def cache_part_filepath(cache_dir, filepath):
+    """This process's own cache file for an input file."""
+    return "{}.{}-{}.npz".format(cache_prefix(cache_dir, filepath),
+                                 socket.gethostname(), os.getpid())
+
+
+def cache_parts(cache_dir, filepath):
+    """Every cache file there is for an input file."""
+    parts = glob.glob(glob.escape(cache_prefix(cache_dir, filepath)) +
+                      ".*.npz")
+    return sorted(part for part in parts if not part.endswith(TMP_SUFFIX))
+
+
+def file_stamp(filepath):
+    """Size and modification time of a file, used to spot stale caches."""
+    stat = os.stat(filepath)
+    return np.array([stat.st_size, stat.st_mtime_ns], dtype=np.int64)
+
+
+def load_part(cache_path, stamp):
+    """
+    Load the records of one cache file, {name: {field: array}},
+    None if it's stale (or was removed while we were looking).
+    """
+    try:
+        with np.load(cache_path) as cache:
+            if not np.array_equal(cache["__stamp__"], stamp):
+                return None
+            records = {}
+            for i, name in enumerate(cache["__names__"]):
+                prefix = "{}_".format(i)
+                records[str(name)] = {
+                    key[len(prefix):]: cache[key] for key in cache.files
+                    if key.startswith(prefix)}
+    except FileNotFoundError:
+        return None
+    return records
+
+
+def load_cache(cache_dir, filepath):
+    """
+    Load the cached records for an input file, from all its cache files.
+
+    Returns {name: {field: array}}, empty if there is no (valid) cache.
+    """
+    stamp = file_stamp(filepath)
+    records = {}
+    for cache_path in cache_parts(cache_dir, filepath):
+        part_records = load_part(cache_path, stamp)
+        if part_records is None:
+            logging.info("Cache %s is stale, ignoring it", cache_path)
+            continue
+        records.update(part_records)
+    return records
+
+
+def remove_quietly(path):
+    """Remove a file, if it's still there."""
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def save_cache(cache_dir, filepath, records):
+    """
+    Save records for an input file to this process's own cache file.
+
+    Every job only ever rewrites its own cache file, so jobs running at the
+    same time can't lose each other's records, and a job saving a few new
+    records doesn't rewrite everything cached so far. Once there are
+    MAX_CACHE_PARTS files for an input, the others are folded into this one
+    (and removed), so loading the cache stays cheap.
+    """
+    if not os.path.exists(cache_dir):
+        os.makedirs(cache_dir, exist_ok=True)
+    stamp = file_stamp(filepath)
+    cache_path = cache_part_filepath(cache_dir, filepath)
+    others = [part for part in cache_parts(cache_dir, filepath)
+              if part != cache_path]
+
+    all_records = {}
+    folded = []
+    if len(others) >= MAX_CACHE_PARTS:
+        for part in others:
+            all_records.update(load_part(part, stamp) or {})
+            folded.append(part)
+    all_records.update(load_part(cache_path, stamp) or {})
+    all_records.update(records)
+
+    names = sorted(all_records)
+    arrays = {"__stamp__": stamp, "__names__": np.array(names)}
+    for i, name in enumerate(names):
+        for field, arr in all_records[name].items():
+            arrays["{}_{}".format(i, field)] = arr
+
+    tmp_path = cache_path[:-len(".npz")] + TMP_SUFFIX
+    np.savez(tmp_path, **arrays)
+    os.replace(tmp_path, cache_path)
+    # only once everything they had is safely in ours
+    for part in folded:
+        remove_quietly(part)
+
+
+class CachedInputFile(object):
+    """
+    A WTPH output, only opened if something we need isn't in the cache.
+
+    With cache_dir=None nothing is cached, the file is just opened lazily.
+    Nothing (not even the cache) is read until a hist is first asked for.
+    """
+
+    def __init__(self, filepath, cache_dir=None):
+        self.filepath = filepath
+        self.cache_dir = cache_dir
+        self._tfile = None
+        self._records = None
+        self._new_records = {}
+
+    def _root_file(self):
+        """Open the actual ROOT file, the first time it's needed."""
+        if self._tfile is None:
+            from ROOT import TFile
+            logging.debug("Opening %s", self.filepath)
+            with instrumentation.timer("open"):
+                self._tfile = TFile(self.filepath)
+            instrumentation.count("files_opened")
+        return self._tfile
+
+    def _record(self, name, read):
+        """Get a record from the cache, or read it and remember it."""
+        if self._records is None:
+            self._records = {}
+            if self.cache_dir is not None:
+                with instrumentation.timer("open"):
+                    self._records = load_cache(self.cache_dir, self.filepath)
+        if name not in self._records:
+            self._records[name] = read()
+            self._new_records[name] = self._records[name]
+            instrumentation.count("records_read")
+        else:
+            instrumentation.count("records_cached")
+        return self._records[name]
+
+    def hist(self, hist_path):
+        """
+        Contents, sumw2 and binning of a hist, {field: array}.
+
+        See HIST_FIELDS for the fields.
+        """
+        def read():
+            hist = self._root_file().Get(hist_path)
+            if not hist:
+                raise ValueError(
+                    "Couldn't find {}. Does this really exist in {}?\n".format(
+                        hist_path, self.filepath))
+            contents, sumw2 = hist_arrays(hist)
+            record = {"contents": contents, "sumw2": sumw2}
+            for field, value in hist_binning(hist).items():
+                record[field] = np.asarray(value)
+            return record
+        return self._record(hist_path, read)
+
+    def list_dir(self, path):
+        """Sorted names of the keys in a directory ([] if missing)."""
+        def read():
+            directory = self._root_file().Get(path)
+            names = []
+            if directory:
+                names = sorted(
+                    key.GetName() for key in directory.GetListOfKeys())
+            return {"names": np.array(names, dtype=str)}
+        return [str(name) for name in self._record("dir:" + path, read)[
+            "names"]]
+
+    def close(self):
+        """Close the ROOT file if we opened it, and save anything new."""
+        if self._tfile is not None:
+            self._tfile.Close()
+            self._tfile = None
+        if self.cache_dir is not None and self._new_records:
+            with instrumentation.timer("cache_write"):
+                save_cache(self.cache_dir, self.filepath, self._new_records)
+            self._new_records = {}
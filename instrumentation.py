@@ -0,0 +1,137 @@
+"""
+Module for lightweight timing and counting of what make_2d_eff spends its
+time on, to find slow periods and triggers across many batch jobs.
+
+Work is grouped into records by labels (year, period, trigger, ...):
+
+    with instrumentation.scope(year="18", period="B"):
+        with instrumentation.timer("fetch"):
+            ...
+        instrumentation.count("selections")
+
+Scopes nest, an inner scope gets its own record with the labels of the
+outer ones added to its own. Timers and counts go to the innermost open
+scope (or to a record for the whole job if there isn't one). Timers are
+exclusive, time spent in a timer nested inside another one only counts
+for the inner one, so the stages of a record never add up to more than
+its wall time (which includes the time spent in inner scopes).
+
+At the end of a job write_records appends one JSON line per record, e.g.
+    {"labels": {"year": "18", ...}, "seconds": {"fetch": 0.2, ...},
+     "counts": {"selections": 1}, "host": ..., "pid": ..., ...}
+Records with the same labels (e.g. computed in a worker process and
+written in the main one) are meant to be added up when aggregating.
+"""
+import contextlib
+import json
+import os
+import resource
+import socket
+import time
+
+# finished records, and the stack of open ones (innermost last)
+_RECORDS = []
+_OPEN = []
+# [stage, start time, time spent in nested timers] of running timers
+_TIMERS = []
+_JOB_RECORD = None
+
+
+def _new_record(labels):
+    """An empty record with the given labels."""
+    return {"labels": labels, "seconds": {}, "counts": {}}
+
+
+def _current():
+    """The record timers and counts currently go to."""
+    global _JOB_RECORD
+    if _OPEN:
+        return _OPEN[-1]
+    if _JOB_RECORD is None:
+        _JOB_RECORD = _new_record({})
+    return _JOB_RECORD
+
+
+@contextlib.contextmanager
+def scope(**labels):
+    """Put everything timed or counted in a with block in its own record."""
+    all_labels = dict(_OPEN[-1]["labels"]) if _OPEN else {}
+    all_labels.update((key, str(value)) for key, value in labels.items())
+    record = _new_record(all_labels)
+    _OPEN.append(record)
+    start = time.time()
+    try:
+        yield record
+    finally:
+        record["wall_seconds"] = time.time() - start
+        _OPEN.remove(record)
+        _RECORDS.append(record)
+
+
+@contextlib.contextmanager
+def timer(stage):
+    """Add the time spent in a with block to a stage of the record."""
+    record = _current()
+    entry = [stage, time.time(), 0.]
+    _TIMERS.append(entry)
+    try:
+        yield
+    finally:
+        _TIMERS.pop()
+        elapsed = time.time() - entry[1]
+        seconds = record["seconds"]
+        seconds[stage] = seconds.get(stage, 0.) + elapsed - entry[2]
+        if _TIMERS:
+            _TIMERS[-1][2] += elapsed
+
+
+def count(name, number=1):
+    """Add to a counter of the record."""
+    counts = _current()["counts"]
+    counts[name] = counts.get(name, 0) + number
+
+
+def take_records():
+    """Get (and forget) the finished records, e.g. to send from a worker."""
+    global _JOB_RECORD
+    records = list(_RECORDS)
+    if _JOB_RECORD is not None:
+        records.append(_JOB_RECORD)
+    del _RECORDS[:]
+    _JOB_RECORD = None
+    return records
+
+
+def add_records(records):
+    """Add records taken from another process."""
+    _RECORDS.extend(records)
+
+
+def write_records(path, **job_labels):
+    """
+    Append every record so far to a JSON lines file, and forget them.
+
+    job_labels are added to the labels of every record. Everything is
+    written with a single write, so jobs can share a file on a local disk,
+    but on a shared file system give each job its own file.
+    """
+    job_info = {
+        "host": socket.gethostname(),
+        "pid": os.getpid(),
+        "batch_job_id": os.environ.get("SLURM_JOB_ID"),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        # kB on Linux
+        "max_rss_mb": resource.getrusage(
+            resource.RUSAGE_SELF).ru_maxrss / 1024.,
+    }
+    lines = []
+    for record in take_records():
+        line = dict(record)
+        line["labels"] = dict(job_labels, **record["labels"])
+        line.update(job_info)
+        lines.append(json.dumps(line, sort_keys=True) + "\n")
+    directory = os.path.dirname(path)
+    if directory and not os.path.exists(directory):
+        os.makedirs(directory)
+    with open(path, "a") as out:
+        out.write("".join(lines))
@@ -29,11 +29,23 @@ ROOT will complain about the file not being found.
 
 Execution:
 ----------
-(requires python 2!)
+(python 3)
 
-python 2Dsysts.py -d [input fils directory] -y [year] -p [period]
+One selection:
+python make_2d_eff.py -i [input files directory] -o [output directory]
+-y [year] -p [period] -T [trigger type] -v [version]
 -r [region] -t [trigger] -q [quality] --[other options]
 
+Every selection of one period, or of every year and period:
+python make_2d_eff.py -i [input dir] -o [output dir] -v [version]
+-y [year] -p [period] -T [trigger type] -a/--allSelections
+python make_2d_eff.py -i [input dir] -o [output dir] -v [version]
+--runAll -j [jobs]
+
+Batch jobs writing shards, then merging them:
+python make_2d_eff.py ... --shards
+python make_2d_eff.py -o [output dir] -v [version] -y [year] --mergeShards
+
 See the parser option lines below for more details about the other options.
 The parser options also allow the user to use the batch script batch2DEff.sh
 to run this script many times for different
@@ -41,6 +53,40 @@ years/periods/regions/triggers/qualities.
 In this way, output ROOT files can, in one go,
 be filled with all of the necessary plots.
 
+-a/--allSelections does every quality/region/trigger found in the inputs
+for one year/period, opening each input file only once, and --runAll does
+that for every year and period, using -j/--jobs worker processes (results
+are sent back to one process which does all the writing).
+
+With --variations, only some variations are used (nominal always has to
+be one of them). The systematics of such a run are incomplete, so its
+outputs go to separate files named after the variations, e.g.
+muontrigger_sf_2018_mc20e_v66.3.0_only-nominal.root, never the real ones.
+
+When running many jobs on a batch system, add --shards so each job writes
+its own small shard file rather than updating the shared per-year file,
+then run once with --mergeShards -y [year] to build the per-year file.
+
+Everything read from the inputs is cached in --cacheDir (see hist_cache,
+<outDir>/hist_cache/ by default, --noCache for none), so re-running e.g. with --savePNGs doesn't need to read the inputs again.
+If the inputs have been converted with wtph_columnar.py, --columnar reads
+those instead of the ROOT files.
+If WTPH was run with the merged configs (every variation in one pass, see
+merged_config), --merged reads each variation from the one merged output
+by its selection names (check those outputs with check_merged_outputs.py
+first).
+With --savePNGs, --pngJobs [n] draws them in n worker processes, and PNGs
+whose hists haven't changed since they were last drawn are skipped
+(see png_rendering).
+With --telemetry [file], the time spent in each stage is appended to that
+file for every selection, as JSON lines (see instrumentation):
+    open      opening inputs (or loading their caches)
+    fetch     getting the probe and match hists out of them
+    compute   computing efficiencies and SFs (NumPy only, no ROOT)
+    hists     making the output ROOT hists
+    write     writing them
+    png       queueing (or drawing) PNGs
+
 Outputs:
 --------
 
@@ -55,28 +101,30 @@ but there's no need to put copyright/edit info here, that's all in GitLab!)
 # Imports and Option Parser
 from __future__ import print_function
 import math
+import multiprocessing
 import optparse
 import sys
 import os
 import logging
-from ROOT import gROOT, SetAtlasStyle, TCanvas, gStyle, TFile, TEfficiency, TObject
 import constants as c
+import instrumentation
+from eff_engine import (binning_shape, compute_eff_arrays, empty_hist,
+                        fill_hist, record_binning)
+from hist_cache import CachedInputFile
+from merged_config import MergedVariationFile
+from png_rendering import PNGQueue
 from run_numbers import periods
+from sf_shards import close_shard, merge_shards, open_shard
 from triggers import triggers_in_period
+from wtph_columnar import ColumnarInputFile, columnar_path, is_up_to_date
 
 # TODO Need to be careful about period K 2017 nvtx systematic:
 # TODO cut >/< 19 vertices for 2017 but >/< 25 for period K
 
-# Suppresses basic info prints to terminal (used to shut up TEff constructor)
-gROOT.ProcessLine("gErrorIgnoreLevel = 1001;")
-# set up global style stuff
-gROOT.LoadMacro('AtlasUtils.C')
-gROOT.LoadMacro('AtlasLabels.C')
-if gROOT.LoadMacro('AtlasStyle.C') > 0:
-    SetAtlasStyle()
-
 DEFAULT_IN_DIR = '../../../../../output/'
 DEFAULT_OUT_DIR = '../../../../../run/'
+# hist cache directory, in the output directory by default
+CACHE_DIR_NAME = 'hist_cache/'
 
 RELEASE = 22
 MC_NUMBER = "20" if RELEASE >= 22 else "16"  # not sure how actually defined
@@ -88,25 +136,17 @@ MC_CAMPAIGNS = {
 }
 
 
-def draw_hist(out_dir, title_prefix, hist, name):
-    """Make a histogram."""
-    canvas = TCanvas()
-    canvas.SetTopMargin(0.1)
-    canvas.SetBottomMargin(0.15)
-    canvas.SetLeftMargin(0.15)
-    canvas.SetRightMargin(0.15)
-    gStyle.SetOptTitle(1)
-    gStyle.SetOptStat(0)
-    gStyle.SetPaintTextFormat(".3f")
-    title = title_prefix + name
+def quiet_root():
+    """Suppresses basic info prints to terminal from ROOT."""
+    from ROOT import gROOT
+    gROOT.ProcessLine("gErrorIgnoreLevel = 10000000;")
+
+
+def filled_clone(template, name, contents):
+    """Clone an empty template hist and fill it with an array of contents."""
+    hist = template.Clone(name)
     hist.SetDirectory(0)
-    hist.SetTitle(title)
-    hist.SetTitleSize(0.02, "t")
-    hist.SetMaximum(1.0)
-    hist.SetMinimum(0.0)
-    hist.Draw("COLZ TEXT")
-    canvas.SaveAs(out_dir + title_prefix + name + ".png")
-    canvas.Close()
+    return fill_hist(hist, contents)
 
 
 def get_options():
@@ -115,6 +155,9 @@ def get_options():
     # Save PNGs of 2D data/mc efficiency hists
     parser.add_option('--savePNGs', action='store_true', default=False,
                       dest='savePNGs')
+    # number of worker processes drawing PNGs (1: draw them in this one)
+    parser.add_option('--pngJobs', type='int', default=1,
+                      dest='pngJobs')
     # Make separate ROOT file with SF hists
     parser.add_option('--makeSFPlots', action='store_true', default=False,
                       dest='makeSFPlots')
@@ -153,6 +196,42 @@ def get_options():
     # T&P NTuple Version e.g. v65.3.2 or v064
     parser.add_option('-v', '--version', type='string', default=None,
                       dest='version')
+    # do every quality/region/trigger found in the inputs for year/period,
+    # opening each input file once (-r, -t and -q are ignored)
+    parser.add_option('-a', '--allSelections', action='store_true',
+                      default=False, dest='allSelections')
+    # do every year and period (all other selection options are ignored)
+    parser.add_option('--runAll', action='store_true', default=False,
+                      dest='runAll')
+    # number of worker processes to compute with when using --runAll
+    parser.add_option('-j', '--jobs', type='int', default=1,
+                      dest='jobs')
+    # write this job's output to its own shard, not the shared per-year file
+    parser.add_option('--shards', action='store_true', default=False,
+                      dest='shards')
+    # merge all shards for a year into the per-year file(s), nothing else
+    parser.add_option('--mergeShards', action='store_true', default=False,
+                      dest='mergeShards')
+    # where to cache hists read from the inputs, so reruns skip ROOT I/O
+    # (default <outDir>/hist_cache/)
+    parser.add_option('--cacheDir', type='string', default=None,
+                      dest='cacheDir')
+    # don't use (or fill) the hist cache
+    parser.add_option('--noCache', action='store_true', default=False,
+                      dest='noCache')
+    # comma-separated subset of variations to use, e.g. nominal (default all)
+    parser.add_option('--variations', type='string', default=None,
+                      dest='variations')
+    # read inputs from their columnar versions (made by wtph_columnar.py)
+    parser.add_option('--columnar', action='store_true', default=False,
+                      dest='columnar')
+    # read every variation from one merged WTPH output (see merged_config)
+    parser.add_option('--merged', action='store_true', default=False,
+                      dest='merged')
+    # append timings and counts of this job to this file, as JSON lines
+    # (see instrumentation)
+    parser.add_option('--telemetry', type='string', default=None,
+                      dest='telemetry')
 
     (options, _) = parser.parse_args()
 
@@ -182,17 +261,14 @@ def get_options():
     if options.version is None:
         print("using defualt ntuple version: v66.3.0")
         options.version = "v66.3.0"
+    if options.cacheDir is None:
+        options.cacheDir = os.path.join(options.outDir, CACHE_DIR_NAME)
     return options
 
 
-def make_2d_eff_hists(year, period, region, trigger_type, trigger, quality,
-                      version, input_dir, output_dir, make_sf_plots,
-                      print_sf_values, debug, save_pngs):
-    """Make 2D Efficiency histograms for all the given parameters."""
-    print(year, period, quality, region, trigger_type)
-    # Suppresses basic info prints to terminal (used to shut up TEff constructor)
-    gROOT.ProcessLine("gErrorIgnoreLevel = 10000000;")
-
+def check_period_args(year, period, trigger_type, version, input_dir,
+                      output_dir):
+    """Check the arguments shared by every selection in a period."""
     # check year
     if year not in MC_CAMPAIGNS.keys():
         raise ValueError("Invalid year! Use one of", MC_CAMPAIGNS.keys())
@@ -202,27 +278,11 @@ def make_2d_eff_hists(year, period, region, trigger_type, trigger, quality,
     if period not in periods(number_year):
         raise ValueError("Invalid period! Use one of", periods(number_year))
 
-    # check region
-    if region not in c.DETECTOR_REGIONS:
-        raise ValueError(
-            "Invalid detector region! Use one of", c.DETECTOR_REGIONS)
-
     # check trigger_type
     if trigger_type not in c.TRIGGER_TYPES:
         raise ValueError(
             "Invalid trigger type! Use one of", c.TRIGGER_TYPES)
 
-    # check trigger
-    single = (trigger_type == "SingleMuonTriggers")
-    if trigger not in triggers_in_period(single, number_year, period):
-        raise ValueError(
-            "Invalid detector region! Use one of", c.DETECTOR_REGIONS)
-
-    # check quality working point
-    if quality not in c.WORKING_POINTS:
-        raise ValueError(
-            "Invalid quality working point! Use one of", c.WORKING_POINTS)
-
     # show warning if you're running over another version
     if version != c.NTUPLE_VERSION:
         logging.warning("Version is not the same as in constants module!")
@@ -233,19 +293,118 @@ def make_2d_eff_hists(year, period, region, trigger_type, trigger, quality,
     if not os.path.exists(output_dir):
         raise ValueError("Output directory does not exist!", output_dir)
 
-    assert isinstance(make_sf_plots, bool)
-    assert isinstance(print_sf_values, bool)
-    assert isinstance(debug, bool)
-    assert isinstance(save_pngs, bool)
 
-    montecarlo = MC_CAMPAIGNS[year]
+def check_selection_args(year, period, region, trigger_type, trigger,
+                         quality):
+    """Check region, trigger and quality, for a year/period/trigger type."""
+    # check region
+    if region not in c.DETECTOR_REGIONS:
+        raise ValueError(
+            "Invalid detector region! Use one of", c.DETECTOR_REGIONS)
+
+    # check trigger
+    number_year = int("20"+year)
+    single = (trigger_type == "SingleMuonTriggers")
+    valid_triggers = triggers_in_period(single, number_year, period)
+    if trigger not in valid_triggers:
+        raise ValueError("Invalid trigger! Use one of", valid_triggers)
+
+    # check quality working point
+    if quality not in c.WORKING_POINTS:
+        raise ValueError(
+            "Invalid quality working point! Use one of", c.WORKING_POINTS)
+
 
-    # Load input files
-    logging.debug("Looking for input files in directory: %s", input_dir)
-    input_files = os.listdir(input_dir)
-    logging.debug("Found %s files in %s", len(input_files), input_dir)
+def input_filepath_fmt(input_dir, year, period, version, trigger_type):
+    """Format string for WTPH outputs, needs data_mc and variation."""
+    var_conf_name = "{data_mc}20"+str(year)+"_"+"_".join(
+        [period, "{variation}", version, trigger_type])+".root"
+    return os.path.join(input_dir, var_conf_name)
+
+
+def check_variations(variations):
+    """Check a subset of variations to run over, None means all of them."""
+    if variations is None:
+        return list(c.VARIATIONS)
+    for var in variations:
+        if var not in c.VARIATIONS:
+            raise ValueError("Invalid variation! Use some of", c.VARIATIONS)
+    if "nominal" not in variations:
+        raise ValueError("The nominal variation is always needed!")
+    if len(variations) < len(c.VARIATIONS):
+        logging.warning("Only using variations %s, systematics will be "
+                        "incomplete! Writing to separate output files.",
+                        ", ".join(variations))
+    # keep the usual order, whatever order they were given in
+    return [var for var in c.VARIATIONS if var in variations]
+
+
+def input_file(filepath, cache_dir=None, columnar=False):
+    """
+    Get a WTPH output to read hists from.
+
+    If columnar, use its up-to-date columnar version if there is one
+    (see wtph_columnar), otherwise read the ROOT file via the hist cache.
+    """
+    if columnar:
+        cols_path = columnar_path(filepath)
+        if os.path.exists(cols_path) and (
+                not os.path.exists(filepath) or is_up_to_date(filepath)):
+            return ColumnarInputFile(cols_path)
+        logging.warning(
+            "No up-to-date columnar file for %s, reading ROOT file", filepath)
+    if not os.path.exists(filepath):
+        raise ValueError("File not found:", filepath)
+    return CachedInputFile(filepath, cache_dir)
+
+
+def open_input_files(var_conf_fmt, cache_dir=None, variations=None,
+                     columnar=False, merged=False):
+    """
+    Get the WTPH output of every variation, for data and MC.
+
+    Returns {"data": {variation: file}, "mc": {variation: file}},
+    see input_file for what the files are and what the options do.
+    Nothing is opened here, each file is only opened (or its cache read)
+    once its hists are first needed.
+    Only the given variations are used, all of them if None.
+    If merged, every variation is read from the same merged output.
+    """
+    variations = check_variations(variations)
+
+    input_files = {"data": {}, "mc": {}}
+    if merged:
+        logging.info("Using merged data file %s", var_conf_fmt.format(
+            data_mc="data", variation=c.MERGED_VARIATION))
+        for d_mc in ["data", "mc"]:
+            merged_file = input_file(
+                var_conf_fmt.format(
+                    data_mc=d_mc, variation=c.MERGED_VARIATION),
+                cache_dir, columnar)
+            for var in variations:
+                input_files[d_mc][var] = MergedVariationFile(merged_file, var)
+        return input_files
+
+    logging.info("Using nominal data file %s", var_conf_fmt.format(
+        data_mc="data", variation="nominal"))
+    for d_mc in ["data", "mc"]:
+        for var in variations:
+            input_files[d_mc][var] = input_file(
+                var_conf_fmt.format(data_mc=d_mc, variation=var), cache_dir,
+                columnar)
+    return input_files
+
+
+def close_input_files(input_files):
+    """Close everything opened by open_input_files, updating caches."""
+    for var_files in input_files.values():
+        for var_file in var_files.values():
+            var_file.close()
 
-    dir_fmt = "ZmumuTPMerged/"+quality+"MuonProbes_"+\
+
+def selection_hist_paths(quality, region, trigger):
+    """Paths of the probe and match hists for one selection."""
+    dir_fmt = c.WTPH_TOP_DIR+"/"+quality+"MuonProbes_"+\
         region.capitalize()+"/OC/"+trigger+"/"
     probe_dir = dir_fmt+"Probe/"
     match_dir = dir_fmt+"Match/"
@@ -260,629 +419,583 @@ def make_2d_eff_hists(year, period, region, trigger_type, trigger, quality,
 
     logging.debug(
         "Will look in directory,\n%s\nFor hist,\n%s", probe_dir, probe_hist)
+    return probe_dir + probe_hist, match_dir + match_hist
+
+
+def read_selection(input_files, quality, region, trigger):
+    """
+    Read the probe and match hists of one quality/region/trigger.
+
+    Returns (probes, matches, binning), probes and matches being
+    {"data": {variation: (contents, sumw2)}, "mc": {...}}
+    and binning the nominal data probe hist record.
+    """
+    probe_path, match_path = selection_hist_paths(quality, region, trigger)
+
+    # Pull the bin contents out of every probe & match hist once,
+    # everything after this is done on numpy arrays
+    probes = {"data": {}, "mc": {}}
+    matches = {"data": {}, "mc": {}}
+    with instrumentation.timer("fetch"):
+        for data_mc, var_files in sorted(input_files.items()):
+            for name, var_file in var_files.items():
+                probe = var_file.hist(probe_path)
+                match = var_file.hist(match_path)
+                probes[data_mc][name] = (probe["contents"], probe["sumw2"])
+                matches[data_mc][name] = (match["contents"], match["sumw2"])
+            logging.debug("Got %s probe & match hists", data_mc)
+
+        # (binning assumed to be the same for data and mc)
+        binning = input_files["data"]["nominal"].hist(probe_path)
+    return probes, matches, binning
+
+
+def compute_selection(input_files, quality, region, trigger, make_sf_plots,
+                      print_sf_values):
+    """
+    Compute efficiencies and SFs for one quality/region/trigger.
+
+    Returns (binning, results), where binning is that of the output hists
+    (see eff_engine.hist_binning) and results come from compute_eff_arrays.
+    No hists are made here (so no ROOT is needed), see write_selection_outputs.
+    """
+    probes, matches, record = read_selection(
+        input_files, quality, region, trigger)
+    binning = record_binning(record)
+
+    with instrumentation.timer("compute"):
+        logging.debug('Now computing efficiencies...')
+        results = compute_eff_arrays(
+            probes, matches, binning_shape(binning),
+            make_sf_plots=make_sf_plots, print_sf_values=print_sf_values)
+    return binning, results
+
+
+def variations_suffix(variations):
+    """
+    Suffix of the output files of a run using only some variations
+    (e.g. _only-nominal), "" if it uses all of them.
+    """
+    if variations is None:
+        return ""
+    # (in the usual order, like check_variations)
+    variations = [var for var in c.VARIATIONS if var in variations]
+    if len(variations) == len(c.VARIATIONS):
+        return ""
+    return "_only-" + "-".join(variations)
+
+
+def effs_filepath_for(output_dir, year, version, debug, variations=None):
+    """
+    Path of the efficiency file the SF tool reads
+    (or of a separate file, if only some variations are used).
+    """
+    suffix = variations_suffix(variations)
+    if debug:
+        # test output file
+        return os.path.join(output_dir, "debug%s.root" % suffix)
+    # Change ntuple version to match your inputs!
+    # outfile named in format for SF tool
+    return os.path.join(
+        output_dir, 'muontrigger_sf_20%s_mc%s_%s%s.root' %
+        (year, MC_CAMPAIGNS[year], version, suffix))
 
-    var_conf_name = "{data_mc}20"+str(year)+"_"+"_".join(
-        [period, "{variation}", version, trigger_type])+".root"
-    var_conf_fmt = os.path.join(input_dir, var_conf_name)
-    for d_mc in ["data", "mc"]:
-        for var in c.VARIATIONS:
-            var_conf = var_conf_fmt.format(data_mc=d_mc, variation=var)
-            if not os.path.exists(var_conf):
-                raise ValueError("File not found:", var_conf)
-
-    # unfortunately it IS necessary to keep these as separately named variables
-    # or else ROOT has some problem with namespace garbage
-    # sorry about that, future code friend
-    # VARIATIONS = [
-    #     "nominal", "dphill", "mll",
-    #     "muneg", "mupos", "noIP", "nvtx_dw", "nvtx_up", "ptdw", "ptup",
-    #     "isoPflowLoose_VarRad", "isoPflowTight_VarRad",
-    #     "isoLoose_VarRad", "isoTight_VarRad"]
-    print("Using nominal data file", var_conf_fmt.format(
-        data_mc="data", variation="nominal"))
-
-    data_nominal = TFile(var_conf_fmt.format(
-        data_mc="data", variation="nominal"))
-
-    data_dphill = TFile(var_conf_fmt.format(
-        data_mc="data", variation="dphill"))
-    data_mll = TFile(var_conf_fmt.format(
-        data_mc="data", variation="mll"))
-    data_muneg = TFile(var_conf_fmt.format(
-        data_mc="data", variation="muneg"))
-    data_mupos = TFile(var_conf_fmt.format(
-        data_mc="data", variation="mupos"))
-    data_no_ip = TFile(var_conf_fmt.format(
-        data_mc="data", variation="noIP"))
-    data_nvtx_dw = TFile(var_conf_fmt.format(
-        data_mc="data", variation="nvtx_dw"))
-    data_nvtx_up = TFile(var_conf_fmt.format(
-        data_mc="data", variation="nvtx_up"))
-    data_ptdw = TFile(var_conf_fmt.format(
-        data_mc="data", variation="ptdw"))
-    data_ptup = TFile(var_conf_fmt.format(
-        data_mc="data", variation="ptup"))
-    data_iso_loose_pf = TFile(var_conf_fmt.format(
-        data_mc="data", variation="isoPflowLoose_VarRad"))
-    data_iso_tight_pf = TFile(var_conf_fmt.format(
-        data_mc="data", variation="isoPflowTight_VarRad"))
-    data_iso_loose = TFile(var_conf_fmt.format(
-        data_mc="data", variation="isoLoose_VarRad"))
-    data_iso_tight = TFile(var_conf_fmt.format(
-        data_mc="data", variation="isoTight_VarRad"))
-    data_files = [
-        data_nominal, data_dphill, data_mll, data_muneg, data_mupos,
-        data_no_ip, data_nvtx_dw, data_nvtx_up, data_ptdw, data_ptup,
-        data_iso_loose_pf, data_iso_tight_pf, data_iso_loose, data_iso_tight]
-
-    mc_nominal = TFile(var_conf_fmt.format(
-        data_mc="mc", variation="nominal"))
-    mc_dphill = TFile(var_conf_fmt.format(
-        data_mc="mc", variation="dphill"))
-    mc_mll = TFile(var_conf_fmt.format(
-        data_mc="mc", variation="mll"))
-    mc_muneg = TFile(var_conf_fmt.format(
-        data_mc="mc", variation="muneg"))
-    mc_mupos = TFile(var_conf_fmt.format(
-        data_mc="mc", variation="mupos"))
-    mc_no_ip = TFile(var_conf_fmt.format(
-        data_mc="mc", variation="noIP"))
-    mc_nvtx_dw = TFile(var_conf_fmt.format(
-        data_mc="mc", variation="nvtx_dw"))
-    mc_nvtx_up = TFile(var_conf_fmt.format(
-        data_mc="mc", variation="nvtx_up"))
-    mc_ptdw = TFile(var_conf_fmt.format(
-        data_mc="mc", variation="ptdw"))
-    mc_ptup = TFile(var_conf_fmt.format(
-        data_mc="mc", variation="ptup"))
-    mc_iso_loose_pf = TFile(var_conf_fmt.format(
-        data_mc="mc", variation="isoPflowLoose_VarRad"))
-    mc_iso_tight_pf = TFile(var_conf_fmt.format(
-        data_mc="mc", variation="isoPflowTight_VarRad"))
-    mc_iso_loose = TFile(var_conf_fmt.format(
-        data_mc="mc", variation="isoLoose_VarRad"))
-    mc_iso_tight = TFile(var_conf_fmt.format(
-        data_mc="mc", variation="isoTight_VarRad"))
-    mc_files = [
-        mc_nominal, mc_dphill, mc_mll, mc_muneg, mc_mupos,
-        mc_no_ip, mc_nvtx_dw, mc_nvtx_up, mc_ptdw, mc_ptup,
-        mc_iso_loose_pf, mc_iso_tight_pf, mc_iso_loose, mc_iso_tight]
-
-
-    print("n_data", data_nominal.Get(probe_dir + "/" + probe_hist).GetEntries())
-    print("n_data", mc_nominal.Get(probe_dir + "/" + probe_hist).GetEntries())
-
-
-    probe_hists = {"data": {}, "mc": {}}
-    match_hists = {"data": {}, "mc": {}}
-    effs = {"data": {}, "mc": {}}
-    hists = {"data": {}, "mc": {}}
-
-    # Data:
-    for i, var_file in enumerate(data_files):
-        name = c.VARIATIONS[i]
-        probe_hists["data"][name] = var_file.Get(probe_dir + "/" + probe_hist)
-        if not probe_hists["data"][name]:
-            raise ValueError(
-                "Couldn't find {}. Does this really exist in {}?\n".format(
-                    probe_dir + probe_hist, var_file.GetName()))
-        match_hists["data"][name] = var_file.Get(match_dir + "/" + match_hist)
-        if not match_hists["data"][name]:
-            raise ValueError(
-                "Couldn't find {}. Does this really exist in {}?\n".format(
-                    match_dir + match_hist, var_file.GetName()))
-        logging.debug("Got data probe & match hists for %s", name)
-
-        # Make TEff object to do stat errors properly
-        effs["data"][name] = TEfficiency(
-            match_hists["data"][name], probe_hists["data"][name])
-
-        # Make empty TH2 which will be filled with TEff bin values
-        # (+/- errors if needed) down below
-        hists["data"][name] = probe_hists["data"][name].Clone()
-        hists["data"][name].Reset()
-
-    # MC:
-    for j, mc_varfile in enumerate(mc_files):
-        name = c.VARIATIONS[j]
-        probe_hists["mc"][name] = mc_varfile.Get(probe_dir + "/" + probe_hist)
-        if not probe_hists["mc"][name]:
-            raise ValueError(
-                "Couldn't find {}. Does this really exist in {}?\n".format(
-                    probe_dir + probe_hist, mc_varfile.GetName()))
-        match_hists["mc"][name] = mc_varfile.Get(match_dir + "/" + match_hist)
-        if not match_hists["mc"][name]:
-            raise ValueError(
-                "Couldn't find {}. Does this really exist in {}?\n".format(
-                    match_dir + match_hist, mc_varfile.GetName()))
-        logging.debug("Got MC probe & match hists for %s", name)
-        # Make TEff object to do stat errors properly
-        effs["mc"][name] = TEfficiency(
-            match_hists["mc"][name], probe_hists["mc"][name])
-        #mcEffs[name].SetStatisticOption(TEfficiency.kFNormal)
-        # Make empty TH2 which will be filled with TEff bin values
-        # (+/- errors if needed) down below
-        hists["mc"][name] = probe_hists["mc"][name].Clone()
-        hists["mc"][name].Reset()
-
-    print(type(probe_hists["data"]["nominal"]))
-    print(type(probe_hists["mc"]["nominal"]))
-
-    # Setting up data systematic, statistical variation histograms
-    # for data
-    data_probe_nominal = probe_hists["data"]["nominal"]
-
-    data_syst_up = data_probe_nominal.Clone('dSystUp')
-    data_syst_up.Reset()
-    data_syst_dw = data_probe_nominal.Clone('dSystDw')
-    data_syst_dw.Reset()
-    data_stat_up = data_probe_nominal.Clone('dStatUp')
-    data_stat_up.Reset()
-    data_stat_dw = data_probe_nominal.Clone('dStatDw')
-    data_stat_dw.Reset()
-    # isoEnv = isolation envelope
-    hists["data"]["isoEnv"] = data_probe_nominal.Clone('isoEnv')
-    hists["data"]["isoEnv"].Reset()
-
-    # MC:
-    mc_probe_nominal = probe_hists["mc"]["nominal"]
-    mc_syst_up = mc_probe_nominal.Clone('mcSystUp')
-    mc_syst_up.Reset()
-    mc_syst_dw = mc_probe_nominal.Clone('mcSystDw')
-    mc_syst_dw.Reset()
-    mc_stat_up = mc_probe_nominal.Clone('mcStatUp')
-    mc_stat_up.Reset()
-    mc_stat_dw = mc_probe_nominal.Clone('mcStatDw')
-    mc_stat_dw.Reset()
-    hists["mc"]["isoEnv"] = mc_probe_nominal.Clone('isoEnv')
-    hists["mc"]["isoEnv"].Reset()
-
-    print("yeet")
-    print(type(data_probe_nominal))
-    print(type(mc_probe_nominal))
-
-    # Number of x- and y-bins - will be used many times
-    # assumed to be the same for data and mc
-    xbins = data_probe_nominal.GetNbinsX()
-    ybins = data_probe_nominal.GetNbinsY()
-
-    # Initialize stat/syst up/down
-    if make_sf_plots:
-        logging.debug("makeSFPlots = True! Will initialize SF hists")
-        sf_hists = {}
-        for k in hists["data"]:
-            sf_hists[k] = hists["data"][k].Clone()
-            sf_hists[k].Reset()
-        sf_stat_up = data_stat_up.Clone()
-        sf_stat_dw = data_stat_dw.Clone()
-        sf_syst_up = data_syst_up.Clone()
-        sf_syst_dw = data_syst_dw.Clone()
-
-    # Initlaize SF value variables and obtain inclusive stat uncertainty
-    if print_sf_values:
-        logging.debug(
-            "printSFValues = True! Will keep track of SF values for each syst")
-        # To get inclusive SF values,
-        # need to add probes and matches across all bins
-        n_data_matches = {}
-        n_data_probes = {}
-        n_mc_matches = {}
-        n_mc_probes = {}
-        sf_values = {}
-        for k in hists["data"]:
-            n_data_matches[k] = 0
-            n_data_probes[k] = 0
-            n_mc_matches[k] = 0
-            n_mc_probes[k] = 0
-            sf_values[k] = 0
-        sf_values["isoEnv"] = 0
-        sf_values["TotSyst"] = 0
-
-        # Inclusive SF stat uncertainty using 1-bin copies of data/mc hists
-        #Data inclusive eff
-        data_match_nominal = match_hists["data"]["nominal"]
-        print(data_nominal.Get(probe_dir + "/" + probe_hist).GetEntries())
-
-        data_match_1_bin = data_match_nominal.Clone()
-        data_match_1_bin.Rebin2D(xbins, ybins)
-        data_probe_1_bin = data_probe_nominal.Clone()
-        data_probe_1_bin.Rebin2D(xbins, ybins)
-        data_eff_1_bin = TEfficiency(data_match_1_bin, data_probe_1_bin)
-
-        data_1_bin = hists["data"]["nominal"].Clone()
-        data_1_bin.Reset()
-        data_1_bin.Rebin2D(xbins, ybins)
-        global_bin = data_eff_1_bin.GetGlobalBin(1, 1)
-        data_eff = data_eff_1_bin.GetEfficiency(global_bin)
-        data_stat_err = data_eff_1_bin.GetEfficiencyErrorUp(global_bin)
-
-        #MC inclusive eff
-        mc_match_nominal = match_hists["mc"]["nominal"]
-        mc_match_1_bin = mc_match_nominal.Clone()
-        mc_match_1_bin.Rebin2D(xbins, ybins)
-        mc_probe_1_bin = mc_probe_nominal.Clone()
-        mc_probe_1_bin.Rebin2D(xbins, ybins)
-        mc_eff_1_bin = TEfficiency(mc_match_1_bin, mc_probe_1_bin)
-
-        mc_1_bin = hists["mc"]["nominal"].Clone()
-        mc_1_bin.Reset()
-        mc_1_bin.Rebin2D(xbins, ybins)
-        mc_eff = mc_eff_1_bin.GetEfficiency(global_bin)
-        print(type(mc_match_1_bin), type(mc_probe_1_bin))
-        print(type(mc_eff_1_bin))
-        print(mc_eff)
-        mc_stat_err = mc_eff_1_bin.GetEfficiencyErrorUp(global_bin)
-
-        # Error propagation:
-        # err_sf = sf*(err_data_eff/data_eff + err_mc_eff/mc_eff)
-        # TODO: is this the right way to deal with divide-by-zero errors?
-        if mc_eff == 0:
-            logging.warning("MC efficiency is zero -- skipping!")
-        else:
-            scale_factor = data_eff / mc_eff
-        sfstaterr = 0 if mc_eff == 0 or data_eff == 0 else (scale_factor * (
-            data_stat_err / data_eff + mc_stat_err / mc_eff))
-
-    # Looping through each bin of each histogram
-    # to grab the nominal efficiency and the systematic variations
-    logging.debug('Now starting loop over bins...')
-    for i in range(1, xbins + 2):
-        for j in range(1, ybins + 2):
-            # Debugging particular bin issues
-            # print("Bin : ("+str(i)+","+str(j)+")")
-
-            # Global bin # to used w GetEfficiency()
-            # and GetEfficiencyErrorUp/Low()
-            global_bin = effs["data"]["nominal"].GetGlobalBin(i, j)
-
-            # Getting data, MC nominal efficiency and up/down stat bin errors:
-            dnom = effs["data"]["nominal"].GetEfficiency(global_bin)
-            dstatup = effs["data"]["nominal"].GetEfficiencyErrorUp(global_bin)
-            dstatdw = effs["data"]["nominal"].GetEfficiencyErrorLow(global_bin)
-            mcnom = effs["mc"]["nominal"].GetEfficiency(global_bin)
-            mcstatup = effs["mc"]["nominal"].GetEfficiencyErrorUp(global_bin)
-            mcstatdw = effs["mc"]["nominal"].GetEfficiencyErrorLow(global_bin)
-
-            # Fill nominal + statUp/statDw data, MC efficiency TH2's
-            hists["data"]["nominal"].SetBinContent(i, j, dnom)
-            hists["mc"]["nominal"].SetBinContent(i, j, mcnom)
-            data_stat_up.SetBinContent(i, j, dnom + dstatup)
-            mc_stat_up.SetBinContent(i, j, mcnom + mcstatup)
-            data_stat_dw.SetBinContent(i, j, dnom - dstatdw)
-            mc_stat_dw.SetBinContent(i, j, mcnom - dstatdw)
-
-            # Error propagation for SF stat up/down hists, in each bin
-            if make_sf_plots:
-                if mcnom != 0:
-                    sfbinerrup = (dnom/mcnom) * (dstatup/dnom + mcstatup/mcnom)
-                    sf_stat_up.SetBinContent(i, j, dnom/mcnom + sfbinerrup)
-                    sfbinerrdw = (dnom/mcnom) * (dstatdw/dnom + mcstatdw/mcnom)
-                    sf_stat_dw.SetBinContent(i, j, dnom/mcnom - sfbinerrdw)
-                else:
-                    sf_stat_up.SetBinContent(i, j, 0)
-                    sf_stat_dw.SetBinContent(i, j, 0)
-
-            # Getting data, MC up/down systematic bin errors
-            # Ints to keep track of systematic variations summed in quadrature:
-            dsyst_tot = 0
-            mcsyst_tot = 0
-
-            # Isolation envelope systematic for the bin:
-            # Data
-            dsyst_tight = effs[
-                "data"]["isoTight_VarRad"].GetEfficiency(global_bin)
-            dsyst_tight_pflow = effs[
-                "data"]["isoPflowTight_VarRad"].GetEfficiency(global_bin)
-            if abs(dnom - dsyst_tight) > abs(dnom - dsyst_tight_pflow):
-                dsyst_iso = dnom - dsyst_tight
-                hists["data"]["isoEnv"].SetBinContent(i, j, dsyst_tight)
-            if abs(dnom - dsyst_tight) <= abs(dnom - dsyst_tight_pflow):
-                dsyst_iso = dnom - dsyst_tight_pflow
-                hists["data"]["isoEnv"].SetBinContent(i, j, dsyst_tight_pflow)
-            # Add iso syst in quadrature to total syst bin error
-            dsyst_tot += (dsyst_iso**2)
-
-            # MC
-            mcsyst_tight = effs[
-                "mc"]["isoTight_VarRad"].GetEfficiency(global_bin)
-            mcsyst_tight_pflow = effs[
-                "mc"]["isoPflowTight_VarRad"].GetEfficiency(global_bin)
-            # If tight systematic larger than TTO systematic
-            if abs(mcnom - mcsyst_tight) > abs(mcnom - mcsyst_tight_pflow):
-                mcsyst_iso = mcnom - mcsyst_tight
-                hists["mc"]["isoEnv"].SetBinContent(i, j, mcsyst_tight)
-                #SF inclusive isoEnv value
-                if print_sf_values:
-                    n_data_matches["isoEnv"] += match_hists["data"][
-                        "isoTight_VarRad"].GetBinContent(i, j)
-                    n_data_probes["isoEnv"] += probe_hists["data"][
-                        "isoTight_VarRad"].GetBinContent(i, j)
-                    n_mc_matches["isoEnv"] += match_hists["mc"][
-                        "isoTight_VarRad"].GetBinContent(i, j)
-                    n_mc_probes["isoEnv"] += probe_hists["mc"][
-                        "isoTight_VarRad"].GetBinContent(i, j)
-            # If TTO systematic larger than tight systematic
-            elif abs(mcnom - mcsyst_tight) <= abs(mcnom - mcsyst_tight_pflow):
-                mcsyst_iso = mcnom - mcsyst_tight_pflow
-                hists["mc"]["isoEnv"].SetBinContent(i, j, mcsyst_tight_pflow)
-                # SF inclusive isoEnv value
-                if print_sf_values:
-                    n_data_matches["isoEnv"] += match_hists["data"][
-                        "isoPflowTight_VarRad"].GetBinContent(i, j)
-                    n_data_probes["isoEnv"] += probe_hists["data"][
-                        "isoPflowTight_VarRad"].GetBinContent(i, j)
-                    n_mc_matches["isoEnv"] += match_hists["mc"][
-                        "isoPflowTight_VarRad"].GetBinContent(i, j)
-                    n_mc_probes["isoEnv"] += probe_hists["mc"][
-                        "isoPflowTight_VarRad"].GetBinContent(i, j)
-            # Add iso syst in quadrature to total syst bin error
-            mcsyst_tot += (mcsyst_iso**2)
-
-            # Get non-isolation systematics for the bin:
-            for k in hists["data"]:
-                if ("nominal" not in k and "isoEnv" not in k):
-                    #Data:
-                    dsyst = effs["data"][k].GetEfficiency(global_bin)
-                    hists["data"][k].SetBinContent(i, j, dsyst)
-                    if not k.startswith("iso"):
-                        dsyst_tot += ((dnom - dsyst)**2)
-                    #MC:
-                    mcsyst = effs["mc"][k].GetEfficiency(global_bin)
-                    hists["mc"][k].SetBinContent(i, j, mcsyst)
-                    if not k.startswith("iso"):
-                        mcsyst_tot += ((mcnom - mcsyst)**2)
-                # SF values
-                if print_sf_values and "isoEnv" not in k:
-                    n_data_matches[k] += match_hists[
-                        "data"][k].GetBinContent(i, j)
-                    n_data_probes[k] += probe_hists[
-                        "data"][k].GetBinContent(i, j)
-                    n_mc_matches[k] += match_hists[
-                        "mc"][k].GetBinContent(i, j)
-                    n_mc_probes[k] += probe_hists[
-                        "mc"][k].GetBinContent(i, j)
-
-            # Finally, set the bin content of the
-            # Syst Up/Dw plots = nominal efficiency + total syst variation
-            data_syst_up.SetBinContent(i, j, dnom + math.sqrt(dsyst_tot))
-            data_syst_dw.SetBinContent(i, j, dnom - math.sqrt(dsyst_tot))
-            mc_syst_up.SetBinContent(i, j, mcnom + math.sqrt(mcsyst_tot))
-            mc_syst_dw.SetBinContent(i, j, mcnom - math.sqrt(mcsyst_tot))
-
-            # Fill syst up/down plots
-            if make_sf_plots:
-                if mcnom != 0 and math.sqrt(mcsyst_tot) != 0:
-                    sf_syst_up.SetBinContent(
-                        i, j, (dnom + math.sqrt(dsyst_tot)) / (
-                            mcnom + math.sqrt(mcsyst_tot)))
-                    sf_syst_dw.SetBinContent(
-                        i, j, (dnom - math.sqrt(dsyst_tot)) / (
-                            mcnom - math.sqrt(mcsyst_tot)))
-                else:
-                    sf_syst_up.SetBinContent(i, j, 0)
-                    sf_syst_dw.SetBinContent(i, j, 0)
-                for k in hists["data"]:
-                    sf_hists[k] = hists["data"][k].Clone()
-                    sf_hists[k].Divide(hists["mc"][k])
-
-    # If inclusive SF values requested,
-    # get them by dividing total matches/probes for data and mc
-    if print_sf_values:
-        for k in hists["data"]:
-            # TODO: is this the right way to deal with /0 errors?
-            if n_data_probes[k] == 0 or n_mc_probes[k] == 0:
-                sf_values[k] = 0
-            else:
-                sf_values[k] = (n_data_matches[k] / n_data_probes[k]) / (
-                    n_mc_matches[k] / n_mc_probes[k])
 
-    # Create/update systematics Efficiencies TFile
-    # make efficiency ROOT files
+def sf_filepath_for(output_dir, year, version, debug, variations=None):
+    """Path of the separate SF plots file."""
+    suffix = variations_suffix(variations)
     if debug:
-        effs_filepath = os.path.join(output_dir, "debug.root")
-        # test output file
+        sf_filename = "debug_SF%s.root" % suffix
     else:
-        # Change ntuple version to match your inputs!
-        # outfile named in format for SF tool
-        effs_filepath = os.path.join(
-            output_dir, 'muontrigger_sf_20%s_mc%s_%s.root' %
-            (year, montecarlo, version))
-    logging.info("Will output data, MC efficiencies to %s", effs_filepath)
-    effs_file = TFile(effs_filepath, 'update')
+        sf_filename = "SFPlots_%s_%s%s.root" % (year, version, suffix)
+    return os.path.join(output_dir, sf_filename)
+
+
+def eff_hists_from_results(template, region, results):
+    """Make the output eff hists, {"data": {name: hist}, "mc": {...}}."""
+    eff_hists = {"data": {}, "mc": {}}
+    for data_mc in ["data", "mc"]:
+        for name, contents in sorted(results[data_mc].items()):
+            key = "eff_etaphi_fine_%s_%s_%s" % (region.lower(), data_mc, name)
+            eff_hists[data_mc][name] = filled_clone(template, key, contents)
+    return eff_hists
+
+
+def sf_hists_from_results(template, region, results):
+    """Make the output SF hists, {name: hist}."""
+    sf_hists = {}
+    for name, contents in sorted(results["sf"].items()):
+        key = "sf_%s_%s" % (region.lower(), name)
+        sf_hists[name] = filled_clone(template, key, contents)
+    return sf_hists
+
+
+def write_eff_hists(effs_file, quality, period, trigger, region, eff_hists):
+    """Write eff hists to the right directory of an open TFile."""
+    from ROOT import TObject
     # Create directory
     # (trigger may or may not contain _RM, replace does nothing if not)
     dir_name = quality + "/Period" + period + "/" +\
         trigger.replace("_RM", "") + "/"
-
     logging.debug(" - Directory: %s", dir_name)
     effs_file.mkdir(dir_name)
     effs_file.cd(dir_name)
     # Put corresponding plots into working point directory
-    #Data:
-    hists["data"]["nominal"].Write("eff_etaphi_fine_%s_data_nominal" % (
-        region.lower()), TObject.kOverwrite)
-    data_syst_up.Write("eff_etaphi_fine_%s_data_syst_up" % (
-        region.lower()), TObject.kOverwrite)
-    data_syst_dw.Write("eff_etaphi_fine_%s_data_syst_down" % (
-        region.lower()), TObject.kOverwrite)
-    data_stat_up.Write("eff_etaphi_fine_%s_data_stat_up" % (
-        region.lower()), TObject.kOverwrite)
-    data_stat_dw.Write("eff_etaphi_fine_%s_data_stat_down" % (
-        region.lower()), TObject.kOverwrite)
-    for k in sorted(hists["data"].keys()):
-        if k != "dnominal":
-            hists["data"][k].Write("eff_etaphi_fine_%s_data_%s" % (
-                region.lower(), k), TObject.kOverwrite)
-    #MC:
-    hists["mc"]["nominal"].Write("eff_etaphi_fine_%s_mc_nominal" % (
-        region.lower()), TObject.kOverwrite)
-    mc_syst_up.Write("eff_etaphi_fine_%s_mc_syst_up" % (
-        region.lower()), TObject.kOverwrite)
-    mc_syst_dw.Write("eff_etaphi_fine_%s_mc_syst_down" % (
-        region.lower()), TObject.kOverwrite)
-    mc_stat_up.Write("eff_etaphi_fine_%s_mc_stat_up" % (
-        region.lower()), TObject.kOverwrite)
-    mc_stat_dw.Write("eff_etaphi_fine_%s_mc_stat_down" % (
-        region.lower()), TObject.kOverwrite)
-    for k in sorted(hists["mc"].keys()):
-        if k != "nominal":
-            hists["mc"][k].Write("eff_etaphi_fine_%s_mc_%s" % (
-                region.lower(), k), TObject.kOverwrite)
-
-    # Save all data, mc (and SF, if SF plots made) hists as pngs
-    if save_pngs:
-        # Directory
-        png_outdir = os.path.join(output_dir, "savePNGs_%s/" % (year))
-        logging.info("savePNGs = True! Will save PNGs to: %s", png_outdir)
-        if not os.path.exists(png_outdir):
-            os.mkdir(png_outdir)
-        # prefix for hist titles
-        title_prefix = "%s_%s_%s_etaphi_fine_%s_" % (
-            quality, period, trigger.replace("_RM", ""), region.lower())
-        gROOT.SetBatch()
-        # Data stat/syst up/down
-        draw_hist(png_outdir, title_prefix, data_syst_up, "dataEff_syst_up")
-        draw_hist(png_outdir, title_prefix, data_syst_dw, "dataEff_syst_dw")
-        draw_hist(png_outdir, title_prefix, data_stat_up, "dataEff_stat_up")
-        draw_hist(png_outdir, title_prefix, data_stat_dw, "dataEff_stat_dw")
-        # MC stat/syst up/down
-        draw_hist(png_outdir, title_prefix, mc_syst_up, "mcEff_syst_up")
-        draw_hist(png_outdir, title_prefix, mc_syst_dw, "mcEff_syst_dw")
-        draw_hist(png_outdir, title_prefix, mc_stat_up, "mcEff_stat_up")
-        draw_hist(png_outdir, title_prefix, mc_stat_dw, "mcEff_stat_dw")
-        # SF stat/syst up/down
-        if make_sf_plots:
-            draw_hist(png_outdir, title_prefix, sf_syst_up, "SF_syst_up")
-            draw_hist(png_outdir, title_prefix, sf_syst_dw, "SF_syst_dw")
-            draw_hist(png_outdir, title_prefix, sf_stat_up, "SF_stat_up")
-            draw_hist(png_outdir, title_prefix, sf_stat_dw, "SF_stat_dw")
-        # Everything else
-        for k in hists["data"]:
-            draw_hist(
-                png_outdir, title_prefix,
-                hists["data"][k], "dataEff_{}".format(k))
-            draw_hist(
-                png_outdir, title_prefix,
-                hists["mc"][k], "mcEff_{}".format(k))
-            if make_sf_plots:
-                draw_hist(png_outdir, title_prefix, sf_hists[k], "SF_{}".format(k))
-
-    # Create separate SF TFile
+    for data_mc in ["data", "mc"]:
+        for name, hist in sorted(eff_hists[data_mc].items()):
+            hist.Write("eff_etaphi_fine_%s_%s_%s" % (
+                region.lower(), data_mc, name), TObject.kOverwrite)
+
+
+def write_sf_hists(sf_file, quality, period, trigger, region, sf_hists):
+    """Write SF hists to the right directory of an open TFile."""
+    from ROOT import TObject
+    dir_name = quality + "/Period" + period + "/" + trigger + "/"
+    logging.debug(" - Directory: %s", dir_name)
+    sf_file.mkdir(dir_name)
+    sf_file.cd(dir_name)
+    for name, hist in sorted(sf_hists.items()):
+        hist.Write("sf_%s_%s" % (region.lower(), name), TObject.kOverwrite)
+
+
+def save_selection_pngs(png_queue, output_dir, year, period, trigger, region,
+                        quality, binning, results, make_sf_plots):
+    """
+    Queue all data, mc (and SF, if SF plots made) hists to be saved as pngs
+    (see png_rendering).
+    """
+    # Directory
+    png_outdir = os.path.join(output_dir, "savePNGs_%s/" % (year))
+    logging.info("savePNGs = True! Will save PNGs to: %s", png_outdir)
+    if not os.path.exists(png_outdir):
+        os.makedirs(png_outdir, exist_ok=True)
+    # prefix for hist titles
+    title_prefix = "%s_%s_%s_etaphi_fine_%s_" % (
+        quality, period, trigger.replace("_RM", ""), region.lower())
+    sf_arrays = results["sf"] if make_sf_plots else {}
+    with instrumentation.timer("png"):
+        for prefix, arrays in [("dataEff_", results["data"]),
+                               ("mcEff_", results["mc"]),
+                               ("SF_", sf_arrays)]:
+            for name, contents in sorted(arrays.items()):
+                png_queue.put(png_outdir, title_prefix,
+                              prefix + name.replace("_down", "_dw"),
+                              binning, contents)
+
+
+def print_sf_table(year, period, region, trigger, quality, results):
+    """Print inclusive SF for nominal, systematic plots."""
+    sf_values = results["sf_values"]
+    sfstaterr = results["sf_stat_err"]
+    print("Scale Factor Values: " + ", ".join([
+        trigger, region, quality, year, period]))
+    placeholder = 0
+    print("{:<15} {:<15} {:<15}".format('Systematic', 'Value', '% Diff'))
+    print("{:<15} {:<15} {:<15} {:<15}".format(
+        "nominal", round(sf_values["nominal"], 5),
+        "N/A", "Stat Error: " + str(sfstaterr)))
+    for k, sf_val in sorted(sf_values.items()):
+        if (k != "nominal" and k != "TotSyst"):
+            placeholder += (sf_val - sf_values["nominal"])**2
+            sf_rounded = round(sf_val, 5)
+            if sf_values["nominal"] == 0:
+                pct_diff = -1
+            else:
+                pct_diff = round(
+                    (sf_val - sf_values["nominal"]) / sf_values["nominal"],
+                    5) * 100
+            print("{:<15} {:<15} {:<15}".format(
+                k, sf_rounded, pct_diff))
+    sf_values["TotSyst"] = sf_values["nominal"] + math.sqrt(placeholder)
+    tot_sf_rounded = round(sf_values["TotSyst"], 5)
+    tot_pct_diff = -1 if sf_values["nominal"] == 0 else round(
+        (sf_values["TotSyst"]-sf_values["nominal"]
+        )/sf_values["nominal"], 5) * 100
+    print(
+        "{:<15} {:<15} {:<15}".format(
+            "Total", tot_sf_rounded, tot_pct_diff))
+
+
+def open_output_files(output_dir, year, version, debug, make_sf_plots,
+                      shard_name=None, variations=None):
+    """
+    Open (effs_file, sf_file) for updating, sf_file is None if no SFs.
+
+    If shard_name is given, open fresh shards of those files instead
+    (see sf_shards), to be merged later on with merge_output_shards.
+    If only some variations are used, the files are separate ones
+    (see variations_suffix).
+    """
+    filepaths = [effs_filepath_for(
+        output_dir, year, version, debug, variations)]
+    logging.info("Will output data, MC efficiencies to %s", filepaths[0])
     if make_sf_plots:
-        if debug:
-            sf_filename = "debug_SF.root"
+        filepaths.append(sf_filepath_for(
+            output_dir, year, version, debug, variations))
+        logging.info(" ---> Will output SFs to file %s", filepaths[1])
+
+    with instrumentation.timer("write"):
+        if shard_name is None:
+            from ROOT import TFile
+            out_files = [TFile(filepath, 'update') for filepath in filepaths]
         else:
-            sf_filename = "SFPlots_%s_%s.root" % (year, version)
-        sf_filepath = os.path.join(output_dir, sf_filename)
-        logging.info(" ---> Will output SFs to file %s", sf_filepath)
-        sf_file = TFile(sf_filepath, 'update')
-        dir_name = quality + "/Period" + period + "/" + trigger + "/"
-        logging.debug(" - Directory: %s", dir_name)
-        sf_file.mkdir(dir_name)
-        sf_file.cd(dir_name)
-        sf_hists["nominal"].Write("sf_%s_nominal" % (region.lower()))
-        sf_syst_up.Write("sf_%s_syst_up" % (
-            region.lower()), TObject.kOverwrite)
-        sf_syst_dw.Write("sf_%s_syst_down" % (
-            region.lower()), TObject.kOverwrite)
-        sf_stat_up.Write("sf_%s_stat_up" % (
-            region.lower()), TObject.kOverwrite)
-        sf_stat_dw.Write("sf_%s_stat_down" % (
-            region.lower()), TObject.kOverwrite)
-        for k in sorted(sf_hists.keys()):
-            if k != "nominal":
-                sf_hists[k].Write("sf_%s_%s" % (
-                    region.lower(), k), TObject.kOverwrite)
-
-    # Print inclusive SF for nominal, systematic plots
+            logging.info("Writing to shard %s", shard_name)
+            out_files = [open_shard(filepath, shard_name)
+                         for filepath in filepaths]
+    effs_file = out_files[0]
+    sf_file = out_files[1] if make_sf_plots else None
+    return effs_file, sf_file
+
+
+def close_output_files(effs_file, sf_file, shards=False):
+    """Close files opened by open_output_files."""
+    with instrumentation.timer("write"):
+        for out_file in [effs_file, sf_file]:
+            if out_file is None:
+                continue
+            if shards:
+                close_shard(out_file)
+            else:
+                out_file.Close()
+
+
+def merge_output_shards(output_dir, year, version, debug, make_sf_plots,
+                        variations=None):
+    """Build the per-year output file(s) from the shards written by jobs."""
+    merge_shards(effs_filepath_for(
+        output_dir, year, version, debug, variations))
+    if make_sf_plots:
+        merge_shards(sf_filepath_for(
+            output_dir, year, version, debug, variations))
+
+
+def png_queue_for(save_pngs, png_jobs):
+    """Queue to draw PNGs with png_jobs processes, None if not saving any."""
+    return PNGQueue(png_jobs) if save_pngs else None
+
+
+def write_selection_outputs(effs_file, sf_file, year, period, region,
+                            trigger, quality, binning, results, output_dir,
+                            print_sf_values, png_queue=None):
+    """
+    Write/draw/print everything asked for, for one computed selection.
+
+    sf_file is None if SF plots weren't requested,
+    png_queue None if PNGs weren't.
+    """
+    with instrumentation.timer("hists"):
+        # Empty TH2 with the right binning, all output hists are clones of it
+        template = empty_hist(binning, "template")
+        eff_hists = eff_hists_from_results(template, region, results)
+        sf_hists = {}
+        if sf_file is not None:
+            sf_hists = sf_hists_from_results(template, region, results)
+
+    with instrumentation.timer("write"):
+        write_eff_hists(
+            effs_file, quality, period, trigger, region, eff_hists)
+        if sf_file is not None:
+            write_sf_hists(
+                sf_file, quality, period, trigger, region, sf_hists)
+
+    if png_queue is not None:
+        save_selection_pngs(png_queue, output_dir, year, period, trigger,
+                            region, quality, binning, results,
+                            sf_file is not None)
+
     if print_sf_values:
-        print("Scale Factor Values: " + ", ".join([
-            trigger, region, quality, year, period]))
-        placeholder = 0
-        print("{:<15} {:<15} {:<15}".format('Systematic', 'Value', '% Diff'))
-        print("{:<15} {:<15} {:<15} {:<15}".format(
-            "nominal", round(sf_values["nominal"], 5),
-            "N/A", "Stat Error: " + str(sfstaterr)))
-        for k, sf_val in sorted(sf_values.items()):
-            if (k != "nominal" and k != "TotSyst"):
-                placeholder += (sf_val - sf_values["nominal"])**2
-                sf_rounded = round(sf_val, 5)
-                if sf_values["nominal"] == 0:
-                    pct_diff = -1
-                else:
-                    pct_diff = round(
-                        (sf_val - sf_values["nominal"]) / sf_values["nominal"],
-                        5) * 100
-                print("{:<15} {:<15} {:<15}".format(
-                    k, sf_rounded, pct_diff))
-        sf_values["TotSyst"] = sf_values["nominal"] + math.sqrt(placeholder)
-        tot_sf_rounded = round(sf_values["TotSyst"], 5)
-        tot_pct_diff = -1 if sf_values["nominal"] == 0 else round(
-            (sf_values["TotSyst"]-sf_values["nominal"]
-            )/sf_values["nominal"], 5) * 100
-        print(
-            "{:<15} {:<15} {:<15}".format(
-                "Total", tot_sf_rounded, tot_pct_diff))
-
-
-def run_over_everything():
-    """Run make_2d_eff_hists"""
-    for trigger_type in c.TRIGGER_TYPES:
-        # for now
-        trigger_type = "SingleMuonTriggers"
-        single = (trigger_type == "SingleMuonTriggers")
-        for number_year in c.YEARS:
-            year = str(number_year)[2:]
-            for period in periods(number_year):
-                # for some reason only barrel and endcap seem to have run
-                # (in wtph)
-                for region in ["Barrel", "Endcap"]:
-                    for trigger in triggers_in_period(single,
-                                                      number_year,
-                                                      period):
-                        for quality in c.WORKING_POINTS:
-                            version = c.NTUPLE_VERSION
-                            input_dir = DEFAULT_IN_DIR
-                            output_dir = DEFAULT_OUT_DIR
-                            debug = False
-                            make_sf_plots = False
-                            print_sf_values = False
-                            save_pngs = False
-                            make_2d_eff_hists(
-                                year, period, region, trigger_type, trigger,
-                                quality, version, input_dir, output_dir,
-                                make_sf_plots, print_sf_values, debug,
-                                save_pngs)
+        print_sf_table(year, period, region, trigger, quality, results)
 
 
-def main():
-    """Make 2D Efficiency Histograms."""
+def make_2d_eff_hists(year, period, region, trigger_type, trigger, quality,
+                      version, input_dir, output_dir, make_sf_plots,
+                      print_sf_values, debug, save_pngs, shards=False,
+                      cache_dir=None, variations=None, columnar=False,
+                      merged=False, png_jobs=1):
+    """
+    Make 2D Efficiency histograms for all the given parameters.
+
+    If shards, write to this job's own shard instead of the per-year file.
+    Inputs are read through a hist cache in cache_dir, unless it's None,
+    or from their columnar versions if columnar.
+    Only the given variations are used, all of them if None.
+    If merged, they're all read from the merged WTPH outputs.
+    PNGs are drawn by png_jobs processes.
+    """
+    logging.info("%s %s %s %s %s", year, period, quality, region,
+                 trigger_type)
+    quiet_root()
+
+    check_period_args(
+        year, period, trigger_type, version, input_dir, output_dir)
+    check_selection_args(year, period, region, trigger_type, trigger, quality)
 
-    run_all = False
+    assert isinstance(make_sf_plots, bool)
+    assert isinstance(print_sf_values, bool)
+    assert isinstance(debug, bool)
+    assert isinstance(save_pngs, bool)
 
-    if run_all:
-        run_over_everything()
+    with instrumentation.scope(year=year, period=period,
+                               trigger_type=trigger_type, quality=quality,
+                               region=region, trigger=trigger):
+        # Load input files
+        logging.debug("Looking for input files in directory: %s", input_dir)
+        var_conf_fmt = input_filepath_fmt(
+            input_dir, year, period, version, trigger_type)
+        input_files = open_input_files(
+            var_conf_fmt, cache_dir, variations, columnar, merged)
+        binning, results = compute_selection(
+            input_files, quality, region, trigger, make_sf_plots,
+            print_sf_values)
+        close_input_files(input_files)
+
+        shard_name = None
+        if shards:
+            shard_name = "_".join([period, quality, region, trigger])
+        effs_file, sf_file = open_output_files(
+            output_dir, year, version, debug, make_sf_plots, shard_name,
+            variations)
+        png_queue = png_queue_for(save_pngs, png_jobs)
+        write_selection_outputs(
+            effs_file, sf_file, year, period, region, trigger, quality,
+            binning, results, output_dir, print_sf_values, png_queue)
+        close_output_files(effs_file, sf_file, shards)
+        if png_queue is not None:
+            png_queue.close()
+
+
+def find_selections(input_file, year, period, trigger_type):
+    """
+    Find every (quality, region, trigger) in a WTPH output.
+
+    Walks ZmumuTPMerged/<quality>MuonProbes_<region>/OC/<trigger>/,
+    skipping anything we don't make SFs for.
+    """
+    number_year = int("20"+year)
+    single = (trigger_type == "SingleMuonTriggers")
+    valid_triggers = triggers_in_period(single, number_year, period)
+    selections = []
+    for sel_dir in input_file.list_dir(c.WTPH_TOP_DIR):
+        probe_sel, _, region = sel_dir.rpartition("_")
+        quality = probe_sel.replace("MuonProbes", "")
+        if (quality not in c.WORKING_POINTS or
+                region not in c.DETECTOR_REGIONS):
+            logging.debug("Skipping directory %s", sel_dir)
+            continue
+        for trigger in input_file.list_dir(
+                c.WTPH_TOP_DIR+"/"+sel_dir+"/OC"):
+            if trigger not in valid_triggers:
+                logging.debug("Skipping trigger %s in %s", trigger, sel_dir)
+                continue
+            selections.append((quality, region, trigger))
+    return selections
+
+
+def compute_period(year, period, trigger_type, version, input_dir,
+                   make_sf_plots, print_sf_values, cache_dir=None,
+                   variations=None, columnar=False, merged=False):
+    """
+    Compute every selection in a period, without writing anything.
+
+    Input files are opened once for the whole period.
+    Returns a list of (quality, region, trigger, binning, results).
+    """
+    # (the columnar inputs don't need ROOT at all)
+    if not columnar:
+        quiet_root()
+
+    with instrumentation.scope(year=year, period=period,
+                               trigger_type=trigger_type):
+        var_conf_fmt = input_filepath_fmt(
+            input_dir, year, period, version, trigger_type)
+        input_files = open_input_files(
+            var_conf_fmt, cache_dir, variations, columnar, merged)
+        with instrumentation.timer("fetch"):
+            selections = find_selections(
+                input_files["data"]["nominal"], year, period, trigger_type)
+        logging.info("Found %s selections for 20%s %s",
+                     len(selections), year, period)
+
+        computed = []
+        for quality, region, trigger in selections:
+            logging.debug("%s %s %s", quality, region, trigger)
+            with instrumentation.scope(quality=quality, region=region,
+                                       trigger=trigger):
+                binning, results = compute_selection(
+                    input_files, quality, region, trigger, make_sf_plots,
+                    print_sf_values)
+                instrumentation.count("selections")
+            computed.append((quality, region, trigger, binning, results))
+        close_input_files(input_files)
+    return computed
+
+
+def write_period_outputs(effs_file, sf_file, year, period, trigger_type,
+                         computed, output_dir, print_sf_values,
+                         png_queue=None):
+    """Write/draw/print everything asked for, for a computed period."""
+    for quality, region, trigger, binning, results in computed:
+        with instrumentation.scope(year=year, period=period,
+                                   trigger_type=trigger_type,
+                                   quality=quality, region=region,
+                                   trigger=trigger):
+            write_selection_outputs(
+                effs_file, sf_file, year, period, region, trigger, quality,
+                binning, results, output_dir, print_sf_values, png_queue)
+
+
+def _compute_period_task(task):
+    """
+    Unpack a task tuple for compute_period, for use with a process pool.
+
+    Also returns what was timed/counted, so it gets back from the workers.
+    """
+    year, period = task[0], task[1]
+    computed = compute_period(*task)
+    return year, period, computed, instrumentation.take_records()
+
+
+def make_2d_eff_period(year, period, trigger_type, version, input_dir,
+                       output_dir, make_sf_plots, print_sf_values, debug,
+                       save_pngs, shards=False, cache_dir=None,
+                       variations=None, columnar=False, merged=False,
+                       png_jobs=1):
+    """
+    Make 2D Efficiency histograms for every selection in a period.
+
+    Same outputs as calling make_2d_eff_hists for every quality, region
+    and trigger, but input and output files are only opened once.
+    If shards, write to this job's own shard instead of the per-year file.
+    Inputs are read through a hist cache in cache_dir, unless it's None,
+    or from their columnar versions if columnar.
+    Only the given variations are used, all of them if None.
+    If merged, they're all read from the merged WTPH outputs.
+    PNGs are drawn by png_jobs processes.
+    """
+    logging.info("%s %s %s", year, period, trigger_type)
+    check_period_args(
+        year, period, trigger_type, version, input_dir, output_dir)
+
+    computed = compute_period(year, period, trigger_type, version, input_dir,
+                              make_sf_plots, print_sf_values, cache_dir,
+                              variations, columnar, merged)
+
+    shard_name = period + "_all" if shards else None
+    effs_file, sf_file = open_output_files(
+        output_dir, year, version, debug, make_sf_plots, shard_name,
+        variations)
+    png_queue = png_queue_for(save_pngs, png_jobs)
+    write_period_outputs(effs_file, sf_file, year, period, trigger_type,
+                         computed, output_dir, print_sf_values, png_queue)
+    close_output_files(effs_file, sf_file, shards)
+    if png_queue is not None:
+        png_queue.close()
+
+
+def run_over_everything(input_dir=DEFAULT_IN_DIR, output_dir=DEFAULT_OUT_DIR,
+                        version=c.NTUPLE_VERSION, make_sf_plots=False,
+                        print_sf_values=False, debug=False, save_pngs=False,
+                        jobs=1, cache_dir=None, variations=None,
+                        columnar=False, merged=False, png_jobs=1):
+    """
+    Make 2D Efficiency histograms for every year and period.
+
+    With jobs > 1, periods are computed in a pool of worker processes
+    (ROOT isn't thread-safe). Workers only compute, results come back here
+    and this process is the only one writing the output files.
+    PNGs are drawn by another png_jobs processes.
+    """
+    # for now
+    trigger_type = "SingleMuonTriggers"
+    tasks = []
+    for number_year in c.YEARS:
+        year = str(number_year)[2:]
+        for period in periods(number_year):
+            check_period_args(
+                year, period, trigger_type, version, input_dir, output_dir)
+            tasks.append((year, period, trigger_type, version, input_dir,
+                          make_sf_plots, print_sf_values, cache_dir,
+                          variations, columnar, merged))
+
+    if jobs > 1:
+        # spawn rather than fork, so workers get a clean ROOT
+        pool = multiprocessing.get_context("spawn").Pool(jobs)
+        computed_periods = pool.imap(_compute_period_task, tasks)
     else:
-        options = get_options()
-
-        year = options.year
-        period = options.period
-        region = options.region
-        trigger_type = options.triggerType
-        trigger = options.trigger
-        quality = options.quality
-        version = options.version
-        input_dir = options.inDir
-        output_dir = options.outDir
-        make_sf_plots = options.makeSFPlots
-        print_sf_values = options.printSFValues
-        debug = options.debug
-        save_pngs = options.savePNGs
-
-        make_2d_eff_hists(
-            year, period, region, trigger_type, trigger, quality, version,
-            input_dir, output_dir, make_sf_plots, print_sf_values, debug,
-            save_pngs)
+        pool = None
+        computed_periods = map(_compute_period_task, tasks)
+
+    # one output file per year, kept open until everything is written
+    output_files = {}
+    png_queue = png_queue_for(save_pngs, png_jobs)
+    for year, period, computed, records in computed_periods:
+        instrumentation.add_records(records)
+        if year not in output_files:
+            output_files[year] = open_output_files(
+                output_dir, year, version, debug, make_sf_plots,
+                variations=variations)
+        effs_file, sf_file = output_files[year]
+        write_period_outputs(effs_file, sf_file, year, period, trigger_type,
+                             computed, output_dir, print_sf_values, png_queue)
+
+    for effs_file, sf_file in output_files.values():
+        close_output_files(effs_file, sf_file)
+    if png_queue is not None:
+        png_queue.close()
+    if pool is not None:
+        pool.close()
+        pool.join()
+
+
+def main():
+    """Make 2D Efficiency Histograms."""
+    options = get_options()
+
+    year = options.year
+    period = options.period
+    region = options.region
+    trigger_type = options.triggerType
+    trigger = options.trigger
+    quality = options.quality
+    version = options.version
+    input_dir = options.inDir
+    output_dir = options.outDir
+    make_sf_plots = options.makeSFPlots
+    print_sf_values = options.printSFValues
+    debug = options.debug
+    save_pngs = options.savePNGs
+    cache_dir = None if options.noCache else options.cacheDir
+    variations = None
+    if options.variations is not None:
+        variations = options.variations.split(",")
+
+    try:
+        if options.mergeShards:
+            merge_output_shards(
+                output_dir, year, version, debug, make_sf_plots, variations)
+        elif options.runAll:
+            run_over_everything(
+                input_dir, output_dir, version, make_sf_plots,
+                print_sf_values, debug, save_pngs, options.jobs, cache_dir,
+                variations, options.columnar, options.merged,
+                options.pngJobs)
+        elif options.allSelections:
+            make_2d_eff_period(
+                year, period, trigger_type, version, input_dir, output_dir,
+                make_sf_plots, print_sf_values, debug, save_pngs,
+                options.shards, cache_dir, variations, options.columnar,
+                options.merged, options.pngJobs)
+        else:
+            make_2d_eff_hists(
+                year, period, region, trigger_type, trigger, quality,
+                version, input_dir, output_dir, make_sf_plots,
+                print_sf_values, debug, save_pngs, options.shards, cache_dir,
+                variations, options.columnar, options.merged,
+                options.pngJobs)
+    finally:
+        # (also for failed jobs, to see how far they got)
+        if options.telemetry is not None:
+            instrumentation.write_records(options.telemetry)
 
 
 if __name__ == "__main__":
@@ -2,9 +2,31 @@
 A script to show how I made run2 configs.
 
 Hopefully this will make it a little easier to do run3 things?
+
+Configs are only rewritten if they change. Every (trigger type, year,
+period, variation) whose config or anything it imports changed is listed
+in constants.CHANGED_CONFIGS_PATH, so only those need WTPH re-running.
+
+Each period also gets a merged config with every variation in it
+(variation constants.MERGED_VARIATION, see merged_config).
+
+Templates are read once, and each period's nominal config is only kept in
+memory, all its variations are made straight from that text, so the only
+disk I/O is one write per changed config.
+
+python make_configs.py [-j 8]
+
+With -j/--jobs, periods are made in that many processes. Apart from the
+detector regions config, which is made first, no two periods share a file.
 """
+import json
+import multiprocessing
+import optparse
 import constants
-from nominal_config import make_nominal_config
+from config_files import remove_stale
+from merged_config import make_merged_config
+from nominal_config import nominal_text
+from run_config import parse_config
 from run_numbers import periods
 from create_dirs import create_dirs
 from basic_config import make_basic_config
@@ -12,34 +34,102 @@ from matches_config import make_match_configs
 from variation_config import make_variation_config
 from detector_regions_config import make_detector_regions_config
 
-create_dirs()
-
-# make detector regions file
-make_detector_regions_config()
-
-for year in constants.YEARS:
-    for period in periods(year):
-        # make trigger match files
-        single_match_config = make_match_configs(year, period, single=True)
-        multi_match_config = make_match_configs(year, period, single=False)
-
-        # make basic config file
-        single_basic_filename = make_basic_config(
-            single_match_config, year, period, single=True)
-        multi_basic_filename = make_basic_config(
-            multi_match_config, year, period, single=False)
-
-        # make nominal config
-        SINGLE_NOMINAL_CONFIG = make_nominal_config(
-            single=True, year=year, period=period,
-            basic_filename=single_basic_filename)
-        MULTI_NOMINAL_CONFIG = make_nominal_config(
-            single=False, year=year, period=period,
-            basic_filename=multi_basic_filename)
-
-        for variation in constants.VARIATIONS:
-            # make variation file
-            make_variation_config(
-                SINGLE_NOMINAL_CONFIG, variation, year, period, single=True)
-            make_variation_config(
-                MULTI_NOMINAL_CONFIG, variation, year, period, single=False)
+TRIGGER_TYPES = [(True, constants.SINGLE_MUON_DIR),
+                 (False, constants.MULTI_LEG_DIR)]
+
+
+def make_period_configs(year, period, single, trigger_type, regions_changed):
+    """
+    Make every config of one period and trigger type.
+
+    Returns (filenames written, [changed config]), see module docstring.
+    """
+    # make trigger match file
+    match_config, match_changed = make_match_configs(
+        year, period, single=single)
+
+    # make basic config file
+    basic_filename, basic_changed = make_basic_config(
+        match_config, year, period, single=single)
+
+    # make nominal config (in memory only, parsed once for all variations)
+    nominal = parse_config(nominal_text(single, year, period))
+
+    written = [match_config, basic_filename]
+    # every variation imports the basic (and so matches) config
+    imports_changed = regions_changed or match_changed or basic_changed
+    var_configs = []
+    for variation in constants.VARIATIONS:
+        # make variation file
+        var_configs.append((variation,) + make_variation_config(
+            nominal, variation, year, period, single=single))
+    # make file with all variations in it
+    var_configs.append((constants.MERGED_VARIATION,) + make_merged_config(
+        nominal, year, period, single=single))
+
+    changed_configs = []
+    for variation, var_filename, var_changed in var_configs:
+        written.append(var_filename)
+        if var_changed or imports_changed:
+            changed_configs.append({
+                "trigger_type": trigger_type, "year": year,
+                "period": period, "variation": variation,
+                "path": var_filename})
+    return written, changed_configs
+
+
+def _make_period_configs_task(task):
+    """Unpack a task tuple for make_period_configs, for a process pool."""
+    return make_period_configs(*task)
+
+
+def get_options():
+    """Get options from the command line."""
+    parser = optparse.OptionParser()
+    # number of processes to make configs with
+    parser.add_option('-j', '--jobs', type='int', default=1, dest='jobs')
+    (options, _) = parser.parse_args()
+    return options
+
+
+def main():
+    """Make every config, and list the ones that changed."""
+    options = get_options()
+    create_dirs()
+
+    # make detector regions file
+    detector_regions_filename, regions_changed = \
+        make_detector_regions_config()
+
+    tasks = [(year, period, single, trigger_type, regions_changed)
+             for year in constants.YEARS
+             for period in periods(year)
+             for single, trigger_type in TRIGGER_TYPES]
+    if options.jobs > 1:
+        pool = multiprocessing.Pool(options.jobs)
+        period_configs = pool.map(_make_period_configs_task, tasks)
+        pool.close()
+        pool.join()
+    else:
+        period_configs = [_make_period_configs_task(task) for task in tasks]
+
+    written = [detector_regions_filename]
+    changed_configs = []
+    for period_written, period_changed in period_configs:
+        written += period_written
+        changed_configs += period_changed
+
+    removed = remove_stale(
+        [constants.SINGLE_MUON_DIR, constants.MULTI_LEG_DIR], written)
+    for path in removed:
+        print("Removed stale config", path)
+
+    print(len(changed_configs), "configs changed")
+    for config in changed_configs:
+        print("  {trigger_type} {year} {period} {variation}".format(**config))
+    with open(constants.CHANGED_CONFIGS_PATH, "w", encoding="utf-8") as out:
+        json.dump(changed_configs, out, indent=1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,6 @@
 """Module for making matches configs."""
 
+from config_files import template_text, write_if_changed
 from triggers import get_matches_text
 from constants import ML_MATCHES_TEMPLATE, SM_MATCHES_TEMPLATE,\
     SM_MATCHES_CONFIG_PATH_FMT, ML_MATCHES_CONFIG_PATH_FMT
@@ -11,6 +12,8 @@ def make_match_configs(year, period, single):
     year: str, e.g. 2015
     period: str, e.g. B
     single: bool, true for single muon triggers, false for multi-leg
+
+    Returns (filename, whether it changed).
     """
     # get the right template file
     if single:
@@ -19,8 +22,7 @@ def make_match_configs(year, period, single):
         matches_template_path = ML_MATCHES_TEMPLATE
 
     # get template file text
-    with open(matches_template_path, "r", encoding="utf-8") as matches_file:
-        matches_template_text = matches_file.read()
+    matches_template_text = template_text(matches_template_path)
 
     # put trigger match blocks here
     matches_file_text = matches_template_text.replace(
@@ -30,6 +32,5 @@ def make_match_configs(year, period, single):
     # write output
     fmt = SM_MATCHES_CONFIG_PATH_FMT if single else ML_MATCHES_CONFIG_PATH_FMT
     matches_filename = fmt.format(year=year, period=period)
-    with open(matches_filename, "w", encoding="utf-8") as match_file:
-        match_file.write(matches_file_text)
-    return matches_filename
+    changed = write_if_changed(matches_filename, matches_file_text)
+    return matches_filename, changed
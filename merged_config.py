@@ -0,0 +1,164 @@
+"""
+Module for making configs that run every variation in one WTPH pass.
+
+Normally each variation has its own config, and its own WTPH job reading
+the same ntuples. A merged config has the selection blocks of every
+variation in it instead, each block's probe selection renamed to
+<name>__<variation> (e.g. MediumMuonProbes__nominal), so one WTPH pass
+fills every systematic. Global cuts all variations share stay global, the
+rest (e.g. the isolation cut of an iso variation) are moved into each
+selection block of the variations that have them. A GlobalCut applies to
+every event wherever it is in the config, so moved ones become ProbeCuts,
+which (like the probe_pt cut of each block) only apply to their own
+selection. That is meant to select the same probes as each variation's own
+config, so check_merged_outputs.py compares a merged WTPH output with the
+single-variation ones before it's used (make_2d_eff --merged).
+Merged configs aren't kept in git, make_configs makes them.
+
+MergedVariationFile reads one variation back out of the output of such a
+run, looking just like the output of a single-variation run.
+"""
+import constants as c
+from config_files import write_if_changed
+from run_config import is_cut
+from variation_config import apply_variation
+
+VARIATION_SEP = "__"
+GLOBAL_CUT = "GlobalCut"
+SELECTION_CUT = "ProbeCut"
+
+
+def merged_selection_name(name_probe_sel, variation):
+    """Name of a probe selection in a merged config."""
+    return name_probe_sel + VARIATION_SEP + variation
+
+
+def split_selection_dir(sel_dir):
+    """
+    Split a WTPH output selection directory, <selection>_<region>,
+    into (selection, variation, region), variation None if not merged.
+    """
+    selection, _, region = sel_dir.rpartition("_")
+    selection, _, variation = selection.partition(VARIATION_SEP)
+    return selection, variation or None, region
+
+
+def selection_cut(cut):
+    """A cut from the header, as one that only applies to its selection."""
+    words = cut.split()
+    if words[0] == GLOBAL_CUT:
+        words[0] = SELECTION_CUT
+    if words[0] != SELECTION_CUT:
+        raise ValueError("Can't move cut into a selection:", cut)
+    return " ".join(words)
+
+
+def merged_block(block, variation, extra_cuts):
+    """A selection block renamed for a variation, with extra cuts added."""
+    extra_cuts = [selection_cut(cut) for cut in extra_cuts]
+    new_block = []
+    for line in block:
+        if line.strip().startswith("NameProbeSel"):
+            indent, name = line.split("NameProbeSel")
+            line = indent + "NameProbeSel " + merged_selection_name(
+                name.strip(), variation)
+        elif line.strip().startswith("End_TPSelection"):
+            new_block += ["    " + cut for cut in extra_cuts]
+        new_block.append(line)
+    return new_block
+
+
+def render_merged_config(nominal, single, year=None, period=None):
+    """Get the text of a config with every variation of a parsed nominal."""
+    configs = {var: apply_variation(nominal, var, single, year, period)
+               for var in c.VARIATIONS}
+    header = [line.rstrip("\n") for line in configs["nominal"].header_lines()]
+    footer = [line.rstrip("\n") for line in configs["nominal"].footer_lines()]
+
+    # cuts every variation has stay global
+    header_cuts = {var: [line.strip() for line in config.header_lines()
+                         if is_cut(line)]
+                   for var, config in configs.items()}
+    common_cuts = [cut for cut in header_cuts["nominal"]
+                   if all(cut in cuts for cuts in header_cuts.values())]
+    new_header = []
+    for line in header:
+        if not is_cut(line) or line.strip() in common_cuts:
+            new_header.append(line)
+    for var, config in configs.items():
+        if [l.rstrip("\n") for l in config.header_lines()
+                if not is_cut(l)] != [l for l in header if not is_cut(l)]:
+            raise ValueError(
+                "Variation changes more than the global cuts:", var)
+
+    new_lines = new_header
+    for var in c.VARIATIONS:
+        extra_cuts = [cut for cut in header_cuts[var]
+                      if cut not in common_cuts]
+        new_lines.append("")
+        new_lines.append("### Variation " + var + " ###")
+        for selection in configs[var].selections:
+            new_lines.append("")
+            new_lines += merged_block(
+                [line.rstrip("\n") for line in selection.lines], var,
+                extra_cuts)
+    return "\n".join(new_lines + [""] + footer) + "\n"
+
+
+def make_merged_config(nominal, year, period, single):
+    """
+    Make a config with every variation of a period in it,
+    from the parsed nominal config (see run_config).
+
+    Returns (filename, whether it changed).
+    """
+    fmt = c.SM_MERGED_CONFIG_PATH_FMT if single else \
+        c.ML_MERGED_CONFIG_PATH_FMT
+    merged_filename = fmt.format(year=year, period=period)
+    changed = write_if_changed(
+        merged_filename, render_merged_config(nominal, single, year, period))
+    return merged_filename, changed
+
+
+class MergedVariationFile(object):
+    """
+    One variation of a merged WTPH output, read with the same paths as a
+    single-variation output, e.g. ZmumuTPMerged/MediumMuonProbes_Barrel/...
+    is read from ZmumuTPMerged/MediumMuonProbes__<variation>_Barrel/...
+
+    Wraps any input file with hist, list_dir and close methods
+    (hist_cache.CachedInputFile, wtph_columnar.ColumnarInputFile).
+    """
+
+    def __init__(self, merged_file, variation):
+        self.merged_file = merged_file
+        self.variation = variation
+
+    def _merged_path(self, path):
+        """Path in the merged output of something in this variation."""
+        parts = path.split("/")
+        if len(parts) < 2 or not parts[1]:
+            return path
+        selection, _, region = split_selection_dir(parts[1])
+        merged_dir = merged_selection_name(
+            selection, self.variation) + "_" + region
+        return path.replace(parts[1], merged_dir)
+
+    def hist(self, hist_path):
+        """Contents, sumw2 and binning of a hist of this variation."""
+        return self.merged_file.hist(self._merged_path(hist_path))
+
+    def list_dir(self, path):
+        """Like the merged file's list_dir, only showing this variation."""
+        if path.strip("/") != c.WTPH_TOP_DIR:
+            return self.merged_file.list_dir(self._merged_path(path))
+        names = []
+        for name in self.merged_file.list_dir(path):
+            selection, variation, region = split_selection_dir(name)
+            if variation == self.variation:
+                names.append(selection + "_" + region)
+        return names
+
+    def close(self):
+        """Close the merged file (fine to do once per variation)."""
+        self.merged_file.close()
@@ -1,15 +1,25 @@
-"""Module for making the config for nominal variation."""
+"""
+Module for making the config for nominal variation.
+
+Nominal configs are never written to disk, every variation config is made
+from the nominal text of its own period, kept in memory (see nominal_text),
+so periods can be made in any order, or at the same time.
+"""
 import os
 import re
 
-from constants import (DETECTOR_REGIONS, ML_NOMINAL_CONFIG_TEMPLATE,
+from config_files import template_text
+from constants import (DETECTOR_REGIONS, ML_BASIC_CONFIG_PATH_FMT,
                        ML_PRE_NOMINAL_CONFIG_TEMPLATE,
-                       SM_NOMINAL_CONFIG_TEMPLATE,
+                       SM_BASIC_CONFIG_PATH_FMT,
                        SM_PRE_NOMINAL_CONFIG_TEMPLATE, ZTRIGGER_DIR,
                        WORKING_POINTS)
 from run_numbers import RUN_NUMBERS
 from triggers import triggers_in_period
 
+# nominal config text of every period so far, {(single, year, period): text}
+_NOMINAL_TEXTS = {}
+
 SINGLE_BLOCK_TEMPLATE = """
 New_TPSelection ZmumuTPMerged OC MuonProbes
     NameProbeSel {working_point}MuonProbes
@@ -84,8 +94,11 @@ def make_selection_blocks(single, year, period):
     return "".join(blocks)
 
 
-def make_nominal_config(single, year, period, basic_filename):
-    """Make a nominal config."""
+def render_nominal_config(single, year, period, basic_filename):
+    """
+    Get the text of a nominal config, which the variation configs
+    are made from (see variation_config.apply_variation).
+    """
     # get template
     if single:
         pre_nominal_template = SM_PRE_NOMINAL_CONFIG_TEMPLATE
@@ -93,8 +106,7 @@ def make_nominal_config(single, year, period, basic_filename):
         pre_nominal_template = ML_PRE_NOMINAL_CONFIG_TEMPLATE
 
     # get template text
-    with open(pre_nominal_template, "r", encoding="utf-8") as pre_nom_file:
-        pre_nominal_template_text = pre_nom_file.read()
+    pre_nominal_template_text = template_text(pre_nominal_template)
 
     # make period cut
     start = RUN_NUMBERS[year][period]["START"]
@@ -111,12 +123,17 @@ def make_nominal_config(single, year, period, basic_filename):
     nominal_file_text = nominal_file_text.replace(
         "SELECTIONS_HERE",
         make_selection_blocks(single, year, period))
+    return nominal_file_text
 
-    if single:
-        nominal_filename = SM_NOMINAL_CONFIG_TEMPLATE
-    else:
-        nominal_filename = ML_NOMINAL_CONFIG_TEMPLATE
-    with open(nominal_filename, "w", encoding="utf-8") as nominal_file:
-        nominal_file.write(nominal_file_text)
 
-    return nominal_filename
+def nominal_text(single, year, period):
+    """
+    Nominal config text of a period, only rendered the first time
+    (it imports the period's basic config, see basic_config).
+    """
+    key = (single, year, period)
+    if key not in _NOMINAL_TEXTS:
+        fmt = SM_BASIC_CONFIG_PATH_FMT if single else ML_BASIC_CONFIG_PATH_FMT
+        _NOMINAL_TEXTS[key] = render_nominal_config(
+            single, year, period, fmt.format(year=year, period=period))
+    return _NOMINAL_TEXTS[key]
@@ -0,0 +1,165 @@
+"""
+Module for drawing the output hists of make_2d_eff to PNGs.
+
+Drawing a TCanvas and saving it for every data/MC/SF hist of a selection
+takes much longer than computing them. PNGQueue is handed the bin contents
+and binning of each hist rather than the hist itself, so they can be drawn
+by a pool of worker processes (each with its own ROOT, in batch mode)
+while the main process gets on with computing and writing.
+
+A hash of everything that goes into an image (bin contents, binning, title
+and RENDER_VERSION) is kept next to it, in .png_hashes/, and images whose
+hash hasn't changed since they were last drawn aren't drawn again.
+"""
+import hashlib
+import multiprocessing
+import os
+import numpy as np
+import instrumentation
+from eff_engine import empty_hist, fill_hist
+
+# change this whenever draw_hist changes, so every PNG is redrawn
+RENDER_VERSION = 1
+HASH_DIR = ".png_hashes"
+
+# ROOT (and especially the ATLAS style macros) is only loaded when needed,
+# most jobs never draw anything
+PLOTTING_SET_UP = False
+
+
+def set_up_plotting():
+    """Set up global style stuff for drawing, the first time only."""
+    global PLOTTING_SET_UP
+    if PLOTTING_SET_UP:
+        return
+    import ROOT
+    ROOT.gROOT.SetBatch()
+    ROOT.gROOT.LoadMacro('AtlasUtils.C')
+    ROOT.gROOT.LoadMacro('AtlasLabels.C')
+    if ROOT.gROOT.LoadMacro('AtlasStyle.C') > 0:
+        ROOT.SetAtlasStyle()
+    PLOTTING_SET_UP = True
+
+
+def draw_hist(out_dir, title_prefix, hist, name):
+    """Make a histogram."""
+    from ROOT import TCanvas, gStyle
+    set_up_plotting()
+    canvas = TCanvas()
+    canvas.SetTopMargin(0.1)
+    canvas.SetBottomMargin(0.15)
+    canvas.SetLeftMargin(0.15)
+    canvas.SetRightMargin(0.15)
+    gStyle.SetOptTitle(1)
+    gStyle.SetOptStat(0)
+    gStyle.SetPaintTextFormat(".3f")
+    title = title_prefix + name
+    hist.SetDirectory(0)
+    hist.SetTitle(title)
+    hist.SetTitleSize(0.02, "t")
+    hist.SetMaximum(1.0)
+    hist.SetMinimum(0.0)
+    hist.Draw("COLZ TEXT")
+    canvas.SaveAs(out_dir + title_prefix + name + ".png")
+    canvas.Close()
+    instrumentation.count("pngs")
+
+
+def image_hash(title, binning, contents):
+    """Hash of everything that goes into drawing a hist."""
+    digest = hashlib.sha1()
+    digest.update(str(RENDER_VERSION).encode("utf-8"))
+    for text in [title, binning["class_name"], binning["x_title"],
+                 binning["y_title"]]:
+        digest.update(str(text).encode("utf-8") + b"\0")
+    for arr in [binning["x_edges"], binning["y_edges"], contents]:
+        digest.update(np.ascontiguousarray(arr, dtype=np.float64).tobytes())
+    return digest.hexdigest()
+
+
+def hash_filepath(png_path):
+    """Where the hash of a PNG is kept."""
+    return os.path.join(os.path.dirname(png_path), HASH_DIR,
+                        os.path.basename(png_path) + ".sha1")
+
+
+def is_unchanged(png_path, digest):
+    """Check whether a PNG was already drawn from the same hist."""
+    hash_path = hash_filepath(png_path)
+    if not (os.path.exists(png_path) and os.path.exists(hash_path)):
+        return False
+    with open(hash_path, "r") as hash_file:
+        return hash_file.read().strip() == digest
+
+
+def save_hash(png_path, digest):
+    """Remember what a PNG was drawn from (via a temp file)."""
+    hash_path = hash_filepath(png_path)
+    os.makedirs(os.path.dirname(hash_path), exist_ok=True)
+    tmp_path = "{}.{}.tmp".format(hash_path, os.getpid())
+    with open(tmp_path, "w") as hash_file:
+        hash_file.write(digest + "\n")
+    os.replace(tmp_path, hash_path)
+
+
+def render_png(out_dir, title_prefix, name, binning, contents, digest):
+    """Fill a hist from its contents and draw it (in a worker, or not)."""
+    hist = fill_hist(empty_hist(binning, "png_" + name), contents)
+    draw_hist(out_dir, title_prefix, hist, name)
+    save_hash(out_dir + title_prefix + name + ".png", digest)
+
+
+def _init_worker():
+    """Set up ROOT in a rendering worker, without its info prints."""
+    import ROOT
+    ROOT.gErrorIgnoreLevel = ROOT.kWarning
+    set_up_plotting()
+
+
+class PNGQueue(object):
+    """
+    PNGs waiting to be drawn.
+
+    With jobs > 1 they're drawn by that many worker processes, otherwise
+    straight away by this one. Call close to wait for all of them.
+    """
+
+    def __init__(self, jobs=1):
+        self.pool = None
+        if jobs > 1:
+            # spawn rather than fork, so workers get a clean ROOT
+            self.pool = multiprocessing.get_context("spawn").Pool(
+                jobs, initializer=_init_worker)
+        self.pending = []
+
+    def put(self, out_dir, title_prefix, name, binning, contents):
+        """
+        Draw a hist, given as its binning (see eff_engine.hist_binning)
+        and flat array of contents, to out_dir/title_prefix+name.png,
+        unless an identical one is already there.
+        """
+        png_path = out_dir + title_prefix + name + ".png"
+        digest = image_hash(title_prefix + name, binning, contents)
+        if is_unchanged(png_path, digest):
+            instrumentation.count("pngs_unchanged")
+            return
+        args = (out_dir, title_prefix, name, binning, contents, digest)
+        if self.pool is None:
+            render_png(*args)
+        else:
+            self.pending.append(self.pool.apply_async(render_png, args))
+            # only keep track of unfinished ones (get raises worker errors)
+            for result in [res for res in self.pending if res.ready()]:
+                result.get()
+                self.pending.remove(result)
+
+    def close(self):
+        """Wait for every queued PNG to be drawn."""
+        if self.pool is None:
+            return
+        self.pool.close()
+        for result in self.pending:
+            result.get()
+        self.pending = []
+        self.pool.join()
+        self.pool = None
@@ -0,0 +1,216 @@
+"""
+Module for working out the least we need to rebuild after a change.
+
+The SF pipeline goes
+    run configs (make_configs) -> WTPH outputs (run_wtph_batch)
+    -> SF maps (make_2d_eff)
+Every artifact gets a fingerprint, a hash of everything it's made from:
+    run config:  templates, triggers, run number range, variation,
+                 working points, detector regions, and the source of the
+                 modules that make configs (GENERATOR_MODULES)
+    WTPH output: run config, input config, histo config, ntuple version
+    SF maps:     all WTPH outputs of the period (every variation, data & MC)
+Each period's merged config (variation constants.MERGED_VARIATION, see
+merged_config) and its WTPH outputs are artifacts like any variation's, and
+its SF maps depend on them too, as they can be made from either.
+so a change propagates down the chain by itself. The fingerprints of what
+was last built are kept in a manifest, and anything whose fingerprint
+differs from it is out of date. E.g. editing triggers.TRIGGERS[2016]["E"]
+only gives the 2016 period E configs, their WTPH jobs and SF maps.
+Any edit to a generator module (e.g. a rule in
+variation_config.VARIATION_RULES, or the pt cuts in nominal_config) makes
+every config out of date, not just the ones it changes.
+
+python rebuild_plan.py                 # show what needs rebuilding
+python rebuild_plan.py --record wtph   # once the WTPH jobs have been rerun
+"""
+from __future__ import print_function
+import hashlib
+import json
+import optparse
+import os
+import constants as c
+from config_files import file_hash
+from run_numbers import RUN_NUMBERS
+from triggers import triggers_in_period
+
+DEFAULT_MANIFEST = "build_manifest.json"
+STAGES = ["configs", "wtph", "sf"]
+
+# modules whose code (and tables) make the run configs
+GENERATOR_MODULES = ["basic_config.py", "config_files.py",
+                     "detector_regions_config.py", "matches_config.py",
+                     "merged_config.py", "nominal_config.py",
+                     "run_config.py", "variation_config.py"]
+# (not triggers.py, each config's own triggers are in its fingerprint)
+
+# templates each kind of run config is made from
+TEMPLATES = {
+    c.SINGLE_MUON_DIR: [c.DETECTOR_REGION_TEMPLATE,
+                        c.SM_BASIC_CONFIG_TEMPLATE,
+                        c.SM_MATCHES_TEMPLATE,
+                        c.SM_PRE_NOMINAL_CONFIG_TEMPLATE],
+    c.MULTI_LEG_DIR: [c.DETECTOR_REGION_TEMPLATE,
+                      c.ML_BASIC_CONFIG_TEMPLATE,
+                      c.ML_MATCHES_TEMPLATE,
+                      c.ML_PRE_NOMINAL_CONFIG_TEMPLATE],
+}
+
+
+def fingerprint(inputs):
+    """Hash of a (JSON-able) description of an artifact's inputs."""
+    text = json.dumps(inputs, sort_keys=True)
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+def artifact_key(stage, *parts):
+    """Name of an artifact in the manifest, e.g. wtph/data/2016/E/..."""
+    return "/".join([stage] + [str(part) for part in parts])
+
+
+def generator_hashes():
+    """Hashes of the source of every generator module, {module: hash}."""
+    code_dir = os.path.dirname(os.path.abspath(__file__))
+    return {module: file_hash(os.path.join(code_dir, module))
+            for module in GENERATOR_MODULES}
+
+
+def config_inputs(trigger_type, year, period, variation, template_hashes,
+                  code_hashes):
+    """Everything a run config is made from."""
+    run_range = RUN_NUMBERS[year][period]
+    return {
+        "templates": template_hashes[trigger_type],
+        "generator": code_hashes,
+        "working_points": c.WORKING_POINTS,
+        "detector_regions": c.DETECTOR_REGIONS,
+        "triggers": [str(trigger) for trigger in triggers_in_period(
+            trigger_type == c.SINGLE_MUON_DIR, year, period)],
+        "run_range": [run_range["START"], run_range["END"]],
+        "variation": variation,
+    }
+
+
+def wtph_inputs(data_mc, year, period, config_fingerprint, histo_hash):
+    """Everything a WTPH output is made from."""
+    input_config = os.path.join(
+        c.WTPH_INPUT_CONF_DIR,
+        c.WTPH_INPUT_CONF_FMT[data_mc].format(year=year, period=period))
+    return {
+        "run_config": config_fingerprint,
+        "input_config": file_hash(input_config),
+        "histo_config": histo_hash,
+        "ntuple_version": c.NTUPLE_VERSION,
+    }
+
+
+def current_fingerprints():
+    """Fingerprints of every artifact as things stand now, {key: hash}."""
+    template_hashes = {
+        trigger_type: {path: file_hash(path) for path in paths}
+        for trigger_type, paths in TEMPLATES.items()}
+    histo_hash = file_hash(c.WTPH_2D_HISTO_CONF)
+    code_hashes = generator_hashes()
+
+    fingerprints = {}
+    for year in c.YEARS:
+        for period in RUN_NUMBERS[year]:
+            for trigger_type in c.TRIGGER_TYPES:
+                wtph_fingerprints = []
+                for variation in c.VARIATIONS + [c.MERGED_VARIATION]:
+                    config_fp = fingerprint(config_inputs(
+                        trigger_type, year, period, variation,
+                        template_hashes, code_hashes))
+                    fingerprints[artifact_key(
+                        "configs", trigger_type, year, period,
+                        variation)] = config_fp
+                    for data_mc in ["data", "mc"]:
+                        wtph_fp = fingerprint(wtph_inputs(
+                            data_mc, year, period, config_fp, histo_hash))
+                        fingerprints[artifact_key(
+                            "wtph", data_mc, year, period, variation,
+                            trigger_type)] = wtph_fp
+                        wtph_fingerprints.append(wtph_fp)
+                fingerprints[artifact_key(
+                    "sf", year, period, trigger_type)] = fingerprint(
+                        wtph_fingerprints)
+    return fingerprints
+
+
+def load_manifest(manifest_path):
+    """Fingerprints of what was last built, {key: hash}."""
+    if not os.path.exists(manifest_path):
+        return {}
+    with open(manifest_path, "r") as manifest_file:
+        return json.load(manifest_file)
+
+
+def save_manifest(manifest_path, manifest):
+    """Save the manifest (via a temp file, so it's never half-written)."""
+    tmp_path = manifest_path + ".tmp"
+    with open(tmp_path, "w") as manifest_file:
+        json.dump(manifest, manifest_file, indent=1, sort_keys=True)
+    os.replace(tmp_path, manifest_path)
+
+
+def out_of_date(fingerprints, manifest):
+    """Keys of artifacts that need rebuilding, {stage: sorted [key]}."""
+    plan = {stage: [] for stage in STAGES}
+    for key in sorted(fingerprints):
+        if manifest.get(key) != fingerprints[key]:
+            plan[key.split("/")[0]].append(key)
+    return plan
+
+
+def record(fingerprints, manifest, stages):
+    """Mark everything in the given stages as rebuilt."""
+    for key, value in fingerprints.items():
+        if key.split("/")[0] in stages:
+            manifest[key] = value
+    return manifest
+
+
+def get_options():
+    """Get options from the command line."""
+    parser = optparse.OptionParser()
+    # manifest with the fingerprints of what was last built
+    parser.add_option('-m', '--manifest', type='string',
+                      default=DEFAULT_MANIFEST, dest='manifest')
+    # record the given stages (comma-separated, or "all") as rebuilt
+    parser.add_option('--record', type='string', default=None,
+                      dest='record')
+    # write the out of date artifacts to this file, as JSON
+    parser.add_option('--planFile', type='string', default=None,
+                      dest='planFile')
+    (options, _) = parser.parse_args()
+    return options
+
+
+def main():
+    """Show what's out of date, or record that it's been rebuilt."""
+    options = get_options()
+    fingerprints = current_fingerprints()
+    manifest = load_manifest(options.manifest)
+
+    if options.record is not None:
+        stages = STAGES if options.record == "all" else \
+            options.record.split(",")
+        for stage in stages:
+            if stage not in STAGES:
+                raise ValueError("Invalid stage! Use one of", STAGES)
+        save_manifest(options.manifest, record(fingerprints, manifest, stages))
+        print("Recorded", ", ".join(stages), "as rebuilt")
+        return
+
+    plan = out_of_date(fingerprints, manifest)
+    for stage in STAGES:
+        print(len(plan[stage]), stage, "out of date")
+        for key in plan[stage]:
+            print("  " + key)
+    if options.planFile is not None:
+        with open(options.planFile, "w") as plan_file:
+            json.dump(plan, plan_file, indent=1)
+
+
+if __name__ == "__main__":
+    main()
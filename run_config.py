@@ -0,0 +1,121 @@
+"""
+Module for a structured view of a WTPH run config.
+
+A run config is a header (comments, Import, global cuts) followed by
+selection blocks, New_TPSelection ... End_TPSelection, each with its own
+probe cuts. parse_config splits the text up once, line endings and any
+lines between or after the blocks included, so RunConfig.text gives the
+exact same text back unless something has been changed.
+
+The header of a nominal config has a marker line, EXTRA_CUTS_MARKER, where
+variations add their global cuts (see variation_config). It's dropped
+when the text is made.
+"""
+
+EXTRA_CUTS_MARKER = "EXTRA_GLOBAL_CUTS_HERE"
+CUT_KEYWORDS = ["GlobalCut", "ProbeCut"]
+
+
+def is_cut(line):
+    """Check whether a config line is a cut."""
+    words = line.split()
+    return bool(words) and words[0] in CUT_KEYWORDS
+
+
+def keyword(line):
+    """First word of a config line, "" if there isn't one."""
+    words = line.split()
+    return words[0] if words else ""
+
+
+class Selection(object):
+    """One New_TPSelection ... End_TPSelection block, as lines."""
+
+    def __init__(self, lines):
+        self.lines = lines
+
+    def copy(self):
+        """A copy that can be changed without changing this one."""
+        return Selection(list(self.lines))
+
+    def find(self, word):
+        """Index of the first line starting with a keyword, None if none."""
+        for i, line in enumerate(self.lines):
+            if keyword(line) == word:
+                return i
+        return None
+
+    def value(self, word):
+        """Rest of the first line starting with a keyword, None if none."""
+        i = self.find(word)
+        if i is None:
+            return None
+        return self.lines[i].strip()[len(word):].strip()
+
+
+class RunConfig(object):
+    """
+    A parsed run config.
+
+    header is a list of lines before the first selection, body a list of
+    Selections and the (blank, comment, ...) lines around them, in order.
+    """
+
+    def __init__(self, header, body):
+        self.header = header
+        self.body = body
+
+    @property
+    def selections(self):
+        """Every selection block, in order."""
+        return [item for item in self.body if isinstance(item, Selection)]
+
+    def copy(self):
+        """A copy that can be changed without changing this one."""
+        return RunConfig(
+            list(self.header),
+            [item.copy() if isinstance(item, Selection) else item
+             for item in self.body])
+
+    def header_lines(self):
+        """Header lines, without the extra cuts marker."""
+        return [line for line in self.header
+                if line.strip() != EXTRA_CUTS_MARKER]
+
+    def footer_lines(self):
+        """Lines after the last selection block."""
+        footer = []
+        for item in reversed(self.body):
+            if isinstance(item, Selection):
+                break
+            footer.insert(0, item)
+        return footer
+
+    def text(self):
+        """The config as text."""
+        lines = self.header_lines()
+        for item in self.body:
+            lines += item.lines if isinstance(item, Selection) else [item]
+        return "".join(lines)
+
+
+def parse_config(text):
+    """Parse the text of a run config into a RunConfig."""
+    header, body = [], []
+    block = None
+    for line in text.splitlines(keepends=True):
+        word = keyword(line)
+        if word == "New_TPSelection":
+            block = [line]
+        elif block is not None:
+            block.append(line)
+            if word == "End_TPSelection":
+                body.append(Selection(block))
+                block = None
+        elif body:
+            body.append(line)
+        else:
+            header.append(line)
+    if block is not None:
+        raise ValueError("Selection without End_TPSelection:", block[0])
+    return RunConfig(header, body)
@@ -4,7 +4,11 @@ Module to list run numbers for each period we care about.
 The numbers here come from COMA:
 atlas-tagservices.cern.ch/
 tagservices/RunBrowser/runBrowserReport/rBR_Period_Report.php
+
+To go the other way, from run numbers to periods, period_of looks up whole
+arrays of run numbers at once in an index of the periods sorted by start.
 """
+import numpy as np
 
 # 2015
 # using AllYear 13TeV data periods
@@ -182,6 +186,111 @@ RUN_NUMBERS = {
     }
 }
 
+# index of RUN_NUMBERS, built the first time it's needed
+_PERIOD_INDEX = None
+
+
 def periods(year):
     """Get the list of periods in a year (integer, 4-digit)."""
     return RUN_NUMBERS[year].keys()
+
+
+def sorted_intervals(run_numbers=None):
+    """List of (start, end, (year, period)) sorted by start, then end."""
+    if run_numbers is None:
+        run_numbers = RUN_NUMBERS
+    return sorted(
+        (bounds["START"], bounds["END"], (year, period))
+        for year, year_periods in run_numbers.items()
+        for period, bounds in year_periods.items())
+
+
+def find_overlaps(run_numbers=None):
+    """
+    Find periods whose run ranges overlap (e.g. 2016 H with G and I).
+
+    Returns a list of ((year, period), (year, period)) pairs.
+    """
+    intervals = sorted_intervals(run_numbers)
+    overlaps = []
+    for i, (_, end, key) in enumerate(intervals):
+        for start_j, _, key_j in intervals[i + 1:]:
+            if start_j > end:
+                break
+            overlaps.append((key, key_j))
+    return overlaps
+
+
+def build_period_index(run_numbers=None):
+    """
+    Index of periods for period_of: (starts, ends, keys), sorted by start.
+
+    Each run has to belong to at most one period, so overlapping periods
+    raise a ValueError.
+    """
+    overlaps = find_overlaps(run_numbers)
+    if overlaps:
+        raise ValueError("Periods have overlapping run numbers:", overlaps)
+    intervals = sorted_intervals(run_numbers)
+    starts = np.array([start for start, _, _ in intervals], dtype=np.int64)
+    ends = np.array([end for _, end, _ in intervals], dtype=np.int64)
+    keys = [key for _, _, key in intervals]
+    return starts, ends, keys
+
+
+def default_period_index():
+    """Index of RUN_NUMBERS, built the first time it's asked for."""
+    global _PERIOD_INDEX
+    if _PERIOD_INDEX is None:
+        _PERIOD_INDEX = build_period_index()
+    return _PERIOD_INDEX
+
+
+def period_positions(runs, index=None):
+    """
+    Position in the index keys of the period of each run, -1 if none.
+
+    Uses a binary search over the period starts, for a whole array at once.
+    """
+    if index is None:
+        index = default_period_index()
+    starts, ends, _ = index
+    runs = np.asarray(runs, dtype=np.int64)
+    # last period starting at or before each run
+    positions = np.searchsorted(starts, runs, side="right") - 1
+    in_period = (positions >= 0) & (runs <= ends[np.clip(positions, 0, None)])
+    return np.where(in_period, positions, -1)
+
+
+def period_of(runs, index=None):
+    """
+    (year, period) of each run in an array, None for runs in no period.
+
+    Returns a list in the same order as runs,
+    or just the (year, period) if given a single run number.
+    """
+    if index is None:
+        index = default_period_index()
+    keys = index[2]
+    periods_of_runs = [keys[pos] if pos >= 0 else None
+                       for pos in period_positions(np.atleast_1d(runs), index)]
+    if np.ndim(runs) == 0:
+        return periods_of_runs[0]
+    return periods_of_runs
+
+
+def sum_by_period(runs, values, index=None):
+    """
+    Sum per-run values (e.g. event counts) into periods.
+
+    Returns {(year, period): total}, runs in no period are left out.
+    """
+    if index is None:
+        index = default_period_index()
+    keys = index[2]
+    positions = period_positions(runs, index)
+    in_period = positions >= 0
+    totals = np.bincount(positions[in_period],
+                         weights=np.asarray(values)[in_period],
+                         minlength=len(keys))
+    return {key: totals[i] for i, key in enumerate(keys)}
@@ -1,29 +1,50 @@
 """
 Run WriteTagProbeHistos, the nice way :)
+
+python run_wtph_batch.py [--resume]
+
+writes a job script for every data/MC, year, variation, period and trigger
+type, and a script (submitAllWTPH.sh) to submit them all.
+
+With --resume, jobs are only submitted if their output is missing or broken
+(empty, not a ROOT file, not closed properly or without ZmumuTPMerged), and
+they aren't still in the Slurm queue from last time. What happened to every
+job is kept in a state file in the job area, along with its Slurm job ID
+once it has been submitted.
+
+With --pack, several WTPH runs share one Slurm job (and so one setup),
+filling each job up to a walltime budget (--packTime, default
+constants.TIME). How long a run takes is estimated from how many Input
+lines its input config has, at constants.WTPH_MINUTES_PER_INPUT each.
+Each pack is named after a hash of the runs in it (kept in the state file
+as each run's "pack"), so a resubmitted pack never overwrites the script
+of one that's still waiting to run.
+
+With --merged, each period is run once with its merged config (every
+variation in one pass, see merged_config) instead of once per variation.
+
+How the jobs get run is up to the --executor:
+    slurm   write job scripts and submitAllWTPH.sh (the default)
+    local   run WTPH right here, --localJobs at a time, holding back new
+            ones while the machine is fully loaded or short of memory
+            (needs the WTPH environment already set up, and a grid proxy)
+    dryrun  just print the WTPH commands
 """
 from __future__ import print_function
 import getpass
+import hashlib
+import json
+import multiprocessing
+import optparse
 import os
+import subprocess
+import time
 import constants as c
 from run_numbers import RUN_NUMBERS
 from wtph_input_configs import format_input_configs
 
 NTUPV = c.NTUPLE_VERSION  # to make lines shorter later
 
-# ensure that input configs have the propper naming scheme
-format_input_configs()
-
-# assuming run configs were generated with these modules,
-# they must already have the right naming scheme
-
-# First, some paths and such:
-if not os.path.exists(c.WTPH_OUTPUT_DIR):
-    os.mkdir(c.WTPH_OUTPUT_DIR)
-if not os.path.exists(c.WTPH_JOB_AREA):
-    os.mkdir(c.WTPH_JOB_AREA)
-
-INPUT_CONFIGS = os.listdir(c.WTPH_INPUT_CONF_DIR)
-
 # job parameters like time limit and slurm account are set in constants module
 
 # Do we really need these? I don't think so!
@@ -36,87 +57,488 @@ INPUT_CONFIGS = os.listdir(c.WTPH_INPUT_CONF_DIR)
 
 # name of bash script that will submit all batch jobs
 SUBMIT_FILE = os.path.join(c.WTPH_JOB_AREA, "submitAllWTPH.sh")
-if os.path.exists(SUBMIT_FILE):
-    os.remove(SUBMIT_FILE)
+# what happened to each job, and its Slurm job ID
+STATE_FILE = os.path.join(c.WTPH_JOB_AREA, "wtph_state.json")
+# the submit script appends "job_name job_id" here for each job it submits
+JOB_ID_LOG = os.path.join(c.WTPH_JOB_AREA, "submitted_jobs.log")
 
-PW = getpass.getpass("Please enter your grid password:")
-CWD = os.getcwd()
+# what every WTPH output starts with
+ROOT_MAGIC = b"root"
 
 # setup stuff for individual scripts
 HEADER = "#!/bin/bash\n"
-SETUP = 'lsetup "rucio SL7Python2"\n' +\
-    "echo " + PW + " | voms-proxy-init -voms atlas\n" +\
-    "cd " + os.path.join(c.MTPPP_ROOT, "build") + "\n" +\
-    "asetup\n" +\
-    "source */setup.sh\n" +\
-    "mkdir -p " + c.WTPH_OUTPUT_DIR + "\n" +\
-    "cd " + os.path.join(c.MTPPP_ROOT, "run") + "\n"
-
-# stuff we'll write into the master script to run at the end
-MAIN_FILE_LINES = []
-
-# For each year, systematic, and period, make a script to run WTPH
-for year in c.YEARS:
-    for syst in c.VARIATIONS:
-        for prd in RUN_NUMBERS[year]:
-            for trigs in ["SingleMuonTriggers", "MultiLegTriggers"]:
-                # find run configs
-                run_configs = os.listdir(
-                    os.path.join(c.WTPH_RUN_CONF_DIR, trigs))
-                run_config = "MuonProbes_" + trigs + \
-                    "_{syst}_{year}_{prd}.conf".format(
-                        syst=syst, year=year, prd=prd)
-                assert run_config in run_configs
-                run_conf_dir = os.path.join(c.WTPH_RUN_CONF_DIR, trigs)
-                run_config = os.path.join(run_conf_dir, run_config)
-
-                for data_mc in ["data", "mc"]:
-                    # find input configs, guaranteed to exist from earlier code
-                    input_file = os.path.join(
-                        c.WTPH_INPUT_CONF_DIR,
-                        c.WTPH_INPUT_CONF_FMT[data_mc].format(
-                            year=year, period=prd))
-
-                    # output file we'll write to
-                    output_file = os.path.join(
-                        c.WTPH_OUTPUT_DIR,
-                        data_mc + str(year) + "_" + prd + "_" +\
-                        syst + "_" + NTUPV + "_" + trigs + ".root")
-
-                    # write the bash scripts that runs WTPH
-                    job_file = os.path.join(
-                        c.WTPH_JOB_AREA,
-                        "{data_mc}{year}-{prd}-{syst}-{trigs}.sh".format(
-                            data_mc=data_mc, year=year, prd=prd, syst=syst,
-                            trigs=trigs))
-                    with open(job_file, "w") as jfile:
-                        jfile.write(
-                            HEADER + SETUP + "WriteTagProbeHistos" +
-                            " -i "+ input_file +\
-                            " -h " + c.WTPH_2D_HISTO_CONF +\
-                            " -r " + run_config +\
-                            " -o " + output_file)
-
-                    # make the ATLAS-formatted job files as required for Cedar
-                    atlfile = os.path.join(
-                        c.WTPH_JOB_AREA,
-                        "atlas-{data_mc}{year}-{prd}-{syst}-{trigs}.sh".format(
+
+# where the local executor writes the output of each WTPH run
+LOCAL_LOG_DIR = os.path.join(c.WTPH_JOB_AREA, "logs")
+# how often the local executor checks on its WTPH processes (seconds)
+POLL_SECONDS = 5
+
+
+def get_options():
+    """Get options from the command line."""
+    parser = optparse.OptionParser()
+    # only submit jobs whose outputs are missing or broken
+    parser.add_option('--resume', action='store_true', default=False,
+                      dest='resume')
+    # where to keep track of jobs
+    parser.add_option('--stateFile', type='string', default=STATE_FILE,
+                      dest='stateFile')
+    # pack several WTPH runs into each batch job
+    parser.add_option('--pack', action='store_true', default=False,
+                      dest='pack')
+    # walltime budget of a packed job, HH:MM:SS
+    parser.add_option('--packTime', type='string', default=c.TIME,
+                      dest='packTime')
+    # estimated minutes of WTPH per Input line of an input config
+    parser.add_option('--minutesPerInput', type='float',
+                      default=c.WTPH_MINUTES_PER_INPUT,
+                      dest='minutesPerInput')
+    # run all variations in one pass, with the merged configs
+    parser.add_option('--merged', action='store_true', default=False,
+                      dest='merged')
+    # how to run the jobs: slurm, local or dryrun
+    parser.add_option('-e', '--executor', type='choice', default='slurm',
+                      choices=sorted(EXECUTORS), dest='executor')
+    # how many WTPH processes the local executor runs at once
+    parser.add_option('--localJobs', type='int',
+                      default=multiprocessing.cpu_count(), dest='localJobs')
+    # the local executor doesn't start new jobs with less free memory (MB)
+    parser.add_option('--minFreeMemory', type='int', default=4000,
+                      dest='minFreeMemory')
+    (options, _) = parser.parse_args()
+    return options
+
+
+def setup_lines(password):
+    """Lines every job script starts with, to set up WTPH."""
+    return 'lsetup "rucio SL7Python2"\n' +\
+        "echo " + password + " | voms-proxy-init -voms atlas\n" +\
+        "cd " + os.path.join(c.MTPPP_ROOT, "build") + "\n" +\
+        "asetup\n" +\
+        "source */setup.sh\n" +\
+        "mkdir -p " + c.WTPH_OUTPUT_DIR + "\n" +\
+        "cd " + os.path.join(c.MTPPP_ROOT, "run") + "\n"
+
+
+def list_jobs(merged=False):
+    """
+    Describe every WTPH job we need, as a list of dicts.
+
+    Each one has its name, data_mc, year, period, variation, trigger_type,
+    and the input_file, run_config and output_file it uses.
+    If merged, there's one job per period with variation MERGED_VARIATION.
+    """
+    variations = [c.MERGED_VARIATION] if merged else c.VARIATIONS
+    # assuming run configs were generated with these modules,
+    # they must already have the right naming scheme
+    run_configs = {
+        trigs: os.listdir(os.path.join(c.WTPH_RUN_CONF_DIR, trigs))
+        for trigs in c.TRIGGER_TYPES}
+
+    jobs = []
+    # For each year, systematic, and period, make a script to run WTPH
+    for year in c.YEARS:
+        for syst in variations:
+            for prd in RUN_NUMBERS[year]:
+                for trigs in c.TRIGGER_TYPES:
+                    # find run configs
+                    run_config = "MuonProbes_" + trigs + \
+                        "_{syst}_{year}_{prd}.conf".format(
+                            syst=syst, year=year, prd=prd)
+                    assert run_config in run_configs[trigs]
+                    run_conf_dir = os.path.join(c.WTPH_RUN_CONF_DIR, trigs)
+                    run_config = os.path.join(run_conf_dir, run_config)
+
+                    for data_mc in ["data", "mc"]:
+                        # find input configs, guaranteed to exist by now
+                        input_file = os.path.join(
+                            c.WTPH_INPUT_CONF_DIR,
+                            c.WTPH_INPUT_CONF_FMT[data_mc].format(
+                                year=year, period=prd))
+
+                        # output file we'll write to
+                        output_file = os.path.join(
+                            c.WTPH_OUTPUT_DIR,
+                            data_mc + str(year) + "_" + prd + "_" +\
+                            syst + "_" + NTUPV + "_" + trigs + ".root")
+
+                        name = "{data_mc}{year}-{prd}-{syst}-{trigs}".format(
                             data_mc=data_mc, year=year, prd=prd, syst=syst,
-                            trigs=trigs))
-
-                    MAIN_FILE_LINES += [
-                        # batchScript = command to make the atlas-format file
-                        'batchScript "source ' + job_file + '" -O '+ atlfile,
-                        "echo 'Submitting " + atlfile + "'",
-                        "cd " + c.WTPH_SUBMIT_AREA,
-                        "sbatch" +\
-                        " --account " + c.ACCOUNT +\
-                        " --time " + c.TIME +\
-                        " --mail-user " + c.MAIL_USER +\
-                        " --mail-type " + c.MAIL_TYPE + " "+ atlfile,
-                        "cd " + CWD]
-
-with open(SUBMIT_FILE, "w") as subfile:
-    subfile.write("\n".join(MAIN_FILE_LINES))
-
-print("To run all jobs: source " + SUBMIT_FILE)
+                            trigs=trigs)
+                        jobs.append({
+                            "name": name,
+                            "data_mc": data_mc, "year": year, "period": prd,
+                            "variation": syst, "trigger_type": trigs,
+                            "input_file": input_file,
+                            "run_config": run_config,
+                            "output_file": output_file})
+    return jobs
+
+
+def wtph_command(job):
+    """The WriteTagProbeHistos command line for a job."""
+    return "WriteTagProbeHistos" +\
+        " -i " + job["input_file"] +\
+        " -h " + c.WTPH_2D_HISTO_CONF +\
+        " -r " + job["run_config"] +\
+        " -o " + job["output_file"]
+
+
+def write_job_file(script_name, jobs, setup):
+    """
+    Write the bash script that runs WTPH for some jobs (one after the
+    other, after a single setup), return its path.
+    """
+    job_file = os.path.join(c.WTPH_JOB_AREA, script_name + ".sh")
+    with open(job_file, "w") as jfile:
+        jfile.write(HEADER + setup + "\n".join(
+            wtph_command(job) for job in jobs))
+    return job_file
+
+
+def submit_lines(script_name, jobs, job_file, cwd, walltime=c.TIME):
+    """
+    Lines of the submit script that submit a job script,
+    and log its ID for each of the jobs in it.
+    """
+    # make the ATLAS-formatted job files as required for Cedar
+    atlfile = os.path.join(c.WTPH_JOB_AREA, "atlas-" + script_name + ".sh")
+    lines = [
+        # batchScript = command to make the atlas-format file
+        'batchScript "source ' + job_file + '" -O '+ atlfile,
+        "echo 'Submitting " + atlfile + "'",
+        "cd " + c.WTPH_SUBMIT_AREA,
+        "JOB_ID=$(sbatch --parsable" +\
+        " --account " + c.ACCOUNT +\
+        " --time " + walltime +\
+        " --mail-user " + c.MAIL_USER +\
+        " --mail-type " + c.MAIL_TYPE + " " + atlfile + ")"]
+    for job in jobs:
+        lines.append('echo "' + job["name"] + ' $JOB_ID" >> ' + JOB_ID_LOG)
+    lines.append("cd " + cwd)
+    return lines
+
+
+def time_to_minutes(walltime):
+    """Slurm-style HH:MM:SS to minutes."""
+    hours, minutes, seconds = (int(part) for part in walltime.split(":"))
+    return hours * 60 + minutes + seconds / 60.
+
+
+def count_inputs(input_file):
+    """Number of Input lines (i.e. ntuple files) in an input config."""
+    with open(input_file, "r") as in_file:
+        return sum(1 for line in in_file if line.startswith("Input"))
+
+
+def pack_name(pack):
+    """
+    Name of the batch job (and script) of a pack, from the runs in it, so a
+    new pack never overwrites the script of one still waiting in the queue.
+    """
+    digest = hashlib.sha1(
+        "\n".join(sorted(job["name"] for job in pack)).encode("utf-8"))
+    return "pack-" + digest.hexdigest()[:12]
+
+
+def pack_jobs(jobs, budget_minutes, minutes_per_input):
+    """
+    Group jobs into packs that should each run within the budget.
+
+    First-fit decreasing on the estimated run time of each job, jobs that
+    are over budget on their own get a pack of their own.
+    Returns a list of lists of jobs.
+    """
+    input_counts = {}
+    estimates = []
+    for job in jobs:
+        if job["input_file"] not in input_counts:
+            input_counts[job["input_file"]] = count_inputs(job["input_file"])
+        estimates.append(
+            (input_counts[job["input_file"]] * minutes_per_input, job))
+
+    packs = []
+    pack_minutes = []
+    # longest first, by name for ties so packs come out the same every time
+    for minutes, job in sorted(estimates,
+                               key=lambda item: (-item[0], item[1]["name"])):
+        for i, used in enumerate(pack_minutes):
+            if used + minutes <= budget_minutes:
+                packs[i].append(job)
+                pack_minutes[i] += minutes
+                break
+        else:
+            packs.append([job])
+            pack_minutes.append(minutes)
+    return packs
+
+
+def check_output(output_file):
+    """
+    Check whether a WTPH output is complete.
+
+    Returns None if it is, otherwise a short description of the problem.
+    """
+    if not os.path.exists(output_file):
+        return "missing"
+    if os.path.getsize(output_file) == 0:
+        return "empty"
+    with open(output_file, "rb") as out_file:
+        if out_file.read(len(ROOT_MAGIC)) != ROOT_MAGIC:
+            return "not a ROOT file"
+    # only open it with ROOT once the cheap checks pass
+    from ROOT import TFile
+    root_file = TFile.Open(output_file)
+    if not root_file or root_file.IsZombie():
+        return "unreadable"
+    try:
+        if root_file.TestBit(TFile.kRecovered):
+            return "not closed properly"
+        if not root_file.GetListOfKeys().FindObject(c.WTPH_TOP_DIR):
+            return "no " + c.WTPH_TOP_DIR
+    finally:
+        root_file.Close()
+    return None
+
+
+def load_state(state_file):
+    """
+    Load the state of every job, {name: {"status": ..., "job_id": ...}},
+    with any job IDs logged by the submit script since last time.
+    """
+    state = {}
+    if os.path.exists(state_file):
+        with open(state_file, "r") as sfile:
+            state = json.load(sfile)
+    if os.path.exists(JOB_ID_LOG):
+        with open(JOB_ID_LOG, "r") as log_file:
+            for line in log_file:
+                fields = line.split()
+                if len(fields) == 2:
+                    state.setdefault(fields[0], {})["job_id"] = fields[1]
+    return state
+
+
+def save_state(state_file, state):
+    """Save the state of every job (via a temp file)."""
+    tmp_path = state_file + ".tmp"
+    with open(tmp_path, "w") as sfile:
+        json.dump(state, sfile, indent=1, sort_keys=True)
+    os.replace(tmp_path, state_file)
+
+
+def queued_job_ids():
+    """IDs of our jobs pending or running in Slurm (none if no Slurm)."""
+    try:
+        output = subprocess.check_output(
+            ["squeue", "--noheader", "--format=%i", "--user=" + c.USER])
+    except (OSError, subprocess.CalledProcessError):
+        return set()
+    return set(output.decode("utf-8").split())
+
+
+def jobs_to_submit(jobs, state, resume):
+    """
+    Pick out the jobs to submit, updating their state.
+
+    Without resume that's all of them. With it, only those whose outputs
+    are missing or broken and that aren't still in the queue.
+    """
+    queued = queued_job_ids() if resume else set()
+    to_submit = []
+    for job in jobs:
+        job_state = state.setdefault(job["name"], {})
+        job_state["output_file"] = job["output_file"]
+        job_state.pop("problem", None)
+        problem = check_output(job["output_file"]) if resume else None
+        if resume and problem is None:
+            job_state["status"] = "done"
+        elif resume and job_state.get("job_id") in queued:
+            job_state["status"] = "queued"
+        else:
+            job_state["status"] = "to_submit"
+            job_state.pop("pack", None)
+            if problem is not None:
+                job_state["problem"] = problem
+            to_submit.append(job)
+    return to_submit
+
+
+def available_memory_mb():
+    """Memory available for new processes in MB, None if we can't tell."""
+    try:
+        with open("/proc/meminfo", "r") as meminfo:
+            for line in meminfo:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) / 1024.
+    except (IOError, OSError):
+        pass
+    return None
+
+
+class SlurmExecutor(object):
+    """Write a job script per batch job, and a script to submit them all."""
+
+    def __init__(self, options):
+        self.options = options
+
+    def run(self, scripts, state):
+        """Write the job scripts and the submit script."""
+        if os.path.exists(SUBMIT_FILE):
+            os.remove(SUBMIT_FILE)
+        setup = setup_lines(
+            getpass.getpass("Please enter your grid password:"))
+        cwd = os.getcwd()
+        # stuff we'll write into the master script to run at the end
+        main_file_lines = []
+        for script_name, script_jobs, script_time in scripts:
+            job_file = write_job_file(script_name, script_jobs, setup)
+            main_file_lines += submit_lines(
+                script_name, script_jobs, job_file, cwd, script_time)
+
+        with open(SUBMIT_FILE, "w") as subfile:
+            subfile.write("\n".join(main_file_lines))
+
+        print("To run all jobs: source " + SUBMIT_FILE)
+
+
+class LocalExecutor(object):
+    """
+    Run WTPH jobs as local processes, a few at a time.
+
+    A new job is only started while fewer than localJobs are running, the
+    load average is below the number of CPUs and at least minFreeMemory MB
+    is available (except that one job can always run). The state of each
+    job is saved as soon as it finishes, so --resume picks up from there.
+    """
+
+    def __init__(self, options):
+        self.options = options
+
+    def can_start(self, n_running):
+        """Check whether there's room for another WTPH process."""
+        if n_running == 0:
+            return True
+        if n_running >= self.options.localJobs:
+            return False
+        if os.getloadavg()[0] >= multiprocessing.cpu_count():
+            return False
+        free_mb = available_memory_mb()
+        return free_mb is None or free_mb >= self.options.minFreeMemory
+
+    def start(self, job):
+        """Start WTPH for a job, return its process."""
+        log_path = os.path.join(LOCAL_LOG_DIR, job["name"] + ".log")
+        # the process has its own copy of the log file, ours can be closed
+        with open(log_path, "w") as log_file:
+            process = subprocess.Popen(
+                wtph_command(job).split(), stdout=log_file,
+                stderr=subprocess.STDOUT,
+                cwd=os.path.join(c.MTPPP_ROOT, "run"))
+        print("Started", job["name"])
+        return process
+
+    def finish(self, job, process, state):
+        """Record how a finished job went."""
+        job_state = state[job["name"]]
+        problem = "exit code {}".format(process.returncode) \
+            if process.returncode else check_output(job["output_file"])
+        if problem is None:
+            job_state["status"] = "done"
+        else:
+            job_state["status"] = "failed"
+            job_state["problem"] = problem
+        print("Finished", job["name"], problem or "")
+        save_state(self.options.stateFile, state)
+
+    def run(self, scripts, state):
+        """Run every job, returning once they've all finished."""
+        if not os.path.exists(LOCAL_LOG_DIR):
+            os.makedirs(LOCAL_LOG_DIR)
+        # packing doesn't mean anything here, every job is its own process
+        waiting = [job for _, script_jobs, _ in scripts for job in script_jobs]
+        running = []
+        while waiting or running:
+            while waiting and self.can_start(len(running)):
+                job = waiting.pop(0)
+                process = self.start(job)
+                state[job["name"]]["status"] = "running"
+                state[job["name"]]["job_id"] = "local:{}".format(process.pid)
+                running.append((job, process))
+            time.sleep(POLL_SECONDS)
+            still_running = []
+            for job, process in running:
+                if process.poll() is None:
+                    still_running.append((job, process))
+                else:
+                    self.finish(job, process, state)
+            running = still_running
+
+
+class DryRunExecutor(object):
+    """Print what would be run, without running or writing anything."""
+
+    def __init__(self, options):
+        self.options = options
+
+    def run(self, scripts, state):
+        """Print the WTPH commands of each batch job."""
+        for script_name, script_jobs, script_time in scripts:
+            print("# {} ({} runs, {})".format(
+                script_name, len(script_jobs), script_time))
+            for job in script_jobs:
+                print(wtph_command(job))
+
+
+EXECUTORS = {
+    "slurm": SlurmExecutor,
+    "local": LocalExecutor,
+    "dryrun": DryRunExecutor,
+}
+
+
+def main():
+    """Work out which jobs need running, and run them."""
+    options = get_options()
+    dry_run = options.executor == "dryrun"
+
+    # a dry run doesn't touch anything, so input configs need formatting
+    # (and directories making) by a real run first
+    if not dry_run:
+        # ensure that input configs have the propper naming scheme
+        format_input_configs()
+
+        # First, some paths and such:
+        if not os.path.exists(c.WTPH_OUTPUT_DIR):
+            os.mkdir(c.WTPH_OUTPUT_DIR)
+        if not os.path.exists(c.WTPH_JOB_AREA):
+            os.mkdir(c.WTPH_JOB_AREA)
+
+    jobs = list_jobs(options.merged)
+    state = load_state(options.stateFile)
+    to_submit = jobs_to_submit(jobs, state, options.resume)
+    print(len(to_submit), "of", len(jobs), "jobs to submit")
+    if not dry_run:
+        save_state(options.stateFile, state)
+    if not to_submit:
+        return
+
+    if options.pack:
+        packs = pack_jobs(to_submit, time_to_minutes(options.packTime),
+                          options.minutesPerInput)
+        print("Packed into", len(packs), "batch jobs")
+        scripts = [(pack_name(pack), pack, options.packTime)
+                   for pack in packs]
+        for script_name, pack, _ in scripts:
+            for job in pack:
+                state[job["name"]]["pack"] = script_name
+    else:
+        scripts = [(job["name"], [job], c.TIME) for job in to_submit]
+
+    EXECUTORS[options.executor](options).run(scripts, state)
+    if not dry_run:
+        save_state(options.stateFile, state)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+"""
+Module for writing make_2d_eff output as shards, and merging them.
+
+When lots of make_2d_eff jobs write to the same per-year file in 'update'
+mode they fight over it, and every update rewrites keys and grows the file.
+Instead each job can write its own small shard file next to the final file,
+in <final file>.shards/, and once all jobs are done merge_shards builds the
+final file from them in one go.
+
+Shards are named after the job that made them, so re-running a job just
+replaces its shard. If different jobs wrote the same key (e.g. a job for
+one selection re-run after a job for the whole period), the most recently
+written shard wins. Shards only appear under their final name once they
+are completely written, so a crashed job can't leave half a shard behind.
+"""
+import logging
+import os
+
+SHARD_SUFFIX = ".root"
+TMP_SUFFIX = ".tmp"
+
+
+def shard_dir(final_path):
+    """Directory holding the shards of a final output file."""
+    return final_path + ".shards"
+
+
+def shard_path(final_path, shard_name):
+    """Path of one shard of a final output file."""
+    return os.path.join(shard_dir(final_path), shard_name + SHARD_SUFFIX)
+
+
+def open_shard(final_path, shard_name):
+    """Open a fresh shard for writing (under a temporary name)."""
+    from ROOT import TFile
+    if not os.path.exists(shard_dir(final_path)):
+        os.makedirs(shard_dir(final_path))
+    return TFile(shard_path(final_path, shard_name) + TMP_SUFFIX, "recreate")
+
+
+def close_shard(shard_file):
+    """Close a shard opened with open_shard and move it into place."""
+    tmp_path = shard_file.GetName()
+    shard_file.Close()
+    os.replace(tmp_path, tmp_path[:-len(TMP_SUFFIX)])
+
+
+def list_shards(final_path):
+    """Sorted paths of the finished shards of a final output file."""
+    directory = shard_dir(final_path)
+    if not os.path.exists(directory):
+        return []
+    return [os.path.join(directory, f) for f in sorted(os.listdir(directory))
+            if f.endswith(SHARD_SUFFIX)]
+
+
+def shards_oldest_first(shards):
+    """Shards in the order they were written (by name for ties)."""
+    return sorted(shards, key=lambda shard: (os.path.getmtime(shard), shard))
+
+
+def read_objects(directory, path=""):
+    """Recursively yield (dir_path, key_name, object) from a TDirectory."""
+    for key in directory.GetListOfKeys():
+        obj = key.ReadObj()
+        if obj.InheritsFrom("TDirectory"):
+            for item in read_objects(obj, path + key.GetName() + "/"):
+                yield item
+        else:
+            if obj.InheritsFrom("TH1"):
+                obj.SetDirectory(0)
+            yield path, key.GetName(), obj
+
+
+def merge_shards(final_path):
+    """
+    (Re)build a final output file from all of its shards.
+
+    The final file is written from scratch, every directory and key in
+    sorted order, so the same shards always give the same file.
+    If two shards have the same key, the one written last wins.
+    """
+    from ROOT import TFile
+    shards = list_shards(final_path)
+    if not shards:
+        raise ValueError("No shards found in", shard_dir(final_path))
+
+    # {dir_path: {key_name: (shard, object)}}
+    merged = {}
+    for shard in shards_oldest_first(shards):
+        shard_file = TFile(shard)
+        for dir_path, key_name, obj in read_objects(shard_file):
+            dir_objects = merged.setdefault(dir_path, {})
+            if key_name in dir_objects:
+                logging.warning("%s%s in %s replaces the one in %s",
+                                dir_path, key_name, shard,
+                                dir_objects[key_name][0])
+            dir_objects[key_name] = (shard, obj)
+        shard_file.Close()
+
+    tmp_path = final_path + TMP_SUFFIX
+    out_file = TFile(tmp_path, "recreate")
+    for dir_path in sorted(merged):
+        if dir_path:
+            out_file.mkdir(dir_path)
+            out_file.cd(dir_path)
+        else:
+            out_file.cd()
+        for key_name in sorted(merged[dir_path]):
+            merged[dir_path][key_name][1].Write(key_name)
+    out_file.Close()
+    os.replace(tmp_path, final_path)
+    logging.info("Merged %s shards into %s", len(shards), final_path)
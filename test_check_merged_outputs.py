@@ -0,0 +1,90 @@
+"""
+Tests for check_merged_outputs, on columnar WTPH outputs (no ROOT needed).
+
+python -m pytest test_check_merged_outputs.py
+"""
+import numpy as np
+import constants as c
+from check_merged_outputs import check_merged_outputs
+from make_2d_eff import input_filepath_fmt, selection_hist_paths
+from merged_config import merged_selection_name
+from triggers import triggers_in_period
+from wtph_columnar import columnar_path, write_columnar
+
+YEAR = "18"
+PERIOD = "B"
+TRIGGER_TYPE = "SingleMuonTriggers"
+CHANGED_VARIATION = "noIP"
+
+
+def selection():
+    """A (quality, region, trigger) make_2d_eff makes SFs for."""
+    trigger = triggers_in_period(True, int("20" + YEAR), PERIOD)[0]
+    return c.WORKING_POINTS[0], c.DETECTOR_REGIONS[0], trigger
+
+
+def merged_path(path, variation):
+    """Where a standalone output's hist is in the merged output."""
+    quality, region, _ = selection()
+    sel_dir = quality + "MuonProbes_" + region
+    return path.replace(sel_dir, merged_selection_name(
+        quality + "MuonProbes", variation) + "_" + region)
+
+
+def records(rng):
+    """Probe and match hist records of one selection, {path: record}."""
+    return {path: {
+        "class_name": "TH2D", "title": "", "x_title": "", "y_title": "",
+        "x_edges": np.linspace(-2.5, 2.5, 4),
+        "y_edges": np.linspace(-np.pi, np.pi, 3),
+        "contents": rng.poisson(100, size=20).astype(float),
+        "sumw2": rng.poisson(100, size=20).astype(float)}
+            for path in selection_hist_paths(*selection())}
+
+
+def write_outputs(input_dir, change_merged):
+    """
+    Write standalone and merged outputs with the same hists,
+    the merged one changed for CHANGED_VARIATION if change_merged.
+    """
+    var_conf_fmt = input_filepath_fmt(
+        input_dir, YEAR, PERIOD, c.NTUPLE_VERSION, TRIGGER_TYPE)
+    rng = np.random.RandomState(0)
+    for data_mc in ["data", "mc"]:
+        merged = {}
+        for variation in c.VARIATIONS:
+            standalone = records(rng)
+            write_columnar(
+                columnar_path(var_conf_fmt.format(
+                    data_mc=data_mc, variation=variation)),
+                standalone, "test", [0, 0])
+            for path, record in standalone.items():
+                record = dict(record)
+                if change_merged and variation == CHANGED_VARIATION:
+                    record["contents"] = record["contents"] + 1
+                merged[merged_path(path, variation)] = record
+        write_columnar(
+            columnar_path(var_conf_fmt.format(
+                data_mc=data_mc, variation=c.MERGED_VARIATION)),
+            merged, "test", [0, 0])
+    return var_conf_fmt
+
+
+def test_same_outputs(tmp_path):
+    """Nothing to report if every variation matches."""
+    var_conf_fmt = write_outputs(str(tmp_path), change_merged=False)
+    problems = check_merged_outputs(var_conf_fmt, YEAR, PERIOD, TRIGGER_TYPE,
+                                    columnar=True)
+    assert len(problems) == 2 * len(c.VARIATIONS)
+    assert not any(problems.values())
+
+
+def test_changed_variation(tmp_path):
+    """A variation selecting different probes when merged is reported."""
+    var_conf_fmt = write_outputs(str(tmp_path), change_merged=True)
+    problems = check_merged_outputs(var_conf_fmt, YEAR, PERIOD, TRIGGER_TYPE,
+                                    columnar=True)
+    assert sorted(key for key, value in problems.items() if value) == [
+        ("data", CHANGED_VARIATION), ("mc", CHANGED_VARIATION)]
+    assert all("contents differs" in problem
+               for problem in problems[("data", CHANGED_VARIATION)])
@@ -0,0 +1,85 @@
+"""
+Tests for reading WTPH outputs converted with wtph_columnar in make_2d_eff.
+
+python -m pytest test_wtph_columnar.py
+
+The round trip through a real TFile is skipped if ROOT can't be imported.
+"""
+import numpy as np
+import pytest
+import constants as c
+from make_2d_eff import (find_selections, input_file, read_selection,
+                         selection_hist_paths)
+from triggers import triggers_in_period
+from wtph_columnar import (ColumnarInputFile, columnar_path, convert,
+                           hist_key, write_columnar)
+
+YEAR = "18"
+PERIOD = "B"
+TRIGGER_TYPE = "SingleMuonTriggers"
+
+
+def one_selection():
+    """A (quality, region, trigger) make_2d_eff makes SFs for."""
+    trigger = triggers_in_period(True, int("20" + YEAR), PERIOD)[0]
+    return c.WORKING_POINTS[0], c.DETECTOR_REGIONS[0], trigger
+
+
+def test_selection_hist_paths_are_keys():
+    """The paths make_2d_eff reads are the keys the converter writes."""
+    for path in selection_hist_paths(*one_selection()):
+        assert "//" not in path
+        assert path == hist_key(*path.split("/"))
+
+
+def test_hist_ignores_doubled_slashes(tmp_path):
+    """Hists are found however their path is joined, like ROOT's Get."""
+    record = {"class_name": "TH2D", "title": "", "x_title": "",
+              "y_title": "", "x_edges": np.arange(3.), "y_edges":
+              np.arange(2.), "contents": np.arange(12.), "sumw2":
+              np.arange(12.)}
+    cols_path = str(tmp_path / "test.cols")
+    write_columnar(cols_path, {hist_key("a", "b", "h"): record}, "test",
+                   [0, 0])
+    cols_file = ColumnarInputFile(cols_path)
+    np.testing.assert_array_equal(
+        cols_file.hist("a/b//h")["contents"], record["contents"])
+    assert cols_file.list_dir("a") == ["b"]
+
+
+def test_convert_then_read_selection(tmp_path):
+    """A TFile laid out like a WTPH output reads back the same hists."""
+    ROOT = pytest.importorskip("ROOT")
+    from eff_engine import hist_arrays
+    quality, region, trigger = one_selection()
+    root_path = str(tmp_path / "data18B_nominal.root")
+
+    rng = np.random.RandomState(0)
+    root_file = ROOT.TFile(root_path, "recreate")
+    for path in selection_hist_paths(quality, region, trigger):
+        directory, name = path.rsplit("/", 1)
+        root_file.mkdir(directory, "", True)
+        root_file.cd(directory)
+        hist = ROOT.TH2D(name, "", 4, -2.5, 2.5, 3, -np.pi, np.pi)
+        hist.Sumw2()
+        for eta, phi in rng.uniform(-2, 2, size=(50, 2)):
+            hist.Fill(eta, phi, rng.uniform(0.8, 1.2))
+        hist.Write()
+    root_file.Close()
+
+    assert convert(root_path) == columnar_path(root_path)
+    cols_file = input_file(root_path, columnar=True)
+    assert isinstance(cols_file, ColumnarInputFile)
+    assert find_selections(cols_file, YEAR, PERIOD, TRIGGER_TYPE) == [
+        (quality, region, trigger)]
+    probes, matches, _ = read_selection(
+        {"data": {"nominal": cols_file}, "mc": {"nominal": cols_file}},
+        quality, region, trigger)
+
+    root_file = ROOT.TFile(root_path)
+    probe_path, match_path = selection_hist_paths(quality, region, trigger)
+    for path, read in [(probe_path, probes), (match_path, matches)]:
+        contents, sumw2 = hist_arrays(root_file.Get(path))
+        np.testing.assert_array_equal(read["data"]["nominal"][0], contents)
+        np.testing.assert_array_equal(read["data"]["nominal"][1], sumw2)
+    root_file.Close()
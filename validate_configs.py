@@ -0,0 +1,268 @@
+"""
+Script for checking generated run configs before WTPH jobs use them.
+
+python validate_configs.py [-j 8] [configs...]
+
+Every MuonProbes_*.conf in SingleMuonTriggers/ and MultiLegTriggers/ (or
+just the given configs) is parsed, along with everything it imports, and
+checked that:
+    - every Import resolves to a file
+    - New_*/End_* blocks are balanced
+    - every selection has a NameProbeSel
+    - every Matches name has a New_MatchSelection with that MatchName
+    - every match only cuts on probe_matched_<trigger> of its own triggers
+    - every DetRegion name has a New_DetRegion with that RegionName
+    - the runNumber cut is the period's range in run_numbers
+Imports under constants.ZTRIGGER_DIR are looked for in --confRoot (by
+default here, where make_configs writes them). Configs are checked in
+parallel with -j, each imported file is only parsed once per process.
+Every problem is listed, and the exit status is 1 if there were any.
+"""
+from __future__ import print_function
+import glob
+import multiprocessing
+import optparse
+import os
+import sys
+import constants as c
+from run_config import keyword
+from run_numbers import RUN_NUMBERS
+
+CONFIG_GLOB = "MuonProbes_*.conf"
+# keywords opening a block, other than New_<X> (which End_<X> closes)
+BLOCK_ENDS = {"MatchCombCut": "End_CombCut", "ProbeCombCut": "End_CombCut"}
+OR_SEP = "_OR_"
+RUN_NUMBER_CUT = ["GlobalCut", "int", "runNumber", "RNG"]
+
+# every file parsed so far in this process, {path: parsed file}
+_PARSED = {}
+
+
+def resolve_import(import_path, conf_root):
+    """Where an imported file is, locally."""
+    if import_path.startswith(c.ZTRIGGER_DIR):
+        import_path = import_path[len(c.ZTRIGGER_DIR):]
+    return os.path.normpath(os.path.join(conf_root, import_path))
+
+
+def block_end(word):
+    """Keyword closing a block opened by word, None if it doesn't open one."""
+    if word.startswith("New_"):
+        return "End_" + word[len("New_"):]
+    return BLOCK_ENDS.get(word)
+
+
+def parse_file(path):
+    """
+    Parse a config (without its imports) into
+    {"imports": [path], "match_names": {name: [branch]},
+     "regions": [name], "selections": [{"line", "name", "matches",
+     "regions"}], "run_ranges": [(start, end)], "problems": [str]}.
+    """
+    parsed = {"imports": [], "match_names": {}, "regions": [],
+              "selections": [], "run_ranges": [], "problems": []}
+    with open(path, "r", encoding="utf-8") as conf_file:
+        lines = conf_file.read().splitlines()
+
+    open_blocks = []
+    current = None
+    for number, line in enumerate(lines, 1):
+        words = line.split()
+        word = keyword(line)
+        if not words or word.startswith("#"):
+            continue
+        where = "{}:{}".format(path, number)
+
+        if word.startswith("End_"):
+            if not open_blocks or open_blocks[-1][0] != word:
+                parsed["problems"].append(
+                    "{}: unexpected {}".format(where, word))
+            else:
+                open_blocks.pop()
+            if word in ["End_TPSelection", "End_MatchSelection"]:
+                current = None
+            continue
+        if block_end(word) is not None:
+            open_blocks.append((block_end(word), where))
+
+        if word == "Import" and len(words) > 1:
+            parsed["imports"].append(words[1])
+        elif word == "New_TPSelection":
+            current = {"line": where, "name": None, "matches": [],
+                       "regions": []}
+            parsed["selections"].append(current)
+        elif word == "New_MatchSelection":
+            current = {"name": None, "branches": []}
+        elif word == "NameProbeSel" and current is not None:
+            current["name"] = " ".join(words[1:])
+        elif word == "Matches" and current is not None:
+            current["matches"] += words[1:]
+        elif word == "DetRegion" and current is not None:
+            current["regions"] += words[1:]
+        elif word == "MatchName" and current is not None:
+            current["name"] = words[1]
+            parsed["match_names"][words[1]] = current["branches"]
+        elif word == "Cut" and current is not None and "branches" in current:
+            if len(words) > 2 and words[2].startswith("probe_matched_"):
+                current["branches"].append(words[2])
+        elif word == "RegionName":
+            parsed["regions"] += words[1:]
+        elif words[:4] == RUN_NUMBER_CUT and len(words) == 6:
+            parsed["run_ranges"].append((int(words[4]), int(words[5])))
+
+    for end, where in open_blocks:
+        parsed["problems"].append("{}: no {}".format(where, end))
+    return parsed
+
+
+def parsed_file(path):
+    """Parse a file, the first time it's asked for."""
+    if path not in _PARSED:
+        _PARSED[path] = parse_file(path)
+    return _PARSED[path]
+
+
+def with_imports(path, conf_root):
+    """
+    A config and everything it imports (however deep), as a list of
+    (path, parsed file), and a list of problems resolving the imports.
+    """
+    files, problems = [], []
+    to_visit = [path]
+    seen = set()
+    while to_visit:
+        current = to_visit.pop(0)
+        if current in seen:
+            continue
+        seen.add(current)
+        parsed = parsed_file(current)
+        files.append((current, parsed))
+        for import_path in parsed["imports"]:
+            resolved = resolve_import(import_path, conf_root)
+            if not os.path.exists(resolved):
+                problems.append("{}: can't find import {} (looked for {})"
+                                .format(current, import_path, resolved))
+            else:
+                to_visit.append(resolved)
+    return files, problems
+
+
+def period_of_config(path):
+    """(year, period) from a run config name, (None, None) if it has none."""
+    parts = os.path.splitext(os.path.basename(path))[0].split("_")
+    try:
+        return int(parts[-2]), parts[-1]
+    except (IndexError, ValueError):
+        return None, None
+
+
+def match_problems(match_name, branches):
+    """Problems with a match only cutting on its own triggers."""
+    legs = ["probe_matched_" + leg for leg in match_name.split(OR_SEP)]
+    problems = []
+    if not branches:
+        problems.append("match {} has no probe_matched_* cut".format(
+            match_name))
+    for branch in branches:
+        if branch not in legs:
+            problems.append("match {} cuts on {}".format(match_name, branch))
+    return problems
+
+
+def validate_config(path, conf_root="."):
+    """Every problem with a run config, as a list of strings."""
+    files, problems = with_imports(path, conf_root)
+    match_names = {}
+    regions = set()
+    for file_path, parsed in files:
+        problems += parsed["problems"]
+        for name, branches in parsed["match_names"].items():
+            match_names[name] = branches
+            problems += ["{}: {}".format(file_path, problem)
+                         for problem in match_problems(name, branches)]
+        regions.update(parsed["regions"])
+
+    config = parsed_file(path)
+    for selection in config["selections"]:
+        where = selection["line"]
+        if not selection["name"]:
+            problems.append("{}: selection has no NameProbeSel".format(where))
+        if not selection["matches"]:
+            problems.append("{}: selection has no Matches".format(where))
+        for match in selection["matches"]:
+            if match not in match_names:
+                problems.append("{}: no MatchName {}".format(where, match))
+        for region in selection["regions"]:
+            if region not in regions:
+                problems.append("{}: no RegionName {}".format(where, region))
+
+    year, period = period_of_config(path)
+    if year not in RUN_NUMBERS or period not in RUN_NUMBERS[year]:
+        problems.append("{}: unknown year/period {} {}".format(
+            path, year, period))
+    else:
+        expected = (RUN_NUMBERS[year][period]["START"],
+                    RUN_NUMBERS[year][period]["END"])
+        if config["run_ranges"] != [expected]:
+            problems.append(
+                "{}: runNumber cuts {} should be just {} {}".format(
+                    path, config["run_ranges"], *expected))
+    return problems
+
+
+def _validate_config_task(task):
+    """Unpack a task tuple for validate_config, for a process pool."""
+    return task[0], validate_config(*task)
+
+
+def validate_configs(paths, conf_root=".", jobs=1):
+    """Problems with each of the given configs, {path: [problem]}."""
+    tasks = [(path, conf_root) for path in paths]
+    if jobs > 1:
+        pool = multiprocessing.Pool(jobs)
+        results = pool.map(_validate_config_task, tasks,
+                           chunksize=max(1, len(tasks) // (4 * jobs)))
+        pool.close()
+        pool.join()
+    else:
+        results = [_validate_config_task(task) for task in tasks]
+    return dict(results)
+
+
+def default_configs(conf_root="."):
+    """Every run config under conf_root."""
+    paths = []
+    for trigger_type in [c.SINGLE_MUON_DIR, c.MULTI_LEG_DIR]:
+        paths += glob.glob(os.path.join(conf_root, trigger_type, CONFIG_GLOB))
+    return sorted(paths)
+
+
+def get_options():
+    """Get options from the command line."""
+    parser = optparse.OptionParser(usage="%prog [options] [configs...]")
+    # number of processes to check configs with
+    parser.add_option('-j', '--jobs', type='int', default=1, dest='jobs')
+    # where files imported from constants.ZTRIGGER_DIR are
+    parser.add_option('--confRoot', type='string', default=".",
+                      dest='confRoot')
+    return parser.parse_args()
+
+
+def main():
+    """Check configs, list the problems."""
+    options, paths = get_options()
+    if not paths:
+        paths = default_configs(options.confRoot)
+    problems = validate_configs(paths, options.confRoot, options.jobs)
+    n_bad = 0
+    for path in sorted(problems):
+        if problems[path]:
+            n_bad += 1
+            for problem in problems[path]:
+                print(problem)
+    print("{} of {} configs have problems".format(n_bad, len(paths)))
+    sys.exit(1 if n_bad else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,67 @@
-"""Module for making systematic variation configs."""
+"""
+Module for making systematic variation configs.
+
+Each variation is a list of rules in VARIATION_RULES, (transform, argument)
+pairs applied in order to the parsed nominal config (see run_config):
+    add_global_cut      add a cut where the nominal has EXTRA_CUTS_MARKER
+    replace_global_cut  replace a global cut, argument is (old, new)
+    remove_global_cut   remove a global cut
+    cap_probe_pt        also cut every selection's probe pt from above
+    raise_probe_pt      raise every selection's probe pt cut
+Cuts may have {fields} in them, filled in per period from
+period_values, e.g. {nvtx} for the number of vertices to split at.
+Adding a variation is just adding its rules.
+"""
+from config_files import write_if_changed
 from constants import SM_VAR_CONFIG_PATH_FMT,\
     ML_VAR_CONFIG_PATH_FMT
+from run_config import EXTRA_CUTS_MARKER
+
+PROBE_PT_CUT = "ProbeCut floatGeV probe_pt >"
+
+# number of primary vertices the nvtx variations split at
+NVTX_THRESHOLD = 19
+# periods that need a different one, {(year, period): threshold},
+# year as in constants.YEARS
+# (e.g. 2017 period K should probably be 25, see the TODO in make_2d_eff)
+NVTX_THRESHOLDS = {}
+
+VARIATION_RULES = {
+    "nominal": [],
+    "dphill": [
+        ("add_global_cut", "ProbeCut float dilep_dphi |<| 3.0426")],
+    "isoPflowLoose_VarRad": [
+        ("add_global_cut",
+         "GlobalCut bool probe_matched_IsoPflowLoose_VarRad = 1")],
+    "isoPflowTight_VarRad": [
+        ("add_global_cut",
+         "GlobalCut bool probe_matched_IsoPflowTight_VarRad = 1")],
+    "isoLoose_VarRad": [
+        ("add_global_cut",
+         "GlobalCut bool probe_matched_IsoLoose_VarRad = 1")],
+    "isoTight_VarRad": [
+        ("add_global_cut",
+         "GlobalCut bool probe_matched_IsoTight_VarRad = 1")],
+    "mll": [
+        ("replace_global_cut",
+         ("ProbeCut floatGeV dilep_mll |RNG| 81.2 101.2",
+          "ProbeCut floatGeV dilep_mll |RNG| 76.2 106.2"))],
+    "muneg": [("add_global_cut", "GlobalCut float probe_q < 0.0")],
+    "mupos": [("add_global_cut", "GlobalCut float probe_q > 0.0")],
+    "noIP": [
+        ("remove_global_cut", "GlobalCut float z0SinTheta < 0.5"),
+        ("remove_global_cut", "GlobalCut D0Sig probe |<| 3")],
+    "nvtx_dw": [("add_global_cut", "GlobalCut int PV_n < {nvtx}")],
+    "nvtx_up": [("add_global_cut", "GlobalCut int PV_n >= {nvtx}")],
+    "ptdw": [("cap_probe_pt", None)],
+    "ptup": [("raise_probe_pt", None)],
+}
+
+
+def period_values(year, period):
+    """Values of the {fields} in cuts, for a period."""
+    return {"nvtx": NVTX_THRESHOLDS.get((year, period), NVTX_THRESHOLD)}
+
 
 def new_pt_from_cut_line(single, line: str, return_original=False):
     """Given a cut line, return the new pt, i.e. if """
@@ -20,103 +81,100 @@ def new_pt_from_cut_line(single, line: str, return_original=False):
     return new_pt
 
 
-def make_variation_config(nominal_template, variation, year, period, single):
-    """Make a systematic variation config file."""
-    # get template text
-    with open(nominal_template, "r", encoding="utf-8") as variation_file:
-        var_file_text = variation_file.read()
-
-    # make edits based on variation
-    if variation == "nominal":
-        var_file_text = var_file_text.replace(
-            "EXTRA_GLOBAL_CUTS_HERE\n",
-            "")
-    elif variation == "dphill":
-        var_file_text = var_file_text.replace(
-            "EXTRA_GLOBAL_CUTS_HERE",
-            "ProbeCut float dilep_dphi |<| 3.0426")
-    elif variation == "isoPflowLoose_VarRad":
-        var_file_text = var_file_text.replace(
-            "EXTRA_GLOBAL_CUTS_HERE",
-            "GlobalCut bool probe_matched_IsoPflowLoose_VarRad = 1")
-    elif variation == "isoPflowTight_VarRad":
-        var_file_text = var_file_text.replace(
-            "EXTRA_GLOBAL_CUTS_HERE",
-            "GlobalCut bool probe_matched_IsoPflowTight_VarRad = 1")
-    elif variation == "isoLoose_VarRad":
-        var_file_text = var_file_text.replace(
-            "EXTRA_GLOBAL_CUTS_HERE",
-            "GlobalCut bool probe_matched_IsoLoose_VarRad = 1")
-    elif variation == "isoTight_VarRad":
-        var_file_text = var_file_text.replace(
-            "EXTRA_GLOBAL_CUTS_HERE",
-            "GlobalCut bool probe_matched_IsoTight_VarRad = 1")
-    elif variation == "mll":
-        var_file_text = var_file_text.replace(
-            "EXTRA_GLOBAL_CUTS_HERE\n",
-            "").replace(
-                "ProbeCut floatGeV dilep_mll |RNG| 81.2 101.2",
-                "ProbeCut floatGeV dilep_mll |RNG| 76.2 106.2")
-    elif variation == "muneg":
-        var_file_text = var_file_text.replace(
-            "EXTRA_GLOBAL_CUTS_HERE",
-            "GlobalCut float probe_q < 0.0")
-    elif variation == "mupos":
-        var_file_text = var_file_text.replace(
-            "EXTRA_GLOBAL_CUTS_HERE",
-            "GlobalCut float probe_q > 0.0")
-    elif variation == "noIP":
-        var_file_text = var_file_text.replace(
-            "EXTRA_GLOBAL_CUTS_HERE\n",
-            "").replace(
-                "GlobalCut float z0SinTheta < 0.5\n",
-                "").replace(
-                    "GlobalCut D0Sig probe |<| 3\n",
-                    "")
-    elif variation == "nvtx_dw":
-        var_file_text = var_file_text.replace(
-            "EXTRA_GLOBAL_CUTS_HERE",
-            "GlobalCut int PV_n < 19")
-    elif variation == "nvtx_up":
-        var_file_text = var_file_text.replace(
-            "EXTRA_GLOBAL_CUTS_HERE",
-            "GlobalCut int PV_n >= 19")
-    elif variation == "ptdw":
-        lines = var_file_text.splitlines(keepends=True)
-        new_lines = []
-        for line in lines:
-            new_lines.append(line)
-            if "ProbeCut floatGeV probe_pt >" in line:
+def _global_cut_index(config, cut):
+    """Index of a global cut in the header of a config."""
+    for i, line in enumerate(config.header):
+        if line.strip() == cut:
+            return i
+    raise ValueError("Global cut not in nominal config:", cut)
+
+
+def add_global_cut(config, cut, _single):
+    """Add a global cut where the nominal config has the marker for it."""
+    index = _global_cut_index(config, EXTRA_CUTS_MARKER)
+    config.header.insert(index, cut + "\n")
+
+
+def replace_global_cut(config, old_new, _single):
+    """Replace one global cut with another."""
+    old, new = old_new
+    index = _global_cut_index(config, old)
+    config.header[index] = config.header[index].replace(old, new)
+
+
+def remove_global_cut(config, cut, _single):
+    """Remove a global cut."""
+    del config.header[_global_cut_index(config, cut)]
+
+
+def cap_probe_pt(config, _argument, single):
+    """Add a probe pt <= new pt cut after every selection's pt cut."""
+    for selection in config.selections:
+        lines = []
+        for line in selection.lines:
+            lines.append(line)
+            if PROBE_PT_CUT in line:
                 new_pt = new_pt_from_cut_line(single, line)
-                new_lines.append(
+                lines.append(
                     f"    ProbeCut floatGeV probe_pt <= {new_pt:.1f}\n")
-        var_file_text = "".join(new_lines).replace(
-            "EXTRA_GLOBAL_CUTS_HERE\n",
-            "")
-    elif variation == "ptup":
-        lines = var_file_text.splitlines(keepends=True)
-        new_lines = []
-        for line in lines:
-            if "ProbeCut floatGeV probe_pt >" in line:
+        selection.lines = lines
+
+
+def raise_probe_pt(config, _argument, single):
+    """Raise every selection's probe pt cut to the new pt."""
+    for selection in config.selections:
+        for i, line in enumerate(selection.lines):
+            if PROBE_PT_CUT in line:
                 line_pt, new_pt = new_pt_from_cut_line(
                     single, line, return_original=True)
-                new_lines.append(line.replace(line_pt, f"{new_pt:.1f}\n"))
-            else:
-                new_lines.append(line)
-
-        var_file_text = "".join(new_lines).replace(
-            "EXTRA_GLOBAL_CUTS_HERE\n",
-            "")
-        var_file_text = var_file_text.replace(
-            "ProbeCut floatGeV probe_pt > 27.3",
-            "ProbeCut floatGeV probe_pt > 40.0").replace(
-                "ProbeCut floatGeV probe_pt > 52.5",
-                "ProbeCut floatGeV probe_pt > 70.0")
-    else:
+                selection.lines[i] = line.replace(
+                    line_pt, f"{new_pt:.1f}\n")
+
+
+TRANSFORMS = {
+    "add_global_cut": add_global_cut,
+    "replace_global_cut": replace_global_cut,
+    "remove_global_cut": remove_global_cut,
+    "cap_probe_pt": cap_probe_pt,
+    "raise_probe_pt": raise_probe_pt,
+}
+
+
+def _fill_fields(argument, values):
+    """Fill in the {fields} of a rule's cut(s) for a period."""
+    if isinstance(argument, str):
+        return argument.format(**values)
+    if isinstance(argument, tuple):
+        return tuple(_fill_fields(arg, values) for arg in argument)
+    return argument
+
+
+def apply_variation(nominal, variation, single, year=None, period=None):
+    """
+    Get a variation of a parsed nominal config (see run_config),
+    leaving the nominal one as it is.
+    """
+    if variation not in VARIATION_RULES:
         raise ValueError(f"Variation {variation} unaccounted for!")
+    config = nominal.copy()
+    values = period_values(year, period)
+    for transform, argument in VARIATION_RULES[variation]:
+        TRANSFORMS[transform](config, _fill_fields(argument, values), single)
+    return config
+
+
+def make_variation_config(nominal, variation, year, period, single):
+    """
+    Make a systematic variation config file from the parsed nominal config
+    (run_config.parse_config of nominal_config.nominal_text).
+
+    Returns (filename, whether it changed).
+    """
+    var_file_text = apply_variation(
+        nominal, variation, single, year, period).text()
 
     # save the file
     fmt = SM_VAR_CONFIG_PATH_FMT if single else ML_VAR_CONFIG_PATH_FMT
     var_filename = fmt.format(variation=variation, year=year, period=period)
-    with open(var_filename, "w", encoding="utf-8") as variation_file:
-        variation_file.write(var_file_text)
+    changed = write_if_changed(var_filename, var_file_text)
+    return var_filename, changed
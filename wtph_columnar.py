@@ -0,0 +1,229 @@
+"""
+Module for converting WTPH outputs to a columnar format, and reading it.
+
+Run this after WriteTagProbeHistos, e.g.
+
+python wtph_columnar.py -i [WTPH output directory]
+
+Every hist under ZmumuTPMerged/ in each WTPH output file.root is written to
+file.cols next to it: a small JSON header describing each hist, followed by
+one contiguous block of float64s holding all bin edges, contents and sumw2.
+make_2d_eff (with --columnar) then memory-maps those instead of opening
+ROOT files, so only the bins it actually uses are ever read.
+
+Layout of a .cols file:
+    8 bytes     MAGIC
+    8 bytes     header length in bytes (little-endian uint64)
+    header      JSON, padded with spaces to a multiple of 8 bytes
+    data        float64 array, offsets/lengths in the header are into this
+"""
+from __future__ import print_function
+import json
+import logging
+import optparse
+import os
+import posixpath
+import struct
+import sys
+import numpy as np
+import constants as c
+import instrumentation
+from eff_engine import hist_arrays, hist_binning
+from hist_cache import file_stamp
+
+MAGIC = b"ZTRIGCOL"
+COLUMNAR_SUFFIX = ".cols"
+ARRAY_FIELDS = ["contents", "sumw2", "x_edges", "y_edges"]
+STRING_FIELDS = ["class_name", "title", "x_title", "y_title"]
+
+
+def columnar_path(root_path):
+    """Where the columnar version of a WTPH output goes."""
+    return os.path.splitext(root_path)[0] + COLUMNAR_SUFFIX
+
+
+def read_header(cols_path):
+    """Return (header, data_offset) of a columnar file."""
+    with open(cols_path, "rb") as cols_file:
+        if cols_file.read(len(MAGIC)) != MAGIC:
+            raise ValueError("Not a columnar WTPH file:", cols_path)
+        header_len, = struct.unpack("<Q", cols_file.read(8))
+        header = json.loads(cols_file.read(header_len).decode("utf-8"))
+    return header, len(MAGIC) + 8 + header_len
+
+
+def is_up_to_date(root_path):
+    """Check whether a WTPH output has a columnar version matching it."""
+    cols_path = columnar_path(root_path)
+    if not os.path.exists(cols_path):
+        return False
+    header = read_header(cols_path)[0]
+    return header["source_stamp"] == file_stamp(root_path).tolist()
+
+
+def hist_key(*parts):
+    """
+    Key of a hist in a columnar file, from its path (or the parts of it):
+    joined with single slashes, as ROOT would find it with Get.
+    """
+    return posixpath.normpath("/".join(parts))
+
+
+def walk_hists(directory, path=""):
+    """Recursively yield (key, hist) for every hist in a TDirectory."""
+    for key in directory.GetListOfKeys():
+        obj = key.ReadObj()
+        obj_path = hist_key(path, key.GetName()) if path else key.GetName()
+        if obj.InheritsFrom("TDirectory"):
+            for item in walk_hists(obj, obj_path):
+                yield item
+        elif obj.InheritsFrom("TH2"):
+            yield obj_path, obj
+
+
+def convert(root_path):
+    """Write the columnar version of one WTPH output, return its path."""
+    from ROOT import TFile
+    root_file = TFile(root_path)
+    top_dir = root_file.Get(c.WTPH_TOP_DIR)
+    if not top_dir:
+        raise ValueError("No " + c.WTPH_TOP_DIR + " in", root_path)
+
+    records = {}
+    for hist_path, hist in walk_hists(top_dir, c.WTPH_TOP_DIR):
+        contents, sumw2 = hist_arrays(hist)
+        record = hist_binning(hist)
+        record["contents"] = contents
+        record["sumw2"] = sumw2
+        records[hist_key(hist_path)] = record
+    root_file.Close()
+
+    cols_path = columnar_path(root_path)
+    write_columnar(cols_path, records, os.path.basename(root_path),
+                   file_stamp(root_path).tolist())
+    return cols_path
+
+
+def write_columnar(cols_path, records, source, source_stamp):
+    """
+    Write hist records ({hist_path: {field: value}}, see HIST_FIELDS in
+    hist_cache) to a columnar file.
+
+    source and source_stamp say which WTPH output they came from.
+    """
+    hists = {}
+    arrays = []
+    offset = 0
+    for hist_path, record in records.items():
+        entry = {}
+        for field in STRING_FIELDS:
+            entry[field] = str(record[field])
+        for field in ARRAY_FIELDS:
+            arr = np.asarray(record[field], dtype="<f8")
+            entry[field] = [offset, len(arr)]
+            arrays.append(arr)
+            offset += len(arr)
+        hists[hist_path] = entry
+
+    header = {"source": source,
+              "source_stamp": source_stamp,
+              "hists": hists}
+    header_bytes = json.dumps(header, sort_keys=True).encode("utf-8")
+    header_bytes += b" " * (-len(header_bytes) % 8)
+
+    tmp_path = cols_path + ".tmp"
+    with open(tmp_path, "wb") as cols_file:
+        cols_file.write(MAGIC)
+        cols_file.write(struct.pack("<Q", len(header_bytes)))
+        cols_file.write(header_bytes)
+        if arrays:
+            np.concatenate(arrays).tofile(cols_file)
+    os.replace(tmp_path, cols_path)
+    logging.info("Wrote %s hists to %s", len(hists), cols_path)
+
+
+def convert_dir(input_dir, force=False):
+    """Convert every WTPH output in a directory that isn't up to date."""
+    converted = []
+    for filename in sorted(os.listdir(input_dir)):
+        if not filename.endswith(".root"):
+            continue
+        root_path = os.path.join(input_dir, filename)
+        if force or not is_up_to_date(root_path):
+            converted.append(convert(root_path))
+    return converted
+
+
+class ColumnarInputFile(object):
+    """
+    A WTPH output in columnar format, read with the same methods
+    as hist_cache.CachedInputFile but without ROOT.
+    """
+
+    def __init__(self, filepath):
+        self.filepath = filepath
+        self._hists = None
+        self._data = None
+
+    def _load(self):
+        """Read the header and memory-map the data, the first time only."""
+        if self._hists is None:
+            instrumentation.count("files_opened")
+            with instrumentation.timer("open"):
+                header, data_offset = read_header(self.filepath)
+            self._hists = header["hists"]
+            if os.path.getsize(self.filepath) > data_offset:
+                self._data = np.memmap(self.filepath, dtype="<f8", mode="r",
+                                       offset=data_offset)
+            else:
+                self._data = np.zeros(0)
+
+    def hist(self, hist_path):
+        """Contents, sumw2 and binning of a hist, {field: array}."""
+        self._load()
+        key = hist_key(hist_path)
+        if key not in self._hists:
+            raise ValueError(
+                "Couldn't find {}. Does this really exist in {}?\n".format(
+                    hist_path, self.filepath))
+        entry = self._hists[key]
+        record = {field: entry[field] for field in STRING_FIELDS}
+        for field in ARRAY_FIELDS:
+            offset, length = entry[field]
+            record[field] = self._data[offset:offset + length]
+        return record
+
+    def list_dir(self, path):
+        """Sorted names of everything directly inside a directory."""
+        self._load()
+        prefix = path.rstrip("/") + "/"
+        return sorted({
+            hist_path[len(prefix):].split("/")[0] for hist_path in self._hists
+            if hist_path.startswith(prefix)})
+
+    def close(self):
+        """Drop the memory map."""
+        self._hists = None
+        self._data = None
+
+
+def main():
+    """Convert WTPH outputs to columnar files."""
+    parser = optparse.OptionParser()
+    # directory with the WTPH outputs to convert
+    parser.add_option('-i', '--inDir', type='string', default=None,
+                      dest='inDir')
+    # convert even if an up-to-date columnar file exists
+    parser.add_option('--force', action='store_true', default=False,
+                      dest='force')
+    (options, _) = parser.parse_args()
+    logging.basicConfig(stream=sys.stdout, level=logging.INFO)
+
+    if options.inDir is None or not os.path.exists(options.inDir):
+        raise ValueError("Input directory does not exist!", options.inDir)
+    converted = convert_dir(options.inDir, options.force)
+    print("Converted", len(converted), "files")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,8 @@
 """Module for dealing with WTPH input configs."""
 import os
-import shutil
 
 import constants as c
+from config_files import write_if_changed
 from run_numbers import RUN_NUMBERS
 
 
@@ -15,163 +15,152 @@ def check_formatted():
                 assert c.WTPH_INPUT_CONF_FMT[data_mc].format(
                     year=year, period=period) in input_configs
 
-def replace_16_20():
+def replace_16_20(text):
     """
-    Replace mc16 with mc20.
+    Replace mc16 with mc20, in the text of a config.
     Really we should fix CreateInputConfigs,
     but changes get merged so damn slow.
     """
-    for year in c.YEARS:
-        for period in RUN_NUMBERS[year]:
-            for data_mc in ["data", "mc"]:
-                config = c.WTPH_INPUT_CONF_FMT[data_mc].format(
-                    year=year, period=period)
-                config_path = os.path.join(c.WTPH_INPUT_CONF_DIR, config)
-                with open(config_path, "r") as config_file:
-                    text = config_file.read()
-                text = text.replace("mc16", "mc20")
-                with open(config_path, "w") as config_file:
-                    config_file.write(text)
+    return text.replace("mc16", "mc20")
 
 
-def merge_two(config_path_1, config_path_2, output_path):
-    """
-    Merge two input config files, e.g. two data files of the same period.
+# the kinds of line we merge, with the comment heading each in the output
+MERGED_KEYS = [
+    ("Input", "#InputFiles:"),
+    ("GRL", "#Good run Lists to be applied:"),
+    ("PRWDataFile", "#Pile-up reweighting lumicalc files:"),
+    ("PRWMCFile", "#Pile-up reweighting config files:"),
+]
+
 
-    Currently this doesn't preserve info from comments, maybe implement later.
+def merge_configs(config_paths):
+    """
+    Merge any number of input config files into one, in a single pass,
+    and return its text.
+
+    Each file is read once. Lines of each kind are kept in the order they
+    are first seen (files in the order given), dropping duplicates, so the
+    same inputs always give the same output. Comments from each file are
+    kept in the header, under the name of the file they came from.
+    Any other settings are kept too, after the merged ones.
     """
+    # {key: {line: None}}, dicts as ordered sets
+    merged = {key: {} for key, _ in MERGED_KEYS}
+    other = {}
+    header = [
+        "############################################",
+        "# This is the result of merging {} files:".format(
+            len(config_paths))]
+    for config_path in config_paths:
+        header.append("# " + config_path)
+        comments = []
+        with open(config_path, "r") as config_file:
+            for line in config_file:
+                line = line.strip()
+                if not line:
+                    continue
+                if line.startswith("#"):
+                    comments.append("#     " + line.lstrip("#").strip())
+                    continue
+                merged.get(line.split()[0], other).setdefault(line)
+        header += comments
+    header.append("############################################")
+
+    new_lines = header
+    for key, heading in MERGED_KEYS:
+        new_lines += [heading] + list(merged[key])
+    if other:
+        new_lines += ["#Other settings:"] + list(other)
+    return "\n".join(new_lines) + "\n"
+
+
+def merge(config_filenames):
+    """
+    Merge a list of input configs (filenames in WTPH_INPUT_CONF_DIR),
+    return the text of the result.
 
-    # get lines from files
-    with open(config_path_1, "r") as conf1:
-        conf1_lines = conf1.readlines()
-    with open(config_path_2, "r") as conf2:
-        conf2_lines = conf2.readlines()
-    lines = conf1_lines + conf2_lines
+    They're merged in sorted order, so the result doesn't depend on the
+    order os.listdir happened to give them in.
+    """
+    if len(config_filenames) < 2:
+        raise ValueError("Why are you trying to merge this list?")
+    return merge_configs(
+        [os.path.join(c.WTPH_INPUT_CONF_DIR, filename)
+         for filename in sorted(config_filenames)])
 
-    # get all lines of each type, as sets so they're unique
-    inputfiles = list({l for l in lines if l.split()[0] == "Input"})
-    grls = list({l for l in lines if l.split()[0] == "GRL"})
-    prw_data = list({l for l in lines if l.split()[0] == "PRWDataFile"})
-    prw_mc = list({l for l in lines if l.split()[0] == "PRWMCFile"})
 
-    new_lines = [
-        "############################################",
-        "# This is the result of merging two files:",
-        "# " + config_path_1,
-        "# " + config_path_2,
-        "############################################",
-        "#InputFiles:"] + inputfiles +\
-        ["#Good run Lists to be applied:"] + grls +\
-        ["#Pile-up reweighting lumicalc files:"] + prw_data +\
-        ["#Pile-up reweighting config files:"] + prw_mc
+def formatted_filenames():
+    """Names of every config format_input_configs makes."""
+    return {c.WTPH_INPUT_CONF_FMT[data_mc].format(year=year, period=period)
+            for year in c.YEARS for period in RUN_NUMBERS[year]
+            for data_mc in ["data", "mc"]}
 
-    with open(output_path, "w") as outfile:
-        outfile.writelines(new_lines)
-    print("wrote", output_path)
 
+def format_input_config(source_configs, filename, period_prefix,
+                        year_prefix):
+    """
+    Make the config for one period (filename) from the source configs
+    starting with period_prefix (copied if there's one, merged if there are
+    more) or else the one starting with year_prefix.
 
-def merge(config_filenames, output_path):
-    """Merge a list of input configs."""
-    if len(config_filenames) < 2:
-        raise ValueError("Why are you trying to merge this list?")
-    elif len(config_filenames) == 2:
-        merge_two(
-            os.path.join(c.WTPH_INPUT_CONF_DIR, config_filenames[0]),
-            os.path.join(c.WTPH_INPUT_CONF_DIR, config_filenames[1]),
-            output_path)
+    It's only written if that gives something different from what's there,
+    e.g. when source configs have been added or changed since last time.
+    Returns whether it was (re)written.
+    """
+    filepath = os.path.join(c.WTPH_INPUT_CONF_DIR, filename)
+    # try looking for files with year_period_
+    matches = [f for f in source_configs if f.startswith(period_prefix)]
+    if len(matches) > 1:
+        # merge all the configs for that period into one
+        text = merge(matches)
     else:
-        merge(
-            [merge(*config_filenames[0:2])] + config_filenames[2:],
-            output_path)
+        if matches == []:
+            # try looking for a config for the whole year
+            matches = [f for f in source_configs
+                       if f.startswith(year_prefix)]
+            assert len(matches) == 1
+        with open(os.path.join(c.WTPH_INPUT_CONF_DIR, matches[0]),
+                  "r") as config_file:
+            text = config_file.read()
+    changed = write_if_changed(filepath, replace_16_20(text))
+    if changed:
+        print("wrote", filepath)
+    return changed
 
 
 def format_input_configs():
-    """Ensure that a config exists for data or MC for all years and periods."""
-    input_configs = os.listdir(c.WTPH_INPUT_CONF_DIR)
+    """
+    Ensure that an up-to-date config exists for data or MC for all years
+    and periods.
+
+    Configs already there from last time are only rewritten if their
+    sources have changed, so this is safe to run every time.
+    Returns the names of the configs that were (re)written.
+    """
+    # we will never have source files with these exact names
+    formatted = formatted_filenames()
+    source_configs = [f for f in os.listdir(c.WTPH_INPUT_CONF_DIR)
+                      if f not in formatted]
+    made = []
     for year in c.YEARS:
         for period in RUN_NUMBERS[year]:
             # first deal with data files
             data_filename = c.WTPH_INPUT_CONF_FMT["data"].format(
                 year=year, period=period)
-            data_filepath = os.path.join(c.WTPH_INPUT_CONF_DIR, data_filename)
-            # we will never have files with this exact format auto-generated
-            if os.path.exists(data_filepath):
-                os.remove(data_filepath)
-            if data_filename not in input_configs:
-                # try looking for a single file with year_period_
-                data_matches = [
-                    f for f in input_configs
-                    if f.startswith("data_{year}_{period}".format(
-                        year=year, period=period))]
-                if data_matches == []:
-                    # try looking for AllYear config
-                    data_matches = [
-                        f for f in input_configs
-                        if f.startswith("data_{year}_AllYear".format(
-                            year=year))]
-                    assert len(data_matches) == 1
-                    filepath = os.path.join(
-                        c.WTPH_INPUT_CONF_DIR, data_matches[0])
-                    shutil.copyfile(
-                        filepath,
-                        data_filepath)
-                elif len(data_matches) == 1:
-                    # if we found a single year_period file:
-                    filepath = os.path.join(
-                        c.WTPH_INPUT_CONF_DIR, data_matches[0])
-                    shutil.copyfile(
-                        filepath,
-                        data_filepath)
-                else:
-                    # merge multiple year_period files
-                    data_matches = [
-                        f for f in input_configs
-                        if f.startswith("data_{year}_{period}".format(
-                            year=year, period=period))]
-                    # merge all the configs for that period into one
-                    merge(data_matches, data_filepath)
+            if format_input_config(
+                    source_configs, data_filename,
+                    "data_{year}_{period}".format(year=year, period=period),
+                    "data_{year}_AllYear".format(year=year)):
+                made.append(data_filename)
 
             # same vibe with mc things
             mc_filename = c.WTPH_INPUT_CONF_FMT["mc"].format(
                 year=year, period=period)
-            mc_filepath = os.path.join(c.WTPH_INPUT_CONF_DIR, mc_filename)
-            # we will never have files with this exact format auto-generated
-            if os.path.exists(mc_filepath):
-                os.remove(mc_filepath)
-            if mc_filename not in input_configs:
-                # try looking for a single file with year_period_
-                mc_matches = [
-                    f for f in input_configs
-                    if f.startswith("{year}_{period}_Zmumu".format(
-                        year=year, period=period))]
-                if mc_matches == []:
-                    # try looking a year-long config
-                    mc_matches = [
-                        f for f in input_configs
-                        if f.startswith("{year}_Zmumu".format(
-                            year=year))]
-                    assert len(mc_matches) == 1
-                    filepath = os.path.join(
-                        c.WTPH_INPUT_CONF_DIR, mc_matches[0])
-                    shutil.copyfile(
-                        filepath,
-                        mc_filepath)
-                elif len(mc_matches) == 1:
-                    # if we found a single year_period file:
-                    filepath = os.path.join(
-                        c.WTPH_INPUT_CONF_DIR, mc_matches[0])
-                    shutil.copyfile(
-                        filepath,
-                        mc_filepath)
-                else:
-                    # merge multiple year_period files
-                    mc_matches = [
-                        f for f in input_configs
-                        if f.startswith("{year}_{period}_Zmumu".format(
-                            year=year, period=period))]
-                    # merge all the configs for that period into one
-                    merge(mc_matches, mc_filepath)
+            if format_input_config(
+                    source_configs, mc_filename,
+                    "{year}_{period}_Zmumu".format(year=year, period=period),
+                    "{year}_Zmumu".format(year=year)):
+                made.append(mc_filename)
 
     check_formatted()
-    replace_16_20()
-
+    return made